@@ -30,13 +30,15 @@ gcloud beta scheduler jobs create pubsub \
     --attributes="form_type=254" \
     --quiet
 
-# Deploy function to download files
+# Deploy function to download files. It is retried until it succeeds, so a failed chunk is downloaded again and the
+# run's completion count still reaches its total (see `StorageCompletionTracker`).
 gcloud functions deploy \
     download-netfile-filing \
     --runtime=python37 \
     --memory=256MB \
     --entry-point=download_netfile_filing \
     --trigger-topic=download-netfile-filing \
+    --retry \
     --timeout=120
 
 # Deploy function to transform and load the files
@@ -46,4 +48,17 @@ gcloud functions deploy \
     --memory=256MB \
     --entry-point=process_netfile_filings \
     --trigger-topic=process-netfile-filings \
+    --retry \
+    --set-env-vars=PIPELINE_MEMORY_BUDGET_MB=192 \
+    --timeout=300
+
+# Deploy function to transform a shard of the files, when a run is processed in parallel shards
+gcloud functions deploy \
+    process-netfile-shard \
+    --runtime=python37 \
+    --memory=256MB \
+    --entry-point=process_netfile_shard \
+    --trigger-topic=process-netfile-shard \
+    --retry \
+    --set-env-vars=PIPELINE_MEMORY_BUDGET_MB=192 \
     --timeout=300
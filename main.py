@@ -1,115 +1,369 @@
+import base64
 import datetime
+import json
 import logging
-import re
+import os
+import time
+from typing import Any, Iterator, List, Optional, Tuple
 
-from google.cloud import pubsub_v1, storage
+from pipeline.clients import get_bucket, get_publisher_client
+from pipeline.memory import MemoryGovernor
+from pipeline.metrics import flush_metrics
+from pipeline.profiling import profile_if_enabled
+from pipeline.settings import BUCKET_NAME, DOWNLOAD_CHUNK_SIZE, PROJECT_ID
+from pipeline.storage import DEFAULT_STORAGE_FORMAT, get_filing_store
 
-from pipeline.bigquery import is_connected, refresh_model_data
-from pipeline.netfile.client import download_filing, get_filing_ids
-from pipeline.netfile.models import build_tables, destroy_database, export_data_to_csv
-from pipeline.netfile.parsers import parse_filing
+# NOTE: Set the PIPELINE_PROFILE environment variable of a function to `cprofile` or `sample` to profile its
+# invocations. Profiles are uploaded to the bucket's `profiles` directory, and their hot spots are logged.
+
+# NOTE: Each function only imports the modules it needs, inside the function body. This keeps cold starts short,
+# especially for `download_netfile_filing`, which does not need peewee, dateutil, or the BigQuery client.
 
-PROJECT_ID = 'openoakland'
-BUCKET_NAME = 'form-700-filings'
-XML_DIRECTORY_NAME = 'xml'
 FILING_MANIFEST_FILENAME = 'filings.txt'
+RUN_METADATA_FILENAME = 'run.json'
+SHARD_DIRECTORY_NAME = 'shards'
+SHARD_DATABASE = '/tmp/shard.db'
+DOWNLOAD_WORKERS = 8
+PREFETCH_WORKERS = 8
+PREFETCH_DEPTH = 16
+# Leave enough of the 300 second timeout of `process-netfile-filings` to save a checkpoint or export the data.
+PROCESSING_TIME_BUDGET = 180
+# Functions deployed with `--retry` are retried until they succeed, for up to 7 days. Events older than this many
+# seconds are dropped instead, so a message that keeps failing does not keep the function busy.
+MAX_EVENT_AGE = 60 * 60
 
 logger = logging.getLogger(__name__)
 
+_completion_tracker: Any = None
+
+
+def _upload_profile(path: str) -> None:
+    blob = get_bucket(BUCKET_NAME).blob(f'profiles/{os.path.basename(path)}')
+    blob.upload_from_filename(path, content_type='application/octet-stream')
+    os.remove(path)
+    logger.info(f'Uploaded the profile to gs://{BUCKET_NAME}/{blob.name}.')
+
+
+def _is_expired(context) -> bool:
+    """ Returns whether the event is older than `MAX_EVENT_AGE`. Events without a context, e.g. in the harness, never
+    expire. """
+    if context is None:
+        return False
+
+    from dateutil.parser import isoparse
+    age = datetime.datetime.now(datetime.timezone.utc) - isoparse(context.timestamp)
+    if age.total_seconds() <= MAX_EVENT_AGE:
+        return False
+
+    logger.error(f'Dropping event {context.event_id} of {context.timestamp}, which is too old to retry.')
+    return True
+
+
+def _chunk(items: List[str], size: int) -> List[List[str]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
 
+@flush_metrics
+@profile_if_enabled(upload=_upload_profile)
 def download_all_filings(data: dict, context) -> None:  # pylint: disable=unused-argument
-    """ Trigger a download of all Netfile filings of a given type. """
+    """ Trigger a download of all Netfile filings of a given type.
+
+    Filing IDs are published in chunks of `chunk_size` (an optional message attribute), so each download invocation
+    handles a whole chunk. The optional `storage_format` attribute selects how the filings are stored (see
+    `pipeline.storage`), and the optional `shards` attribute sets the number of parallel processing shards.
+    """
+    from pipeline.netfile.client import get_filing_ids
+
     parent_directory = datetime.datetime.now().isoformat()
     topic_name = 'download-netfile-filing'
     attributes = data['attributes']
     form_type = attributes['form_type']
+    chunk_size = int(attributes.get('chunk_size', DOWNLOAD_CHUNK_SIZE))
+    storage_format = attributes.get('storage_format', DEFAULT_STORAGE_FORMAT)
+    shards = int(attributes.get('shards', 1))
 
-    publisher = pubsub_v1.PublisherClient()
+    publisher = get_publisher_client()
     topic_path = publisher.topic_path(PROJECT_ID, topic_name)  # pylint: disable=no-member
 
-    filing_ids = get_filing_ids(form_type)
+    filing_ids = sorted(get_filing_ids(form_type))
+    chunks = _chunk(filing_ids, chunk_size)
 
     # Store a list of the filing IDs
-    storage_client = storage.Client()
-    bucket = storage_client.get_bucket(BUCKET_NAME)
+    bucket = get_bucket(BUCKET_NAME)
     blob = bucket.blob(f'{parent_directory}/{FILING_MANIFEST_FILENAME}')
     blob.upload_from_string('\n'.join(filing_ids), content_type='text/plain')
+    blob = bucket.blob(f'{parent_directory}/{RUN_METADATA_FILENAME}')
+    metadata = {'storage_format': storage_format, 'shards': shards}
+    blob.upload_from_string(json.dumps(metadata), content_type='application/json')
+    _get_completion_tracker().start(parent_directory, len(chunks))
 
-    for filing_id in filing_ids:
-        publisher.publish(topic_path, data=''.encode('utf-8'), filing_id=filing_id, parent_directory=parent_directory)
+    futures = [
+        publisher.publish(
+            topic_path,
+            data='\n'.join(chunk).encode('utf8'),
+            chunk=str(index),
+            parent_directory=parent_directory,
+            storage_format=storage_format
+        )
+        for index, chunk in enumerate(chunks)
+    ]
 
+    # Wait for the batches to be sent. Publishing errors are raised here rather than silently dropped.
+    for future in futures:
+        future.result()
+
+    logger.info(f'Published {len(filing_ids)} filings in {len(chunks)} chunks.')
+
+
+def _publish_processing(directory: str, **attributes: str) -> None:
+    publisher = get_publisher_client()
+    topic_path = publisher.topic_path(PROJECT_ID, 'process-netfile-filings')  # pylint: disable=no-member
+    publisher.publish(topic_path, b'', directory=directory, **attributes).result()
+
+
+def _get_completion_tracker():
+    """ Returns the completion tracker of the bucket. Like the clients, it is reused across warm invocations, so it
+    only reads the expected count of each run once. """
+    global _completion_tracker  # pylint: disable=global-statement
+    bucket = get_bucket(BUCKET_NAME)
+    # A new tracker is needed when a different bucket is registered, e.g. by the harness.
+    if _completion_tracker is None or _completion_tracker.bucket is not bucket:
+        from pipeline.completion import StorageCompletionTracker
+        _completion_tracker = StorageCompletionTracker(bucket)
+    return _completion_tracker
 
-def trigger_processing(storage_client: storage.Client, parent_directory: str):
-    bucket = storage_client.get_bucket(BUCKET_NAME)
-    blob = bucket.blob(f'{parent_directory}/{FILING_MANIFEST_FILENAME}')
-    manifest_file = blob.download_as_string().decode('utf8')
-    expected_count = len(manifest_file.split('\n'))
-
-    actual_count = 0
-    blobs = storage_client.list_blobs(BUCKET_NAME, prefix=f'{parent_directory}/{XML_DIRECTORY_NAME}/')
-    for _ in blobs:
-        actual_count += 1
-
-    if actual_count == expected_count:
-        logger.info('All %d files downloaded. Starting processing.', actual_count)
-        publisher = pubsub_v1.PublisherClient()
-        topic_path = publisher.topic_path(PROJECT_ID, 'process-netfile-filings')  # pylint: disable=no-member
-        publisher.publish(topic_path, b'', directory=parent_directory)
-    else:
-        logger.debug('Only %d of %d filings downloaded. Waiting to start processing.', actual_count, expected_count)
 
+def trigger_processing(parent_directory: str, item_id: str) -> None:
+    """ Records the completion of an item, and triggers processing if it was the last item of the run. """
+    if not _get_completion_tracker().mark_complete(parent_directory, item_id):
+        return
+
+    logger.info('All files downloaded. Starting processing.')
+    _publish_processing(parent_directory)
+
+
+@flush_metrics
+@profile_if_enabled(upload=_upload_profile)
+def download_netfile_filing(data: dict, context) -> None:
+    """ Download a chunk of Netfile filings. """
+    from pipeline.concurrency import bounded_map
+    from pipeline.netfile.client import download_filing
+    from pipeline.netfile.errors import DownloadError
+
+    if _is_expired(context):
+        return
 
-def download_netfile_filing(data: dict, context) -> None:  # pylint: disable=unused-argument
-    """ Download an individual Netfile filing. """
     attributes = data['attributes']
-    filing_id = attributes['filing_id']
+    chunk = attributes['chunk']
     parent_directory = attributes['parent_directory']
-    filename = f'{filing_id}.xml'
+    storage_format = attributes.get('storage_format', DEFAULT_STORAGE_FORMAT)
+    filing_ids = base64.b64decode(data['data']).decode('utf8').split()
 
-    content = download_filing(filing_id)
+    def download(filing_id: str) -> Optional[Tuple[str, str]]:
+        try:
+            return filing_id, download_filing(filing_id)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception(f'Failed to download filing {filing_id}!')
+            return None
 
-    storage_client = storage.Client()
-    bucket = storage_client.get_bucket(BUCKET_NAME)
-    blob = bucket.blob(f'{parent_directory}/{XML_DIRECTORY_NAME}/{filename}')
-    blob.upload_from_string(content, content_type='text/xml')
+    results = list(bounded_map(download, filing_ids, DOWNLOAD_WORKERS))
+    filings = [result for result in results if result]
+    failure_count = len(results) - len(filings)
+    if failure_count:
+        # Raise so the chunk is retried. The chunk is written again in full when it succeeds.
+        raise DownloadError(f'Failed to download {failure_count} of {len(filing_ids)} filings in chunk {chunk}!')
 
-    trigger_processing(storage_client, parent_directory)
+    store = get_filing_store(storage_format, get_bucket(BUCKET_NAME), parent_directory)
+    store.write(chunk, filings)
 
+    trigger_processing(parent_directory, chunk)
 
-def process_netfile_filings(data: dict, context) -> None:  # pylint: disable=unused-argument
-    """ Process all filings in a given directory. """
-    attributes = data['attributes']
-    directory = attributes['directory']
-    xml_directory = f'{directory}/{XML_DIRECTORY_NAME}'
 
-    # Ensure we can connect to the data warehouse
-    is_connected()
+def _get_run_metadata(directory: str) -> dict:
+    # NOTE: Runs started before the metadata file was introduced stored individual XML files, and were not sharded.
+    metadata = {'storage_format': DEFAULT_STORAGE_FORMAT, 'shards': 1}
+    blob = get_bucket(BUCKET_NAME).get_blob(f'{directory}/{RUN_METADATA_FILENAME}')
+    if blob is not None:
+        metadata.update(json.loads(blob.download_as_string().decode('utf8')))
+    return metadata
 
-    # Setup the intermediary database
-    destroy_database()
-    build_tables()
 
-    # Read the files
-    storage_client = storage.Client()
-    blobs = storage_client.list_blobs(BUCKET_NAME, prefix=f'{xml_directory}/')
-    for blob in blobs:
-        match = re.search(rf'{xml_directory}/(\d+)\.xml', blob.name)
-        if not match:
-            logger.warning(f'File name "{blob.name}" does not match the expected format')
-            continue
-
-        filing_id = match.group(1)
-        content = blob.download_as_string().decode('utf8')
-        parse_filing(filing_id, content)
-
-    # Export the data to the data warehouse
-    for model, export in export_data_to_csv():
+def _export_data(directory: str, governor: MemoryGovernor) -> None:
+    """ Export the data in the intermediary database to the data warehouse.
+
+    Tables are exported one at a time. Each export is spilled to a temporary file once it outgrows the memory that the
+    governor can spare.
+    """
+    from pipeline.bigquery import refresh_model_data
+    from pipeline.netfile.models import iter_csv_exports
+
+    bucket = get_bucket(BUCKET_NAME)
+    for model, export in iter_csv_exports(governor.spool_size):
         try:
             # Backup the CSVs in case we need them later
-            bucket = storage_client.get_bucket(BUCKET_NAME)
             blob = bucket.blob(f'{directory}/csv/{model.__name__}.csv')
             blob.upload_from_file(export, rewind=True, content_type='text/csv')
 
             refresh_model_data(model, export)
         except Exception:  # pylint: disable=broad-except
             logger.exception(f'Failed to upload data for #{model} to BigQuery')
+
+
+@flush_metrics
+@profile_if_enabled(upload=_upload_profile)
+def process_netfile_filings(data: dict, context) -> None:
+    """ Process all filings in a given directory.
+
+    Processing is bounded by a time budget (`time_budget`, an optional message attribute, in seconds). If the budget
+    runs out before every filing has been parsed, the intermediary database and a cursor are saved to the bucket as a
+    checkpoint, and the function re-publishes itself with the checkpoint's `sequence` number to continue from there.
+    The data is exported once the last filing has been parsed.
+
+    If the run is configured with several `shards`, the filings are instead partitioned across that many invocations
+    of `process_netfile_shard`, which run in parallel.
+    """
+    from pipeline.bigquery import is_connected
+    from pipeline.checkpoints import ProcessingCheckpoint, StaleCheckpointError
+    from pipeline.concurrency import bounded_map
+    from pipeline.netfile.models import DATABASE, build_tables, close_connection, destroy_database
+    from pipeline.netfile.parsers import parse_filing
+
+    if _is_expired(context):
+        return
+
+    attributes = data['attributes']
+    directory = attributes['directory']
+    sequence = int(attributes.get('sequence', 0))
+    deadline = time.monotonic() + float(attributes.get('time_budget', PROCESSING_TIME_BUDGET))
+    bucket = get_bucket(BUCKET_NAME)
+    checkpoint = ProcessingCheckpoint(bucket, directory)
+    metadata = _get_run_metadata(directory)
+
+    shard_count = int(attributes.get('shards', metadata['shards']))
+    if shard_count > 1 and not sequence:
+        _start_shards(directory, shard_count)
+        return
+
+    # Ensure we can connect to the data warehouse
+    is_connected()
+
+    # Setup the intermediary database, or restore it from the previous checkpoint
+    destroy_database()
+    cursor = None
+    if sequence:
+        try:
+            cursor = checkpoint.restore(sequence, DATABASE)
+        except StaleCheckpointError:
+            logger.warning(f'Ignoring duplicate request to process checkpoint {sequence} of {directory}.')
+            return
+    else:
+        checkpoint.start()
+    build_tables()
+
+    # Read the files. Blobs are downloaded by a pool of threads, ahead of the parser, so parsing overlaps with network
+    # reads. At most `PREFETCH_DEPTH` blobs are held in memory at once, and fewer while memory is over budget.
+    with MemoryGovernor.from_environment('process_netfile_filings') as governor:
+        store = get_filing_store(metadata['storage_format'], bucket, directory)
+        reader = bounded_map(lambda blob: (blob.name, store.read(blob)), store.list_blobs(start_after=cursor),
+                             PREFETCH_WORKERS, max_pending=PREFETCH_DEPTH, throttle=governor.over_budget)
+        for blob_name, filings in reader:
+            for filing_id, content in filings:
+                parse_filing(filing_id, content)
+
+            cursor = blob_name
+            if time.monotonic() >= deadline:
+                break
+        else:
+            _export_data(directory, governor)
+            return
+
+        # We ran out of time. Save our progress, and continue in a new invocation.
+        reader.close()
+        close_connection()
+        try:
+            checkpoint.save(sequence + 1, cursor, DATABASE)
+        except StaleCheckpointError:
+            logger.warning(f'Another invocation already saved checkpoint {sequence + 1} of {directory}. Stopping.')
+            return
+
+    _publish_processing(directory, sequence=str(sequence + 1))
+
+
+def _start_shards(directory: str, shard_count: int) -> None:
+    publisher = get_publisher_client()
+    topic_path = publisher.topic_path(PROJECT_ID, 'process-netfile-shard')  # pylint: disable=no-member
+
+    _get_completion_tracker().start(f'{directory}/{SHARD_DIRECTORY_NAME}', shard_count)
+    futures = [
+        publisher.publish(topic_path, b'', directory=directory, shard=str(shard), shard_count=str(shard_count))
+        for shard in range(shard_count)
+    ]
+    for future in futures:
+        future.result()
+
+    logger.info(f'Started processing {directory} in {shard_count} shards.')
+
+
+def _download_shards(directory: str, shard_count: int) -> Iterator[str]:
+    """ Downloads each shard database in turn, so only one is stored in the (in-memory) /tmp directory at once. """
+    bucket = get_bucket(BUCKET_NAME)
+    for shard in range(shard_count):
+        bucket.blob(f'{directory}/{SHARD_DIRECTORY_NAME}/{shard}.db').download_to_filename(SHARD_DATABASE)
+        yield SHARD_DATABASE
+        os.remove(SHARD_DATABASE)
+
+
+@flush_metrics
+@profile_if_enabled(upload=_upload_profile)
+def process_netfile_shard(data: dict, context) -> None:
+    """ Process the filings in one shard of a directory.
+
+    Filings are assigned to shards by a hash of their ID. Each shard is parsed into its own database, which is saved to
+    the bucket. The invocation that completes the last shard merges the shard databases and exports the data.
+    """
+    # pylint: disable=too-many-locals
+    from pipeline.bigquery import is_connected
+    from pipeline.concurrency import bounded_map
+    from pipeline.netfile.models import DATABASE, build_tables, close_connection, destroy_database, use_database
+    from pipeline.netfile.parsers import parse_filing
+    from pipeline.netfile.shards import get_shard, merge_databases
+
+    if _is_expired(context):
+        return
+
+    attributes = data['attributes']
+    directory = attributes['directory']
+    shard = int(attributes['shard'])
+    shard_count = int(attributes['shard_count'])
+    bucket = get_bucket(BUCKET_NAME)
+
+    with MemoryGovernor.from_environment('process_netfile_shard') as governor:
+        # Amendments may reference filings in other shards, so foreign keys are only checked after the merge.
+        use_database(SHARD_DATABASE, enforce_foreign_keys=False)
+        try:
+            destroy_database()
+            build_tables()
+
+            store = get_filing_store(_get_run_metadata(directory)['storage_format'], bucket, directory)
+            blobs = (blob for blob in store.list_blobs() if get_shard(store.shard_key(blob), shard_count) == shard)
+            for filings in bounded_map(store.read, blobs, PREFETCH_WORKERS, max_pending=PREFETCH_DEPTH,
+                                       throttle=governor.over_budget):
+                for filing_id, content in filings:
+                    parse_filing(filing_id, content)
+
+            close_connection()
+            blob = bucket.blob(f'{directory}/{SHARD_DIRECTORY_NAME}/{shard}.db')
+            blob.upload_from_filename(SHARD_DATABASE, content_type='application/x-sqlite3')
+            destroy_database()
+        finally:
+            use_database(DATABASE)
+
+        if not _get_completion_tracker().mark_complete(f'{directory}/{SHARD_DIRECTORY_NAME}', str(shard)):
+            return
+
+        logger.info(f'All {shard_count} shards processed. Merging the shards.')
+        is_connected()
+        destroy_database()
+        build_tables()
+        merge_databases(_download_shards(directory, shard_count))
+        _export_data(directory, governor)
@@ -0,0 +1,294 @@
+"""
+This file contains a benchmark suite for the ingest path: the cleaners, parsing, CSV export,
+and the BigQuery load (against a local stand-in). Benchmarks run against a synthetic corpus,
+so results are reproducible and comparable between changes.
+"""
+import logging
+import os
+import re
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .clients import register_client
+from .netfile import utils
+from .netfile.models import DATABASE, build_tables, db, destroy_database, export_data_to_csv, use_database
+from .netfile.parsers import parse_filing
+from .netfile.queries import record_queries
+from .netfile.synthetic import SyntheticFilingGenerator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FILING_COUNT = 100
+
+# The fixed workload of the performance regression test, and the stages it checks. The cleaners run too briefly to
+# be timed reliably on their own, and are covered by the parsing stage.
+REGRESSION_FILING_COUNT = 30
+REGRESSION_REPEAT = 5
+REGRESSION_STAGES = ('parse_filing', 'export_data_to_csv', 'refresh_model_data')
+
+# Metrics compared with the baseline, and whether higher values are better
+BASELINE_METRICS: Dict[str, bool] = {
+    'filings_per_second': True,
+    'statements': False,
+    'peak_memory': False,
+}
+# Metrics that do not depend on the speed or load of the machine, which the regression test checks by default
+DETERMINISTIC_METRICS = ('statements', 'peak_memory')
+
+# Largest relative change of each metric, in the wrong direction, that is not a regression
+DEFAULT_TOLERANCES: Dict[str, float] = {
+    'filings_per_second': 0.5,
+    'statements': 0.1,
+    'peak_memory': 0.25,
+}
+# Smallest absolute change of each metric that can be a regression. The peak memory of a small stage varies by some
+# tens of kilobytes between Python and client library versions.
+MINIMUM_REGRESSIONS: Dict[str, float] = {
+    'peak_memory': 128 * 1024,
+}
+DECIMAL_PATTERN = re.compile(r'^-?\d+(\.\d+)?$')
+# Date elements that the parsers clean. Filings have other date elements, which are never cleaned.
+DATE_ELEMENTS = ('assuming_date', 'date_acquired', 'date_disposed', 'date_signed', 'election_date', 'end_date',
+                 'leaving_date', 'start_date')
+
+
+class BenchmarkResult(NamedTuple):
+    stage: str
+    seconds: float
+    filings: int
+    rows: int
+    statements: Optional[int]
+    peak_rss: int  # bytes
+    peak_memory: Optional[int] = None  # bytes allocated by Python at the peak of the stage, if traced
+
+    @property
+    def filings_per_second(self) -> float:
+        return self.filings / self.seconds if self.seconds else 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+class Comparison(NamedTuple):
+    stage: str
+    metric: str
+    baseline: float
+    current: float
+    tolerance: float
+    higher_is_better: bool
+    minimum_regression: float = 0
+
+    @property
+    def change(self) -> float:
+        """ Relative change from the baseline, e.g. 0.1 for a 10% increase. """
+        return (self.current - self.baseline) / self.baseline if self.baseline else 0.0
+
+    @property
+    def regressed(self) -> bool:
+        change = -self.change if self.higher_is_better else self.change
+        return change > self.tolerance and abs(self.current - self.baseline) >= self.minimum_regression
+
+
+def get_peak_rss() -> int:
+    """ Returns the peak resident set size of this process, in bytes. """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, while macOS reports bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _measure(func: Callable[[], Any], trace_memory: bool = False) -> Tuple[float, Optional[int]]:
+    """ Runs the function, and returns its duration in seconds and, if traced, its peak memory allocation in bytes.
+
+    Tracing memory slows down Python considerably, so durations measured while tracing should not be compared with
+    others.
+    """
+    if trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    try:
+        func()
+        seconds = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return seconds, peak_memory
+
+
+def _count_rows() -> int:
+    tables = db.get_tables()
+    return sum(db.execute_sql(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables)
+
+
+def _get_cleaner_inputs(filings: Sequence[Tuple[str, str]]) -> Dict[str, List[str]]:
+    inputs: Dict[str, List[str]] = {'clean_string': [], 'clean_datetime': [], 'clean_boolean': [], 'clean_decimal': []}
+    for _, content in filings:
+        for element in ET.fromstring(content).iter():
+            text = element.text
+            if text is None or not text.strip():
+                continue
+
+            inputs['clean_string'].append(text)
+            if element.tag.startswith(('is_', 'has_', 'made_')):
+                inputs['clean_boolean'].append(text)
+            elif element.tag in DATE_ELEMENTS:
+                inputs['clean_datetime'].append(text)
+            elif element.tag in ('amount', 'interest_rate') and DECIMAL_PATTERN.match(text.strip()):
+                # Some schedules report amounts as ranges (choices), rather than decimals.
+                inputs['clean_decimal'].append(text.strip())
+    return inputs
+
+
+def benchmark_cleaners(filings: Sequence[Tuple[str, str]], trace_memory: bool = False) -> List[BenchmarkResult]:
+    results = []
+    for name, values in _get_cleaner_inputs(filings).items():
+        cleaner = getattr(utils, name)
+        # pylint: disable=cell-var-from-loop
+        seconds, peak_memory = _measure(lambda: [cleaner(value) for value in values], trace_memory)
+        results.append(BenchmarkResult(name, seconds, len(filings), len(values), None, get_peak_rss(), peak_memory))
+    return results
+
+
+def benchmark_parse(filings: Sequence[Tuple[str, str]], trace_memory: bool = False) -> BenchmarkResult:
+    """ Parses the filings into a new, empty database. """
+    destroy_database()
+    build_tables()
+
+    with record_queries() as queries:
+        seconds, peak_memory = _measure(
+            lambda: [parse_filing(filing_id, content) for filing_id, content in filings], trace_memory
+        )
+
+    return BenchmarkResult('parse_filing', seconds, len(filings), _count_rows(), queries.count(), get_peak_rss(),
+                           peak_memory)
+
+
+def benchmark_export(filing_count: int, trace_memory: bool = False) -> Tuple[BenchmarkResult, List]:
+    rows = _count_rows()
+    exports: List = []
+    seconds, peak_memory = _measure(lambda: exports.extend(export_data_to_csv()), trace_memory)
+    result = BenchmarkResult('export_data_to_csv', seconds, filing_count, rows, None, get_peak_rss(), peak_memory)
+    return result, exports
+
+
+def benchmark_refresh(filing_count: int, exports: List, trace_memory: bool = False) -> BenchmarkResult:
+    # The BigQuery client library is slow to import, and only needed by this benchmark.
+    from .bigquery import refresh_model_data
+    from .local_cloud import LocalBigQueryClient
+
+    def refresh() -> None:
+        for model, export in exports:
+            refresh_model_data(model, export)
+
+    client = LocalBigQueryClient()
+    previous = register_client('bigquery', client)
+    try:
+        seconds, peak_memory = _measure(refresh, trace_memory)
+    finally:
+        register_client('bigquery', previous)
+
+    rows = sum(client.tables.values())
+    return BenchmarkResult('refresh_model_data', seconds, filing_count, rows, None, get_peak_rss(), peak_memory)
+
+
+def run_benchmarks(filing_count: int = DEFAULT_FILING_COUNT, schedule_counts: Optional[Dict[str, int]] = None,
+                   seed: int = 0, trace_memory: bool = False) -> List[BenchmarkResult]:
+    """ Runs every benchmark against a synthetic corpus, using a temporary database.
+
+    If `trace_memory` is True, the peak memory allocated by each stage is traced, at the cost of slower stages.
+    """
+    generator = SyntheticFilingGenerator(seed=seed)
+    filings = list(generator.generate_corpus(filing_count, schedule_counts))
+    results = benchmark_cleaners(filings, trace_memory)
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_database(os.path.join(directory, 'benchmark.db'))
+        try:
+            results.append(benchmark_parse(filings, trace_memory))
+            export_result, exports = benchmark_export(filing_count, trace_memory)
+            results.append(export_result)
+            results.append(benchmark_refresh(filing_count, exports, trace_memory))
+        finally:
+            use_database(DATABASE)
+
+    return results
+
+
+def format_results(results: Sequence[BenchmarkResult]) -> str:
+    lines = [f'{"stage":<20} {"seconds":>9} {"filings/s":>11} {"rows/s":>12} {"statements":>11} {"peak RSS MB":>12}']
+    for result in results:
+        statements = '' if result.statements is None else str(result.statements)
+        lines.append(
+            f'{result.stage:<20} {result.seconds:>9.3f} {result.filings_per_second:>11.1f} '
+            f'{result.rows_per_second:>12.1f} {statements:>11} {result.peak_rss / 2 ** 20:>12.1f}'
+        )
+    return '\n'.join(lines)
+
+
+def run_regression_workload(repeat: int = REGRESSION_REPEAT) -> List[BenchmarkResult]:
+    """ Runs the fixed workload of the performance regression test.
+
+    The workload is timed `repeat` times, and the fastest time of each stage is kept to reduce noise. Memory is traced
+    in a separate run, since tracing slows the stages down.
+    """
+    # Per-filing logging would dominate the timings, and depends on how the test runner captures logs
+    logging.disable(logging.INFO)
+    try:
+        runs = [run_benchmarks(REGRESSION_FILING_COUNT) for _ in range(repeat)]
+        traced = {result.stage: result for result in run_benchmarks(REGRESSION_FILING_COUNT, trace_memory=True)}
+    finally:
+        logging.disable(logging.NOTSET)
+
+    results = []
+    for stage_results in zip(*runs):
+        fastest = min(stage_results, key=lambda result: result.seconds)
+        if fastest.stage in REGRESSION_STAGES:
+            results.append(fastest._replace(peak_memory=traced[fastest.stage].peak_memory))
+    return results
+
+
+def get_baseline(results: Sequence[BenchmarkResult]) -> Dict[str, Dict[str, float]]:
+    """ Returns the metrics of the results that are compared with the baseline, by stage. """
+    baseline: Dict[str, Dict[str, float]] = {}
+    for result in results:
+        metrics = {metric: getattr(result, metric) for metric in BASELINE_METRICS}
+        baseline[result.stage] = {metric: round(value, 1) for metric, value in metrics.items() if value is not None}
+    return baseline
+
+
+def compare_to_baseline(results: Sequence[BenchmarkResult], baseline: Dict[str, Dict[str, float]],
+                        tolerances: Optional[Dict[str, float]] = None,
+                        metrics: Sequence[str] = tuple(BASELINE_METRICS)) -> List[Comparison]:
+    """ Compares the given metrics of the results with the baseline. Metrics missing from either side are not
+    compared. """
+    tolerances = dict(DEFAULT_TOLERANCES, **(tolerances or {}))
+    comparisons = []
+    for stage, values in get_baseline(results).items():
+        for metric, current in values.items():
+            expected = baseline.get(stage, {}).get(metric)
+            if metric not in metrics or expected is None or current is None:
+                continue
+            comparisons.append(
+                Comparison(stage, metric, expected, current, tolerances[metric], BASELINE_METRICS[metric],
+                           MINIMUM_REGRESSIONS.get(metric, 0))
+            )
+    return comparisons
+
+
+def format_comparisons(comparisons: Sequence[Comparison]) -> str:
+    lines = [f'{"stage":<20} {"metric":<20} {"baseline":>14} {"current":>14} {"change":>8} {"tolerance":>9}']
+    for comparison in comparisons:
+        flag = '  REGRESSED' if comparison.regressed else ''
+        lines.append(
+            f'{comparison.stage:<20} {comparison.metric:<20} {comparison.baseline:>14.1f} {comparison.current:>14.1f} '
+            f'{comparison.change:>+8.1%} {comparison.tolerance:>9.0%}{flag}'
+        )
+    return '\n'.join(lines)
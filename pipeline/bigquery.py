@@ -1,14 +1,17 @@
 import io
 import logging
-from typing import List, Union
+from typing import IO, List, Union
 
 from google.cloud import bigquery
 from google.cloud.exceptions import GoogleCloudError
 from peewee import Field, Model
 
+from . import metrics
+from .clients import get_bigquery_client
 from .netfile.models import (
-    Form700Filing, Office, ScheduleA1, ScheduleA2, ScheduleB, ScheduleBIncomeSource, ScheduleC1, ScheduleC1IncomeSource,
-    ScheduleC2, ScheduleD, ScheduleDGift, ScheduleE
+    Entity, EntityMention, FilerYearSummary, FilingSummary, Form700Filing, GiftSourceTotal, LatestFiling, Office,
+    ScheduleA1, ScheduleA2, ScheduleB, ScheduleBIncomeSource, ScheduleC1, ScheduleC1IncomeSource, ScheduleC2, ScheduleD,
+    ScheduleDGift, ScheduleE, ValueDistribution
 )
 
 logger = logging.getLogger(__name__)
@@ -18,7 +21,7 @@ DATASET_ID: str = 'ethics'
 
 
 def is_connected() -> bool:
-    client = bigquery.Client()
+    client = get_bigquery_client()
 
     try:
         client.get_service_account_email()
@@ -41,8 +44,8 @@ def _recreate_table(client: bigquery.Client, table_id: str, schema: list) -> Non
     client.create_table(table)
 
 
-def _refresh_table_data(table_id: str, schema: List[bigquery.SchemaField], source_file: Union[io.BytesIO, io.IOBase]):
-    client = bigquery.Client()
+def _refresh_table_data(table_id: str, schema: List[bigquery.SchemaField], source_file: IO[bytes]):
+    client = get_bigquery_client()
     _recreate_table(client, table_id, schema)
 
     logger.info(f'Loading {table_id} data into BigQuery...')
@@ -63,9 +66,12 @@ def _refresh_table_data(table_id: str, schema: List[bigquery.SchemaField], sourc
 
     try:
         # Wait for the loading to complete
-        job.result()
+        with metrics.timer('bigquery_load_seconds', table=table_id):
+            job.result()
+        metrics.observe('bigquery_load_rows', job.output_rows, table=table_id)
         logger.info(f'Loaded {job.output_rows} rows into {DATASET_ID}:{table_id}.')
     except GoogleCloudError as e:
+        metrics.increment('bigquery_load_errors', table=table_id)
         logger.exception(f'Failed to push data to {DATASET_ID}:{table_id}: {e.errors}')
 
 
@@ -109,12 +115,21 @@ def get_table_id_for_model(model: Model) -> str:
         ScheduleD: 'schedule_d_attachments',
         ScheduleDGift: 'schedule_d_gifts',
         ScheduleE: 'schedule_e_attachments',
+        LatestFiling: 'latest_filings',
+        Entity: 'entities',
+        EntityMention: 'entity_mentions',
+        FilingSummary: 'filing_summaries',
+        FilerYearSummary: 'filer_year_summaries',
+        ValueDistribution: 'value_distributions',
+        GiftSourceTotal: 'gift_source_totals',
     }[model]
 
 
-def refresh_model_data(model: Model, data: io.StringIO) -> None:
+def refresh_model_data(model: Model, data: Union[io.StringIO, IO[bytes]]) -> None:
+    """ Replaces the model's table with the given CSV data. Binary files (e.g. from `iter_csv_exports`) are loaded
+    as they are; text buffers are encoded into a copy first. """
     data.seek(0)
-    source_file = _stringio2bytesio(data)
+    source_file = _stringio2bytesio(data) if isinstance(data, io.StringIO) else data
     schema = _get_schema_for_model(model)
     table_id = get_table_id_for_model(model)
     _refresh_table_data(table_id, schema, source_file)
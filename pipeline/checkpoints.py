@@ -0,0 +1,82 @@
+"""
+This file contains code to persist the state of processing between function invocations,
+so a run can be processed in several time-bounded steps instead of a single long one.
+"""
+import json
+import logging
+import uuid
+from typing import Optional
+
+from google.cloud.exceptions import PreconditionFailed
+
+logger = logging.getLogger(__name__)
+
+
+class StaleCheckpointError(Exception):
+    """ Raised when a checkpoint has been superseded, e.g. by a duplicate invocation. """
+
+
+class ProcessingCheckpoint:
+    """ Stores the staging database and a cursor for a run in a bucket.
+
+    Checkpoints are numbered. Each one stores the database as `checkpoint/{sequence}-{token}.db`, and
+    `checkpoint/cursor.json` records the latest sequence, the name of its database, and the name of the last blob that
+    was processed. The cursor is only updated if it has not changed since it was read, so when duplicate invocations
+    race, only one of them continues the run. Each invocation uploads its database under a name of its own, so the
+    database of the winner is never overwritten by one that lost, and is only committed by the cursor.
+    """
+
+    DIRECTORY_NAME = 'checkpoint'
+
+    def __init__(self, bucket, directory: str):
+        self.bucket = bucket
+        self.directory = directory
+        self._generation = 0
+
+    def _path(self, name: str) -> str:
+        return f'{self.directory}/{self.DIRECTORY_NAME}/{name}'
+
+    def start(self) -> None:
+        """ Begins a new sequence of checkpoints, superseding any existing ones. """
+        blob = self.bucket.get_blob(self._path('cursor.json'))
+        self._generation = blob.generation if blob else 0
+
+    def restore(self, sequence: int, database_path: str) -> Optional[str]:
+        """ Downloads the database saved by the given checkpoint.
+
+        Returns:
+            str: The name of the last blob that was processed before the checkpoint was saved.
+
+        Raises:
+            StaleCheckpointError: If the given checkpoint is not the latest one.
+        """
+        blob = self.bucket.get_blob(self._path('cursor.json'))
+        state = json.loads(blob.download_as_string().decode('utf8')) if blob else {}
+        if state.get('sequence') != sequence:
+            raise StaleCheckpointError(f'Checkpoint {sequence} of {self.directory} is not the latest checkpoint.')
+
+        self._generation = blob.generation
+        self.bucket.blob(self._path(state['database'])).download_to_filename(database_path)
+        logger.info(f'Restored checkpoint {sequence} of {self.directory}.')
+        return state['cursor']
+
+    def save(self, sequence: int, cursor: Optional[str], database_path: str) -> None:
+        """ Uploads the database, and advances the cursor to the given checkpoint.
+
+        Raises:
+            StaleCheckpointError: If another invocation saved a checkpoint since this one was started or restored.
+        """
+        database_name = f'{sequence}-{uuid.uuid4().hex}.db'
+        self.bucket.blob(self._path(database_name)).upload_from_filename(
+            database_path, content_type='application/x-sqlite3'
+        )
+
+        state = json.dumps({'sequence': sequence, 'database': database_name, 'cursor': cursor})
+        blob = self.bucket.blob(self._path('cursor.json'))
+        try:
+            blob.upload_from_string(state, content_type='application/json', if_generation_match=self._generation)
+        except PreconditionFailed as e:
+            raise StaleCheckpointError(f'Checkpoint {sequence} of {self.directory} was already saved.') from e
+        self._generation = blob.generation
+
+        logger.info(f'Saved checkpoint {sequence} of {self.directory} at {cursor}.')
@@ -0,0 +1,293 @@
+"""
+This file contains the command line interface of the pipeline, run with `python -m pipeline`.
+
+    python -m pipeline download --cache-dir filings --workers 16 --since 2019-01-01
+    python -m pipeline parse --cache-dir filings --db reporting.db --workers 4
+    python -m pipeline export --db reporting.db --format csv --output export
+    python -m pipeline bench --filings 20 --schedules a1=1000,b=10
+    python -m pipeline run --workers 16 --db reporting.db --format bigquery
+    python -m pipeline simulate --filings 200 --parallelism 8 --shards 2 --latency 0.05
+    python -m pipeline diff --previous previous.db --db reporting.db --output changes
+    python -m pipeline search --db reporting.db "chase bank"
+
+Every subcommand accepts `--metrics` and `--profile` (see `profiling`).
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+from typing import List, Optional
+
+from . import metrics
+from .local import FORM_TYPE, STORAGE_FORMATS, download_to_directory, get_cached_filing_ids, parse_directory
+from .netfile.client import DEFAULT_WORKERS, MAX_CONNECTIONS
+from .netfile.models import DATABASE, use_database
+from .netfile.search import DEFAULT_SEARCH_LIMIT
+from .netfile.synthetic import parse_schedule_counts
+from .profiling import add_profile_arguments, profile
+from .settings import DOWNLOAD_CHUNK_SIZE
+from .storage import DEFAULT_STORAGE_FORMAT, STORE_CLASSES
+from .streaming import DEFAULT_QUEUE_SIZE
+
+# NOTE: The modules that only some subcommands need are imported by their handlers. The BigQuery client library, the
+# benchmarks, and the harness and its stand-ins are slow to import, and are not needed to download or parse filings.
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIRECTORY = 'filings'
+EXPORT_FORMATS = ('csv', 'bigquery')
+
+
+def _parse_date(value: str) -> datetime.date:
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f'Invalid date "{value}". Use the YYYY-MM-DD format.') from e
+
+
+def _download(args: argparse.Namespace) -> None:
+    download_to_directory(args.cache_dir, args.form_type, args.workers, args.format, since=args.since,
+                          use_cache=not args.refresh)
+
+
+def _parse(args: argparse.Namespace) -> None:
+    if not os.path.isdir(args.cache_dir):
+        raise SystemExit(f'The cache directory {args.cache_dir} does not exist. Run the download command first.')
+    logger.info(f'Parsing {len(get_cached_filing_ids(args.cache_dir))} filings from {args.cache_dir}...')
+    # NOTE: With several workers, the parsing happens in worker processes, which cProfile does not see. Profile
+    # a single worker to see where parsing spends its time.
+    parse_directory(args.cache_dir, args.workers)
+
+
+def _export(args: argparse.Namespace) -> None:
+    from .local import export_to_directory
+
+    if args.format == 'csv':
+        export_to_directory(args.output)
+        return
+
+    from .bigquery import refresh_model_data
+    from .memory import EXPORT_SPOOL_SIZE
+    from .netfile.models import get_export_model_classes, iter_csv_exports
+
+    for model, export in iter_csv_exports(lambda: EXPORT_SPOOL_SIZE):
+        refresh_model_data(model, export)
+    logger.info(f'Loaded {len(get_export_model_classes())} tables into BigQuery.')
+
+
+def _run(args: argparse.Namespace) -> None:
+    from .netfile.client import iter_filing_ids
+    from .streaming import StreamingRunner
+
+    filing_ids = iter_filing_ids(args.form_type, since=args.since)
+    runner = StreamingRunner(args.workers, args.queue_size, args.cache_dir)
+    result = runner.run(filing_ids)
+    if result.failed:
+        logger.warning(f'Failed to download {len(result.failed)} filings: {", ".join(result.failed)}')
+    _export(args)
+
+
+def _bench(args: argparse.Namespace) -> None:
+    from .benchmarks import DEFAULT_FILING_COUNT, format_results, run_benchmarks
+
+    # Per-filing logging would dominate the timings
+    logging.getLogger().setLevel(logging.WARNING)
+    filing_count = DEFAULT_FILING_COUNT if args.filings is None else args.filings
+    results = run_benchmarks(filing_count, args.schedules, args.seed)
+
+    if args.json:
+        print(json.dumps([dict(result._asdict(), filings_per_second=result.filings_per_second,
+                               rows_per_second=result.rows_per_second) for result in results], indent=2))
+    else:
+        print(format_results(results))
+
+
+def _simulate(args: argparse.Namespace) -> None:
+    from .harness import DEFAULT_PARALLELISM, format_report, run_functions
+    from .netfile.server import Faults, load_fixtures
+    from .netfile.synthetic import SyntheticFilingGenerator
+
+    # Per-filing logging would drown the report
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.filings:
+        filings = dict(SyntheticFilingGenerator(seed=args.seed).generate_corpus(args.filings, args.schedules))
+    else:
+        filings = load_fixtures()
+    attributes = {'chunk_size': str(args.chunk_size), 'storage_format': args.storage_format, 'shards': str(args.shards)}
+    faults = Faults(args.latency, args.latency_sigma, args.error_rate, args.throttle_rate)
+
+    parallelism = DEFAULT_PARALLELISM if args.parallelism is None else args.parallelism
+    report = run_functions(filings, attributes, parallelism, faults)
+
+    if args.json:
+        print(json.dumps(report._asdict(), indent=2))
+    else:
+        print(format_report(report))
+
+
+def _diff(args: argparse.Namespace) -> None:
+    from .netfile.diffs import write_changes
+
+    summary = write_changes(args.previous, args.output)
+    for model_name, counts in summary.items():
+        if any(counts.values()):
+            logger.info(f'{model_name}: {counts["insert"]} inserted, {counts["update"]} updated, '
+                        f'{counts["delete"]} deleted.')
+
+
+def _search(args: argparse.Namespace) -> None:
+    from .netfile.search import build_search_index, has_search_index, search
+
+    if args.rebuild or not has_search_index():
+        build_search_index()
+    results = search(args.query, args.limit)
+
+    if args.json:
+        print(json.dumps([result._asdict() for result in results], indent=2))
+        return
+    for result in results:
+        schedule = f' {result.schedule_id}' if result.schedule_id else ''
+        print(f'{result.name}\t{result.model}.{result.column}\tfiling {result.filing_id}{schedule}')
+
+
+def _add_cache_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--cache-dir', default=CACHE_DIRECTORY,
+                        help='Directory holding the downloaded filings, as XML files, bundles, or ZIP archives.')
+
+
+def _add_listing_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--form-type', type=int, default=FORM_TYPE,
+                        help=f'Netfile form type to download. Defaults to {FORM_TYPE}, the Form 700.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f'Number of concurrent downloads, at most {MAX_CONNECTIONS}.')
+    parser.add_argument('--since', type=_parse_date, help='Only download filings filed on or after this date.')
+
+
+def _add_export_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv',
+                        help='Write a CSV file per table, or load the tables into BigQuery.')
+    parser.add_argument('--output', default='export', help='Directory in which to write the CSV files.')
+
+
+def _add_database_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--db', default=DATABASE, help='Path of the intermediary SQLite database.')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    # pylint: disable=too-many-statements
+    # Arguments shared by every subcommand
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--metrics', metavar='PATH',
+                        help='Write the metrics of the run to this file, in the Prometheus text format.')
+    add_profile_arguments(common)
+
+    parser = argparse.ArgumentParser(prog='python -m pipeline', description='Download, parse, and export filings.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    download = subparsers.add_parser('download', parents=[common], help='Download filings to the cache directory.')
+    _add_cache_argument(download)
+    _add_listing_arguments(download)
+    download.add_argument('--format', choices=STORAGE_FORMATS, default='xml',
+                          help='Store each filing as an XML file, or many filings per bundle or ZIP archive.')
+    download.add_argument('--refresh', action='store_true',
+                          help='Download filings again, even if they are in the cache directory.')
+    download.set_defaults(func=_download)
+
+    parse = subparsers.add_parser('parse', parents=[common],
+                                  help='Parse the cached filings into a new intermediary database.')
+    _add_cache_argument(parse)
+    _add_database_argument(parse)
+    parse.add_argument('--workers', type=int, default=1,
+                       help='Number of processes to parse with. Each parses a share of the filings into its own '
+                            'database, and the databases are merged at the end.')
+    parse.set_defaults(func=_parse)
+
+    export = subparsers.add_parser('export', parents=[common], help='Export the intermediary database.')
+    _add_database_argument(export)
+    _add_export_arguments(export)
+    export.set_defaults(func=_export)
+
+    run = subparsers.add_parser('run', parents=[common],
+                                help='Download, parse, and export filings in one streaming run, without waiting for '
+                                     'each stage to finish before starting the next.')
+    _add_listing_arguments(run)
+    _add_database_argument(run)
+    _add_export_arguments(run)
+    run.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                     help='Number of filings buffered between two stages.')
+    run.add_argument('--cache-dir', help='If set, save the downloaded filings to this directory, and read filings '
+                                         'already saved there rather than downloading them.')
+    run.set_defaults(func=_run)
+
+    bench = subparsers.add_parser('bench', parents=[common],
+                                  help='Benchmark parsing, cleaning, and exporting synthetic filings.')
+    bench.add_argument('--filings', type=int, help='Number of filings to generate.')
+    bench.add_argument('--schedules', type=parse_schedule_counts, default=None,
+                       help='Entries per schedule in each filing, e.g. "a1=1000,b=10,d=100". Schedules that are not '
+                            'listed have no entries. Defaults to the mix of a typical filing.')
+    bench.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+    bench.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    bench.set_defaults(func=_bench)
+
+    simulate = subparsers.add_parser('simulate', parents=[common],
+                                     help='Run the cloud functions end to end against local stand-ins, and report '
+                                          'timings.')
+    simulate.add_argument('--filings', type=int,
+                          help='Number of synthetic filings to serve. Defaults to serving the template filings.')
+    simulate.add_argument('--schedules', type=parse_schedule_counts, default=None,
+                          help='Entries per schedule in each synthetic filing, e.g. "a1=1000,b=10".')
+    simulate.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+    simulate.add_argument('--chunk-size', type=int, default=DOWNLOAD_CHUNK_SIZE,
+                          help='Number of filings downloaded per download invocation.')
+    simulate.add_argument('--storage-format', choices=sorted(STORE_CLASSES), default=DEFAULT_STORAGE_FORMAT,
+                          help='How the downloaded filings are stored in the bucket.')
+    simulate.add_argument('--shards', type=int, default=1, help='Number of processing shards.')
+    simulate.add_argument('--parallelism', type=int, help='Number of download invocations that may run at once.')
+    simulate.add_argument('--latency', type=float, default=0.0,
+                          help='Median latency of the Netfile stand-in, in seconds.')
+    simulate.add_argument('--latency-sigma', type=float, default=0.0,
+                          help='Spread of the log-normally distributed latency of the Netfile stand-in.')
+    simulate.add_argument('--error-rate', type=float, default=0.0,
+                          help='Share of Netfile requests answered with a 500.')
+    simulate.add_argument('--throttle-rate', type=float, default=0.0,
+                          help='Share of Netfile requests answered with a 429.')
+    simulate.add_argument('--json', action='store_true', help='Print the report as JSON.')
+    simulate.set_defaults(func=_simulate)
+
+    diff = subparsers.add_parser('diff', parents=[common],
+                                 help='Write the rows inserted, updated, and deleted since a previous intermediary '
+                                      'database, as a change file per table.')
+    _add_database_argument(diff)
+    diff.add_argument('--previous', required=True, help='Path of the previous intermediary SQLite database.')
+    diff.add_argument('--output', default='changes', help='Directory in which to write the change files.')
+    diff.set_defaults(func=_diff)
+
+    search_parser = subparsers.add_parser('search', parents=[common],
+                                          help='Search the names of filers, and of the entities, sources, lenders, '
+                                               'and properties they disclose.')
+    _add_database_argument(search_parser)
+    search_parser.add_argument('query', help='Words the names must contain. The last word may be a prefix.')
+    search_parser.add_argument('--limit', type=int, default=DEFAULT_SEARCH_LIMIT, help='Number of results to show.')
+    search_parser.add_argument('--rebuild', action='store_true',
+                               help='Rebuild the search index first. It is built when parsing.')
+    search_parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    search_parser.set_defaults(func=_search)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+    if getattr(args, 'db', None):
+        use_database(args.db)
+
+    with profile(args.command, args.profile, args.profile_directory):
+        args.func(args)
+
+    if args.metrics:
+        metrics.write_prometheus(args.metrics)
+    metrics.flush(command=args.command)
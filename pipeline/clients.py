@@ -0,0 +1,86 @@
+"""
+This file contains a registry of Google Cloud clients. Clients are created lazily,
+on first use, and reused for the lifetime of the process so warm function
+invocations do not pay to import the client libraries or authenticate again.
+"""
+# NOTE: The client libraries are imported by the factories, so they are only imported when a client is first used.
+import logging
+import threading
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# Messages published in quick succession are sent to Pub/Sub in batches of up to this many messages.
+PUBLISH_BATCH_MAX_MESSAGES = 100
+PUBLISH_BATCH_MAX_LATENCY = 0.05  # seconds
+
+_clients: Dict[str, Any] = {}
+# Reentrant, since some factories get other clients (e.g. a bucket needs the storage client).
+_lock = threading.RLock()
+
+
+def _get_client(name: str, factory: Callable[[], Any]) -> Any:
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                logger.debug(f'Creating {name} client...')
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def register_client(name: str, client: Any) -> Any:
+    """ Registers a client to be returned by the getter of the given name (e.g. `bigquery`), in place of a Google
+    Cloud client. This is used to run the pipeline against local stand-ins.
+
+    Registering `None` discards the client, so the getter creates a new one.
+
+    Returns:
+        The previously registered client, if any, so it can be restored.
+    """
+    with _lock:
+        previous = _clients.pop(name, None)
+        if client is not None:
+            _clients[name] = client
+    return previous
+
+
+def reset_clients() -> None:
+    """ Discards all cached clients. The next call to a getter will create a new client. """
+    with _lock:
+        _clients.clear()
+
+
+def get_storage_client():
+    def factory():
+        from google.cloud import storage
+        return storage.Client()
+
+    return _get_client('storage', factory)
+
+
+def get_bucket(bucket_name: str):
+    """ Returns the named bucket. The bucket's metadata is only retrieved once per process. """
+    return _get_client(f'bucket:{bucket_name}', lambda: get_storage_client().get_bucket(bucket_name))
+
+
+def get_publisher_client():
+    def factory():
+        from google.cloud import pubsub_v1
+        batch_settings = pubsub_v1.types.BatchSettings(
+            max_messages=PUBLISH_BATCH_MAX_MESSAGES,
+            max_latency=PUBLISH_BATCH_MAX_LATENCY,
+        )
+        return pubsub_v1.PublisherClient(batch_settings=batch_settings)
+
+    return _get_client('publisher', factory)
+
+
+def get_bigquery_client():
+    def factory():
+        from google.cloud import bigquery
+        return bigquery.Client()
+
+    return _get_client('bigquery', factory)
@@ -0,0 +1,159 @@
+"""
+This file contains trackers used to determine when every unit of work in a fan-out
+has completed, so that the fan-in step is triggered exactly once.
+"""
+import logging
+import random
+import threading
+import time
+import zlib
+from typing import Dict, List, Set
+
+from google.cloud.exceptions import PreconditionFailed
+
+logger = logging.getLogger(__name__)
+
+
+class CompletionTracker:
+    """ Counts completed items for a run and reports when the final item completes. """
+
+    def start(self, run_id: str, expected: int) -> None:
+        """ Registers a run that will complete after `expected` distinct items. """
+        raise NotImplementedError
+
+    def mark_complete(self, run_id: str, item_id: str) -> bool:
+        """ Records the completion of an item.
+
+        Returns:
+            bool: True for the item that completed the run, and False for every other item. The fan-in step runs
+                when this returns True. If the fan-in step fails, the redelivered item returns True again, so the
+                step is retried.
+        """
+        raise NotImplementedError
+
+
+class LocalCompletionTracker(CompletionTracker):
+    """ In-memory tracker for tests and single-process runs. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expected: Dict[str, int] = {}
+        self._completed: Dict[str, Set[str]] = {}
+        self._triggered_by: Dict[str, str] = {}
+
+    def start(self, run_id: str, expected: int) -> None:
+        with self._lock:
+            self._expected[run_id] = expected
+            self._completed[run_id] = set()
+
+    def mark_complete(self, run_id: str, item_id: str) -> bool:
+        with self._lock:
+            completed = self._completed[run_id]
+            completed.add(item_id)
+            if len(completed) >= self._expected[run_id]:
+                self._triggered_by.setdefault(run_id, item_id)
+            return self._triggered_by.get(run_id) == item_id
+
+
+class StorageCompletionTracker(CompletionTracker):
+    """ Tracker backed by objects in a Cloud Storage bucket.
+
+    Each completion costs a constant number of requests, regardless of the size of the run:
+
+    1. The item is added to one of `shard_count` counter objects with a compare-and-set on its generation. Each
+       counter holds the IDs of the items it counted, so an item that was already counted is not counted again, which
+       makes redelivered messages harmless. Sharding the counter keeps contention (and the per-object update rate) low
+       when many downloads finish together.
+    2. The counters are summed with a single list request. The caller that sees the total reach the expected
+       count creates a trigger object, which holds its item ID, with a `generation=0` precondition, so only one
+       item wins.
+
+    An item is only recorded once it is counted, so an invocation that fails before its item is counted is retried
+    in full. An invocation that fails after its item is counted, but before the trigger is created, is retried as a
+    duplicate, which still checks the total, so the run is triggered either way. An invocation that fails after it
+    created the trigger, e.g. while publishing the fan-in message, is retried as the winning item, which wins again.
+    """
+
+    DIRECTORY_NAME = 'completion'
+    MAX_ATTEMPTS = 20
+
+    def __init__(self, bucket, shard_count: int = 16):
+        self.bucket = bucket
+        self.shard_count = shard_count
+        self._expected: Dict[str, int] = {}
+
+    def _path(self, run_id: str, name: str) -> str:
+        return f'{run_id}/{self.DIRECTORY_NAME}/{name}'
+
+    def _trigger(self, run_id: str, item_id: str) -> bool:
+        """ Creates the run's trigger object, unless it exists.
+
+        Returns:
+            bool: True if the trigger was created by this item, now or by an earlier delivery of it.
+        """
+        name = self._path(run_id, 'triggered')
+        try:
+            self.bucket.blob(name).upload_from_string(item_id, content_type='text/plain', if_generation_match=0)
+        except PreconditionFailed:
+            return self.bucket.get_blob(name).download_as_string().decode('utf8') == item_id
+        return True
+
+    def _get_expected(self, run_id: str) -> int:
+        # The expected count never changes for a run, so a tracker that is reused across warm invocations only reads
+        # it once.
+        if run_id not in self._expected:
+            blob = self.bucket.blob(self._path(run_id, 'expected'))
+            self._expected[run_id] = int(blob.download_as_string())
+        return self._expected[run_id]
+
+    def _increment(self, run_id: str, item_id: str) -> bool:
+        """ Adds the item to its counter.
+
+        Returns:
+            bool: False if the item was already counted.
+        """
+        shard = zlib.crc32(item_id.encode('utf8')) % self.shard_count
+        name = self._path(run_id, f'counters/{shard}')
+
+        for attempt in range(self.MAX_ATTEMPTS):
+            blob = self.bucket.get_blob(name)
+            item_ids: List[str] = []
+            generation = 0
+            if blob is not None:
+                item_ids, generation = blob.download_as_string().decode('utf8').split(), blob.generation
+            if item_id in item_ids:
+                return False
+
+            item_ids.append(item_id)
+            blob = self.bucket.blob(name)
+            # The count is kept in the metadata too, so the counters can be summed from a list request.
+            blob.metadata = {'count': str(len(item_ids))}
+            try:
+                blob.upload_from_string('\n'.join(item_ids), content_type='text/plain', if_generation_match=generation)
+                return True
+            except PreconditionFailed:
+                # Another invocation updated the shard first. Back off and retry with the new generation.
+                time.sleep(random.uniform(0, 0.1 * 2 ** min(attempt, 5)))
+
+        raise RuntimeError(f'Failed to increment completion counter {name} after {self.MAX_ATTEMPTS} attempts')
+
+    def _count(self, run_id: str) -> int:
+        blobs = self.bucket.list_blobs(prefix=self._path(run_id, 'counters/'))
+        return sum(int(blob.metadata['count']) for blob in blobs)
+
+    def start(self, run_id: str, expected: int) -> None:
+        blob = self.bucket.blob(self._path(run_id, 'expected'))
+        blob.upload_from_string(str(expected), content_type='text/plain')
+        self._expected[run_id] = expected
+
+    def mark_complete(self, run_id: str, item_id: str) -> bool:
+        if not self._increment(run_id, item_id):
+            logger.info(f'Item {item_id} of run {run_id} was already marked complete.')
+
+        actual_count = self._count(run_id)
+        expected_count = self._get_expected(run_id)
+        if actual_count < expected_count:
+            logger.debug('Only %d of %d items of run %s completed.', actual_count, expected_count, run_id)
+            return False
+
+        return self._trigger(run_id, item_id)
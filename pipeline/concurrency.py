@@ -0,0 +1,40 @@
+"""
+This file contains helpers for running I/O-bound work concurrently.
+"""
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Deque, Generator, Iterable, Optional, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def bounded_map(func: Callable[[T], R], items: Iterable[T], workers: int, max_pending: Optional[int] = None,
+                throttle: Optional[Callable[[], bool]] = None) -> Generator[R, None, None]:
+    """ Applies `func` to each item using a pool of threads, and yields the results in order.
+
+    Unlike `ThreadPoolExecutor.map`, items are consumed lazily and at most `max_pending` results (which defaults to
+    twice the number of workers) are in flight or waiting to be consumed at any time. This bounds the memory used
+    when the results are large, and lets the caller process results while later items are still being fetched.
+
+    If `throttle` is set, it is called before each item is submitted. While it returns True (e.g. because memory is
+    running low), no new work is submitted until the pending results have been consumed.
+
+    Exceptions raised by `func` are re-raised when the corresponding result is reached.
+    """
+    max_pending = max(max_pending or workers * 2, 1)
+    pending: Deque = collections.deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for item in items:
+                while len(pending) >= max_pending or (pending and throttle and throttle()):
+                    yield pending.popleft().result()
+                pending.append(executor.submit(func, item))
+
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # If the consumer stops early, don't start work whose results will never be used.
+            for future in pending:
+                future.cancel()
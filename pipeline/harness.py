@@ -0,0 +1,187 @@
+"""
+This file contains a harness that runs the cloud functions of `main.py` end to end, in a
+single process, against in-memory stand-ins for Pub/Sub, Cloud Storage, and BigQuery, and a
+local stand-in for the Netfile API (see `pipeline.netfile.server`).
+
+Published messages are dispatched to the function subscribed to their topic, as Pub/Sub
+would, so the whole fan-out/fan-in chain runs: `download_all_filings` publishes chunks to
+`download_netfile_filing`, the last download triggers `process_netfile_filings`, which may
+fan out to `process_netfile_shard`. Downloads run in parallel. The processing functions share
+the process-wide staging database, so they run one at a time.
+"""
+import base64
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from .clients import register_client
+from .local_cloud import LocalBigQueryClient, MemoryBucket
+from .netfile import client
+from .netfile.server import Faults, NetfileStandIn
+from .settings import BUCKET_NAME, PROJECT_ID
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARALLELISM = 8
+# Pub/Sub redelivers a message when a function deployed with `--retry` fails. Stop after this many attempts.
+MAX_DELIVERY_ATTEMPTS = 3
+
+# Name of the function of `main.py` subscribed to each topic (see deploy.sh), whether it may run concurrently, and
+# whether it is retried
+SUBSCRIPTIONS: Dict[str, Tuple[str, bool, bool]] = {
+    'download-all-filings': ('download_all_filings', True, False),
+    'download-netfile-filing': ('download_netfile_filing', True, True),
+    'process-netfile-filings': ('process_netfile_filings', False, True),
+    'process-netfile-shard': ('process_netfile_shard', False, True),
+}
+
+
+class Invocation(NamedTuple):
+    topic: str
+    seconds: float
+    error: Optional[str]
+
+
+class LocalPublisher:
+    """ Stand-in for the Pub/Sub publisher, which dispatches each message to the function subscribed to its topic.
+
+    Args:
+        functions (dict): Function subscribed to each topic of `SUBSCRIPTIONS`, by topic.
+        parallelism (int): Number of invocations of the concurrent functions that may run at once.
+    """
+
+    def __init__(self, functions: Dict[str, Callable[[dict, Any], None]], parallelism: int = DEFAULT_PARALLELISM):
+        self.functions = functions
+        self.invocations: List[Invocation] = []
+        self.published: Counter = Counter()
+        self._executors = {
+            True: ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix='function'),
+            False: ThreadPoolExecutor(max_workers=1, thread_name_prefix='processing'),
+        }
+        self._pending = 0
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def topic_path(project: str, topic: str) -> str:
+        return f'projects/{project}/topics/{topic}'
+
+    def publish(self, topic_path: str, data: bytes, **attributes: str) -> Future:
+        topic = topic_path.rsplit('/', 1)[-1]
+        self.published[topic] += 1
+        self._dispatch(topic, data, attributes, 1)
+
+        # The message is "sent" once it has been queued.
+        future: Future = Future()
+        future.set_result(str(sum(self.published.values())))
+        return future
+
+    def _dispatch(self, topic: str, data: bytes, attributes: Dict[str, str], attempt: int) -> None:
+        _, concurrent, _ = SUBSCRIPTIONS[topic]
+        with self._condition:
+            self._pending += 1
+        self._executors[concurrent].submit(self._invoke, topic, data, attributes, attempt)
+
+    def _invoke(self, topic: str, data: bytes, attributes: Dict[str, str], attempt: int) -> None:
+        function = self.functions[topic]
+        _, _, retried = SUBSCRIPTIONS[topic]
+        event = {'data': base64.b64encode(data).decode('ascii'), 'attributes': attributes}
+        start = time.perf_counter()
+        error = None
+        try:
+            function(event, None)
+        except Exception as e:  # pylint: disable=broad-except
+            error = repr(e)
+            logger.exception(f'Invocation {attempt} of {function.__name__} failed.')
+            if retried and attempt < MAX_DELIVERY_ATTEMPTS:
+                self._dispatch(topic, data, attributes, attempt + 1)
+        finally:
+            with self._condition:
+                self.invocations.append(Invocation(topic, time.perf_counter() - start, error))
+                self._pending -= 1
+                self._condition.notify_all()
+
+    def wait(self) -> None:
+        """ Waits until every published message, and every message published in turn, has been handled. """
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending == 0)
+
+    def shutdown(self) -> None:
+        for executor in self._executors.values():
+            executor.shutdown()
+
+
+class HarnessReport(NamedTuple):
+    seconds: float
+    # Number of invocations, failed invocations, and the total seconds spent in them, by topic
+    invocations: Dict[str, Tuple[int, int, float]]
+    published: Dict[str, int]
+    bucket_operations: Dict[str, int]
+    bucket_bytes: Dict[str, int]
+    tables: Dict[str, int]
+
+
+def format_report(report: HarnessReport) -> str:
+    lines = [f'End to end: {report.seconds:.2f}s']
+    for topic, (count, failures, seconds) in report.invocations.items():
+        lines.append(f'  {topic}: {count} invocations ({failures} failed) in {seconds:.2f}s, '
+                     f'{report.published.get(topic, 0)} published')
+    operations = ', '.join(f'{count} {operation}' for operation, count in sorted(report.bucket_operations.items()))
+    transferred = ', '.join(f'{count / 2 ** 20:.1f} MB {direction}' for direction, count in
+                            sorted(report.bucket_bytes.items()))
+    lines.append(f'Bucket requests: {operations}; {transferred}')
+    lines.append(f'Rows loaded: {sum(report.tables.values())} in {len(report.tables)} tables')
+    return '\n'.join(lines)
+
+
+def run_functions(filings: Dict[str, str], attributes: Optional[Dict[str, str]] = None,
+                  parallelism: int = DEFAULT_PARALLELISM, faults: Faults = Faults()) -> HarnessReport:
+    """ Runs the cloud functions end to end, from a `download-all-filings` message to the BigQuery load.
+
+    Args:
+        filings (dict): XML of the filings served by the Netfile stand-in, by filing ID.
+        attributes (dict): Attributes of the `download-all-filings` message, e.g. `chunk_size`, `storage_format`, or
+            `shards`. The form type defaults to 254.
+        parallelism (int): Number of download function invocations that may run at once.
+        faults (Faults): Latency and failures of the Netfile stand-in.
+    """
+    # main.py is the deployed entry point, and imports the pipeline package, so it is only imported once needed.
+    import main
+
+    publisher = LocalPublisher({topic: getattr(main, name) for topic, (name, _, _) in SUBSCRIPTIONS.items()},
+                               parallelism)
+    bucket = MemoryBucket()
+    bigquery_client = LocalBigQueryClient()
+    stand_ins = {'publisher': publisher, f'bucket:{BUCKET_NAME}': bucket, 'bigquery': bigquery_client}
+    previous_clients = {name: register_client(name, stand_in) for name, stand_in in stand_ins.items()}
+    api_root = client.API_ROOT
+
+    try:
+        with NetfileStandIn(filings, faults=faults) as netfile:
+            client.API_ROOT = netfile.url
+            start = time.perf_counter()
+            message = dict({'form_type': '254'}, **(attributes or {}))
+            publisher.publish(publisher.topic_path(PROJECT_ID, 'download-all-filings'), b'', **message)
+            publisher.wait()
+            seconds = time.perf_counter() - start
+    finally:
+        client.API_ROOT = api_root
+        publisher.shutdown()
+        for name, previous in previous_clients.items():
+            register_client(name, previous)
+
+    invocations: Dict[str, Tuple[int, int, float]] = {}
+    for invocation in publisher.invocations:
+        count, failures, total = invocations.get(invocation.topic, (0, 0, 0.0))
+        invocations[invocation.topic] = (count + 1, failures + bool(invocation.error), total + invocation.seconds)
+
+    return HarnessReport(
+        seconds=seconds,
+        invocations={topic: invocations[topic] for topic in SUBSCRIPTIONS if topic in invocations},
+        published=dict(publisher.published),
+        bucket_operations=dict(bucket.operations),
+        bucket_bytes=dict(bucket.bytes),
+        tables=dict(bigquery_client.tables),
+    )
@@ -0,0 +1,225 @@
+"""
+This file contains code to download, cache, parse, and export filings on a local disk, for
+the scripts and the command line interface.
+
+A cache directory holds filings as individual `{filing_id}.xml.gz` files (see
+`netfile.compression`) or uncompressed `{filing_id}.xml` files, bundles (see
+`netfile.bundles`), ZIP archives (see `netfile.archives`), or a mix of them. Filings
+already in the cache are not downloaded again.
+"""
+import datetime
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Set, Tuple
+
+from . import metrics
+from .memory import EXPORT_SPOOL_SIZE
+from .netfile.archives import ARCHIVE_EXTENSION, list_archive, read_archive, write_archive
+from .netfile.bundles import BUNDLE_EXTENSION, read_bundle, write_bundle
+from .netfile.client import DEFAULT_WORKERS, download_filings, get_filing_ids
+from .netfile.compression import GZIP_EXTENSION, compress, decompress
+from .netfile.models import build_tables, destroy_database, iter_csv_exports, use_database
+from .netfile.parsers import parse_filing
+from .netfile.search import build_search_index
+from .netfile.shards import get_shard, merge_databases
+
+logger = logging.getLogger(__name__)
+
+FORM_TYPE = 254  # FPPC Form 700 Statement of Economic Interests (2018-2019)
+STORAGE_FORMATS = ('xml', 'bundle', 'zip')
+BUNDLE_SIZE = 20
+
+_XML_PATTERN = re.compile(r'(\d+)\.xml(?:\.gz)?$')
+
+
+def save_filing(directory: str, filing_id: str, content: str) -> None:
+    """ Saves the filing to the directory, compressed. """
+    file_path = os.path.join(directory, f'{filing_id}.xml{GZIP_EXTENSION}')
+    with open(file_path, 'wb') as output:
+        output.write(compress(content))
+
+
+def load_filing(directory: str, filing_id: str) -> Optional[str]:
+    """ Returns the XML of the filing saved to the directory by `save_filing`, or None if it was not saved. """
+    for name in (f'{filing_id}.xml{GZIP_EXTENSION}', f'{filing_id}.xml'):
+        try:
+            with open(os.path.join(directory, name), 'rb') as f:
+                return decompress(f.read())
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def save_bundle(directory: str, name: str, filings: Iterable[Tuple[str, str]]) -> int:
+    with open(os.path.join(directory, f'{name}{BUNDLE_EXTENSION}'), 'wb') as output:
+        return write_bundle(output, filings)
+
+
+def _iter_xml_paths(directory: str) -> Iterator[Tuple[str, Path]]:
+    for pattern in ('**/*.xml', f'**/*.xml{GZIP_EXTENSION}'):
+        for path in Path(directory).glob(pattern):
+            match = _XML_PATTERN.search(path.name)
+            if match:
+                yield match[1], path
+
+
+def iter_filings(directory: str, include: Callable[[str], bool] = lambda filing_id: True) \
+        -> Iterator[Tuple[str, str]]:
+    """ Yields the ID and XML of the filings in the directory for which `include` returns True. """
+    for filing_id, path in _iter_xml_paths(directory):
+        if not include(filing_id):
+            continue
+
+        with open(str(path), 'rb') as f:
+            content = decompress(f.read())
+
+        yield filing_id, content
+
+    # Bundles and archives may hold many filings each
+    for path in Path(directory).glob(f'**/*{BUNDLE_EXTENSION}'):
+        with open(str(path), 'rb') as f:
+            for filing_id, content in read_bundle(f):
+                if include(filing_id):
+                    yield filing_id, content
+
+    for path in Path(directory).glob(f'**/*{ARCHIVE_EXTENSION}'):
+        yield from read_archive(str(path), include)
+
+
+def get_cached_filing_ids(directory: str) -> Set[str]:
+    """ Returns the IDs of the filings stored in the directory. """
+    filing_ids = {filing_id for filing_id, _ in _iter_xml_paths(directory)}
+    for path in Path(directory).glob(f'**/*{BUNDLE_EXTENSION}'):
+        with open(str(path), 'rb') as f:
+            filing_ids.update(filing_id for filing_id, _ in read_bundle(f))
+    for path in Path(directory).glob(f'**/*{ARCHIVE_EXTENSION}'):
+        filing_ids.update(list_archive(str(path)))
+    return filing_ids
+
+
+def _chunk(items: Iterable, size: int) -> Iterator[List]:
+    chunk: List = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def download_to_directory(directory: str, form_type: int = FORM_TYPE, workers: int = DEFAULT_WORKERS,
+                          storage_format: str = 'xml', *, since: Optional[datetime.date] = None,
+                          use_cache: bool = True) -> int:
+    """ Downloads the filings of the given form type to the directory.
+
+    Args:
+        storage_format (str): `xml` stores each filing in its own compressed file, and `bundle` and `zip` store every
+            `BUNDLE_SIZE` filings in a bundle or a ZIP archive.
+        since (date): If set, only filings filed on or after this date are downloaded.
+        use_cache (bool): If True, filings already stored in the directory are not downloaded again.
+
+    Returns:
+        int: The number of filings downloaded.
+    """
+    # pylint: disable=too-many-arguments
+    if storage_format not in STORAGE_FORMATS:
+        raise ValueError(f'Unknown storage format: {storage_format}')
+    os.makedirs(directory, exist_ok=True)
+
+    filing_ids = get_filing_ids(form_type, since=since)
+    if use_cache:
+        cached_filing_ids = get_cached_filing_ids(directory)
+        logger.info(f'{len(filing_ids & cached_filing_ids)} of {len(filing_ids)} filings are already downloaded.')
+        filing_ids -= cached_filing_ids
+
+    filings = download_filings(sorted(filing_ids), workers)
+    if storage_format == 'xml':
+        for filing_id, content in filings:
+            save_filing(directory, filing_id, content)
+    else:
+        # Name the files after the download, so they do not overwrite those of earlier downloads.
+        timestamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+        for index, chunk in enumerate(_chunk(filings, BUNDLE_SIZE)):
+            name = f'{timestamp}-{index:06d}'
+            if storage_format == 'bundle':
+                save_bundle(directory, name, chunk)
+            else:
+                write_archive(os.path.join(directory, f'{name}{ARCHIVE_EXTENSION}'), chunk)
+
+    logger.info(f'Downloaded {len(filing_ids)} filings to {directory}.')
+    return len(filing_ids)
+
+
+def _parse_shard(directory: str, shard: int, shard_count: int, database_path: str) -> Tuple[str, dict]:
+    # The worker inherits the metrics that the parent recorded before forking, which the parent already reports, and
+    # may have parsed another shard before.
+    metrics.registry.reset()
+
+    # Amendments may reference filings in other shards, so foreign keys are only checked after the merge.
+    use_database(database_path, enforce_foreign_keys=False)
+    destroy_database()
+    build_tables()
+
+    for filing_id, content in iter_filings(directory, lambda filing_id: get_shard(filing_id, shard_count) == shard):
+        parse_filing(filing_id, content)
+
+    # Return the shard's metrics to the parent process, which reports them
+    return database_path, metrics.registry.snapshot()
+
+
+def parse_directory(directory: str, shard_count: int = 1) -> None:
+    """ Parses the filings in the directory into a new intermediary database, and indexes them for search.
+
+    With several shards, each shard of the filings is parsed by its own process into its own database, and the
+    databases are merged at the end.
+    """
+    if shard_count <= 1:
+        # Setup the intermediary database
+        destroy_database()
+        build_tables()
+
+        # Iterate over filings
+        for filing_id, content in iter_filings(directory):
+            parse_filing(filing_id, content)
+        build_search_index()
+        return
+
+    with tempfile.TemporaryDirectory() as shard_directory:
+        shard_args = [
+            (directory, shard, shard_count, os.path.join(shard_directory, f'{shard}.db'))
+            for shard in range(shard_count)
+        ]
+        with multiprocessing.Pool(shard_count) as pool:
+            shard_results = pool.starmap(_parse_shard, shard_args)
+
+        for _, snapshot in shard_results:
+            metrics.registry.merge(snapshot)
+
+        # Setup the intermediary database, and merge the shards into it
+        destroy_database()
+        build_tables()
+        merge_databases([path for path, _ in shard_results])
+    build_search_index()
+
+
+def export_to_directory(directory: str, get_spool_size: Callable[[], int] = lambda: EXPORT_SPOOL_SIZE) -> List[str]:
+    """ Exports each table of the intermediary database to a `{model}.csv` file in the directory.
+
+    Returns:
+        List[str]: The paths of the files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for model, export in iter_csv_exports(get_spool_size):
+        path = os.path.join(directory, f'{model.__name__}.csv')
+        with open(path, 'wb') as output:
+            shutil.copyfileobj(export, output)
+        paths.append(path)
+    logger.info(f'Exported {len(paths)} tables to {directory}.')
+    return paths
@@ -0,0 +1,128 @@
+"""
+This file contains in-process stand-ins for the BigQuery and Cloud Storage clients, to run the pipeline locally: they
+are used by the benchmarks, the harness, and the tests.
+"""
+import codecs
+import csv
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound, PreconditionFailed
+
+from .settings import BUCKET_NAME
+
+
+class LocalLoadJob:
+    def __init__(self, output_rows: int):
+        self.output_rows = output_rows
+
+    def result(self) -> 'LocalLoadJob':
+        return self
+
+
+class LocalBigQueryClient:
+    """ Stand-in for `bigquery.Client` that reads loaded files and counts their rows, instead of uploading them. """
+
+    def __init__(self, project: str = 'local'):
+        self.project = project
+        # Rows loaded into each table, by table ID
+        self.tables: Dict[str, int] = {}
+
+    def dataset(self, dataset_id: str) -> bigquery.DatasetReference:
+        return bigquery.DatasetReference(self.project, dataset_id)
+
+    def get_service_account_email(self) -> str:  # pylint: disable=no-self-use
+        return 'local@localhost'
+
+    def delete_table(self, table, not_found_ok: bool = False) -> None:  # pylint: disable=unused-argument
+        self.tables.pop(table.table_id, None)
+
+    def create_table(self, table: bigquery.Table) -> bigquery.Table:
+        self.tables[table.table_id] = 0
+        return table
+
+    def load_table_from_file(self, file_obj, destination, **kwargs) -> LocalLoadJob:
+        skip_leading_rows = kwargs['job_config'].skip_leading_rows or 0
+        reader = csv.reader(codecs.iterdecode(file_obj, 'utf8'))
+        row_count = max(sum(1 for _ in reader) - skip_leading_rows, 0)
+        self.tables[destination.table_id] = row_count
+        return LocalLoadJob(row_count)
+
+
+class MemoryBlob:
+    """ Stand-in for a Cloud Storage blob. Uploads replace the bucket's copy of the blob, and honour generation
+    preconditions. """
+
+    def __init__(self, bucket: 'MemoryBucket', name: str):
+        self.bucket = bucket
+        self.name = name
+        self.metadata: Optional[Dict[str, str]] = None
+        self.content_encoding: Optional[str] = None
+        self.generation = 0
+        self.data = b''
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None):  # pylint: disable=unused-argument
+        self.bucket.operations['upload'] += 1
+        with self.bucket.lock:
+            current = self.bucket.blobs.get(self.name)
+            generation = current.generation if current else 0
+            if if_generation_match is not None and if_generation_match != generation:
+                raise PreconditionFailed('generation mismatch')
+
+            blob = MemoryBlob(self.bucket, self.name)
+            blob.data = data.encode('utf8') if isinstance(data, str) else bytes(data)
+            blob.metadata = dict(self.metadata) if self.metadata else None
+            blob.content_encoding = self.content_encoding
+            blob.generation = generation + 1
+            self.bucket.blobs[self.name] = blob
+            self.generation = blob.generation
+            self.bucket.bytes['upload'] += len(blob.data)
+
+    def upload_from_file(self, file_obj, rewind: bool = False, content_type=None) -> None:
+        if rewind:
+            file_obj.seek(0)
+        self.upload_from_string(file_obj.read(), content_type=content_type)
+
+    def upload_from_filename(self, filename: str, content_type=None) -> None:
+        with open(filename, 'rb') as f:
+            self.upload_from_string(f.read(), content_type=content_type)
+
+    def download_as_string(self) -> bytes:
+        self.bucket.operations['download'] += 1
+        blob = self.bucket.blobs.get(self.name)
+        if blob is None:
+            raise NotFound(f'{self.name} not found')
+        self.bucket.bytes['download'] += len(blob.data)
+        return blob.data
+
+    def download_to_filename(self, filename: str) -> None:
+        with open(filename, 'wb') as f:
+            f.write(self.download_as_string())
+
+
+class MemoryBucket:
+    """ Stand-in for a Cloud Storage bucket, which counts the requests made to it. """
+
+    def __init__(self, name: str = BUCKET_NAME):
+        self.name = name
+        self.lock = threading.Lock()
+        self.blobs: Dict[str, MemoryBlob] = {}
+        self.operations: Counter = Counter()
+        self.bytes: Counter = Counter()
+
+    def blob(self, name: str) -> MemoryBlob:
+        return MemoryBlob(self, name)
+
+    def get_blob(self, name: str) -> Optional[MemoryBlob]:
+        self.operations['get'] += 1
+        return self.blobs.get(name)
+
+    def list_blobs(self, prefix: str, start_offset: Optional[str] = None) -> List[MemoryBlob]:
+        self.operations['list'] += 1
+        with self.lock:
+            return [
+                blob for name, blob in sorted(self.blobs.items())
+                if name.startswith(prefix) and (start_offset is None or name >= start_offset)
+            ]
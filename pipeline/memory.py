@@ -0,0 +1,137 @@
+"""
+This file contains a memory governor, which keeps processing within a memory budget.
+
+The governor samples the memory usage of the process in the background. Stages that buffer
+data consult it: the prefetch queue stops reading ahead, and exports are spilled to temporary
+files sooner, while the process is over its budget.
+
+On Cloud Functions, /tmp is an in-memory file system that counts against the function's
+memory limit, so spilling to a temporary file does not free memory there. It only keeps the
+data out of the Python heap. Memory usage is therefore measured as the usage of the memory
+cgroup, to which the limit applies, and which includes the files in /tmp. The resident set
+size (RSS) is only used where cgroups are not available.
+"""
+import logging
+import os
+import resource
+import sys
+import threading
+from typing import Optional
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Budget of the cloud functions, in megabytes. Leave headroom below the memory limit of the function: Python does not
+# return freed memory to the OS promptly, and an allocation can overshoot the budget between two samples.
+MEMORY_BUDGET_ENVIRONMENT_VARIABLE = 'PIPELINE_MEMORY_BUDGET_MB'
+SAMPLE_INTERVAL = 0.1  # seconds
+# Largest amount of export data held in memory, per table, before it is spilled to a temporary file
+EXPORT_SPOOL_SIZE = 16 * 2 ** 20
+
+# Memory usage of the process's cgroup, including in-memory files, under cgroup v1 and v2
+CGROUP_USAGE_PATHS = ('/sys/fs/cgroup/memory/memory.usage_in_bytes', '/sys/fs/cgroup/memory.current')
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def get_rss() -> int:
+    """ Returns the current resident set size of this process, in bytes. """
+    try:
+        with open('/proc/self/statm', encoding='utf8') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        # /proc is only available on Linux. Elsewhere, fall back to the peak, which over-estimates the current size.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_memory_usage() -> int:
+    """ Returns the memory usage of this process's cgroup, in bytes, or its RSS if cgroups are not available.
+
+    Unlike the RSS, the cgroup's usage includes files in in-memory file systems, such as the /tmp directory of a cloud
+    function.
+    """
+    for path in CGROUP_USAGE_PATHS:
+        try:
+            with open(path, encoding='utf8') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            continue
+    return get_rss()
+
+
+class MemoryGovernor:
+    """ Tracks the memory usage of the process (see `get_memory_usage`) against a budget, in bytes. A governor without
+    a budget never throttles, but still records the peak usage.
+
+    Use the governor as a context manager to sample the usage in the background, and log the peak when the context
+    exits.
+    """
+
+    def __init__(self, budget: Optional[int] = None, name: str = 'run', sample_interval: float = SAMPLE_INTERVAL):
+        self.budget = budget
+        self.name = name
+        self.sample_interval = sample_interval
+        self.peak = 0
+        self.throttled = 0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_environment(cls, name: str = 'run') -> 'MemoryGovernor':
+        """ Returns a governor with the budget set by the `PIPELINE_MEMORY_BUDGET_MB` environment variable, if any. """
+        budget = os.environ.get(MEMORY_BUDGET_ENVIRONMENT_VARIABLE)
+        return cls(int(float(budget) * 2 ** 20) if budget else None, name)
+
+    def sample(self) -> int:
+        usage = get_memory_usage()
+        self.peak = max(self.peak, usage)
+        return usage
+
+    def headroom(self) -> Optional[int]:
+        """ Returns the bytes left in the budget, which are negative if it is exceeded, or None without a budget. """
+        if self.budget is None:
+            return None
+        return self.budget - self.sample()
+
+    def over_budget(self) -> bool:
+        headroom = self.headroom()
+        if headroom is None or headroom > 0:
+            return False
+        self.throttled += 1
+        return True
+
+    def spool_size(self) -> int:
+        """ Returns how much data a buffer may hold in memory before spilling to a temporary file.
+
+        Spilled data still counts against the budget where /tmp is in memory, and the measured usage includes it, so
+        later buffers get a smaller share of the remaining headroom.
+        """
+        headroom = self.headroom()
+        if headroom is None:
+            return EXPORT_SPOOL_SIZE
+        # Leave half of the remaining headroom for everything else.
+        return max(min(EXPORT_SPOOL_SIZE, headroom // 2), 0)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.sample_interval):
+            self.sample()
+
+    def __enter__(self) -> 'MemoryGovernor':
+        self.sample()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='memory-governor', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self.sample()
+
+        metrics.observe('peak_memory_bytes', self.peak, run=self.name)
+        budget = f' of a {self.budget / 2 ** 20:.0f} MB budget' if self.budget else ''
+        throttled = f', and throttled {self.throttled} times' if self.throttled else ''
+        logger.info(f'Peak memory usage of {self.name} was {self.peak / 2 ** 20:.1f} MB{budget}{throttled}.')
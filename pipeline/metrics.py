@@ -0,0 +1,184 @@
+"""
+This file contains a lightweight metrics layer. Stages of the pipeline record counters and
+histograms (e.g. latencies, bytes, and rows) in a process-wide registry, which is flushed as
+a structured JSON log line at the end of each function invocation or script run.
+"""
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[Tuple[str, str], ...]
+MetricKey = Tuple[str, Labels]
+
+
+class Histogram:
+    """ Summarizes observed values by their count, sum, minimum, and maximum. """
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, count: int, total: float, minimum: Optional[float], maximum: Optional[float]) -> None:
+        """ Adds the summary of values observed elsewhere, e.g. in another process. """
+        if not count:
+            return
+        self.count += count
+        self.sum += total
+        if minimum is not None:
+            self.min = minimum if self.min is None else min(self.min, minimum)
+        if maximum is not None:
+            self.max = maximum if self.max is None else max(self.max, maximum)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max}
+
+
+def _get_key(name: str, labels: Dict[str, Any]) -> MetricKey:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(f'{label}="{value}"' for label, value in labels)
+    return f'{{{pairs}}}'
+
+
+class MetricsRegistry:
+    """ Thread-safe store of counters and histograms, each identified by a name and optional labels. """
+
+    def __init__(self):
+        self.counters: Dict[MetricKey, float] = {}
+        self.histograms: Dict[MetricKey, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = _get_key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = _get_key(name, labels)
+        with self._lock:
+            self._get_histogram(key).observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """ Observes the duration, in seconds, of the enclosed block in the named histogram. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _get_histogram(self, key: MetricKey) -> Histogram:
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        return histogram
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        """ Adds the metrics of a snapshot taken elsewhere (e.g. in a worker process) to this registry. """
+        with self._lock:
+            for counter in snapshot['counters']:
+                key = _get_key(counter['name'], counter['labels'])
+                self.counters[key] = self.counters.get(key, 0) + counter['value']
+            for histogram in snapshot['histograms']:
+                key = _get_key(histogram['name'], histogram['labels'])
+                self._get_histogram(key).merge(histogram['count'], histogram['sum'], histogram['min'],
+                                               histogram['max'])
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                'histograms': [
+                    dict({'name': name, 'labels': dict(labels)}, **histogram.to_dict())
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                ],
+            }
+
+    def flush(self, **context: Any) -> Dict[str, Any]:
+        """ Logs the metrics recorded since the last flush as a single JSON line, and resets them.
+
+        Args:
+            **context: Additional fields of the log entry, e.g. the name of the function.
+        """
+        snapshot = dict(context, **self.snapshot())
+        self.reset()
+        logger.info(json.dumps(dict({'message': 'metrics'}, **snapshot), sort_keys=True))
+        return snapshot
+
+    def to_prometheus(self) -> str:
+        """ Returns the metrics in the Prometheus text exposition format. Histograms are exposed as summaries. """
+        lines = []
+        with self._lock:
+            counter_names = sorted({name for name, _ in self.counters})
+            for counter_name in counter_names:
+                lines.append(f'# TYPE {counter_name} counter')
+                for (name, labels), value in sorted(self.counters.items()):
+                    if name == counter_name:
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+
+            histogram_names = sorted({name for name, _ in self.histograms})
+            for histogram_name in histogram_names:
+                lines.append(f'# TYPE {histogram_name} summary')
+                for (name, labels), histogram in sorted(self.histograms.items()):
+                    if name == histogram_name:
+                        lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+                        lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+increment = registry.increment
+observe = registry.observe
+timer = registry.timer
+flush = registry.flush
+
+
+def write_prometheus(path: str) -> None:
+    """ Writes the metrics recorded so far to a file, in the Prometheus text exposition format. """
+    with open(path, 'w', encoding='utf8') as f:
+        f.write(registry.to_prometheus())
+
+
+def flush_metrics(func: Callable) -> Callable:
+    """ Decorates a function (e.g. a Cloud Function entry point) to time each invocation, and flush the metrics
+    recorded during the invocation when it ends. """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        status = 'error'
+        try:
+            with timer('invocation_seconds', function=func.__name__):
+                result = func(*args, **kwargs)
+            status = 'ok'
+            return result
+        finally:
+            flush(function=func.__name__, status=status)
+
+    return wrapper
@@ -0,0 +1,96 @@
+"""
+This file contains code for reading filings straight out of ZIP archives, without extracting
+them to disk first.
+
+Netfile delivers each filing as a ZIP archive holding a single `Efile.txt` member (see
+`examples/zip`). An archive may hold one filing, named after the archive (`{filing_id}.zip`),
+or many. In a multi-filing archive, each filing is either a `{filing_id}/Efile.txt`,
+`{filing_id}.xml`, or `{filing_id}.txt` member, or a nested `{filing_id}.zip` archive as
+downloaded from Netfile. Archives are memory-mapped, so members are read from the page cache
+rather than copied through a file buffer.
+"""
+import mmap
+import os
+import re
+import zipfile
+from typing import IO, Any, Callable, Iterable, Iterator, List, Optional, Tuple, cast
+
+ARCHIVE_EXTENSION = '.zip'
+EFILE_NAME = 'Efile.txt'
+
+_MEMBER_PATTERN = re.compile(r'(?:^|/)(\d+)(?:/Efile\.txt|\.xml|\.txt|\.zip)$')
+
+
+def _get_filing_id(archive_path: str, member_name: str) -> Optional[str]:
+    """ Returns the ID of the filing stored in the given member, or None if the member does not hold a filing. """
+    if member_name == EFILE_NAME:
+        return os.path.basename(archive_path)[:-len(ARCHIVE_EXTENSION)]
+    match = _MEMBER_PATTERN.search(member_name)
+    return match[1] if match else None
+
+
+def _read_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> str:
+    if info.filename.endswith(ARCHIVE_EXTENSION):
+        # A filing as downloaded from Netfile, nested in a larger archive
+        with archive.open(info) as member, zipfile.ZipFile(member) as nested:
+            return nested.read(EFILE_NAME).decode('utf8').strip()
+    return archive.read(info).decode('utf8').strip()
+
+
+def _iter_members(archive_path: str, archive: zipfile.ZipFile) -> Iterator[Tuple[str, zipfile.ZipInfo]]:
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        filing_id = _get_filing_id(archive_path, info.filename)
+        if filing_id:
+            yield filing_id, info
+
+
+class _MappedFile:
+    """ Adapts a memory map to the file interface that `zipfile` expects, which includes `seekable`. """
+
+    def __init__(self, mapped: mmap.mmap):
+        self._mapped = mapped
+
+    @staticmethod
+    def seekable() -> bool:
+        return True
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._mapped, name)
+
+
+def read_archive(path: str, include: Callable[[str], bool] = lambda filing_id: True) \
+        -> Iterator[Tuple[str, str]]:
+    """ Yields the ID and XML of each filing in the archive for which `include` returns True. """
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            # Empty files cannot be mapped
+            raise zipfile.BadZipFile(f'{path} is empty')
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # _MappedFile has the file interface, but is not typed as a file
+            with zipfile.ZipFile(cast(IO[bytes], _MappedFile(mapped))) as archive:
+                for filing_id, info in _iter_members(path, archive):
+                    if include(filing_id):
+                        yield filing_id, _read_member(archive, info)
+
+
+def list_archive(path: str) -> List[str]:
+    """ Returns the IDs of the filings in the archive, without reading them. """
+    with zipfile.ZipFile(path) as archive:
+        return [filing_id for filing_id, _ in _iter_members(path, archive)]
+
+
+def write_archive(path: str, filings: Iterable[Tuple[str, str]]) -> int:
+    """ Writes the given filings to a multi-filing archive, as compressed `{filing_id}.xml` members.
+
+    Returns:
+        int: The number of filings written.
+    """
+    count = 0
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for filing_id, content in filings:
+            archive.writestr(f'{filing_id}.xml', content)
+            count += 1
+    return count
@@ -0,0 +1,49 @@
+"""
+This file contains code for reading and writing filing bundles. A bundle stores many
+filings in a single gzip-compressed JSON Lines file, with one `{"id": ..., "content": ...}`
+object per line. Storing a run's filings as a handful of bundles, rather than one file per
+filing, replaces thousands of small reads and writes with a few large sequential ones.
+"""
+import gzip
+import io
+import json
+from typing import IO, Iterable, Iterator, Tuple
+
+BUNDLE_EXTENSION = '.jsonl.gz'
+CONTENT_TYPE = 'application/gzip'
+
+
+def write_bundle(fileobj: IO[bytes], filings: Iterable[Tuple[str, str]]) -> int:
+    """ Writes the given filings to a binary file object.
+
+    Returns:
+        int: The number of filings written.
+    """
+    count = 0
+    with gzip.GzipFile(fileobj=fileobj, mode='wb') as gzip_file:
+        for filing_id, content in filings:
+            line = json.dumps({'id': filing_id, 'content': content}) + '\n'
+            gzip_file.write(line.encode('utf8'))
+            count += 1
+    return count
+
+
+def read_bundle(fileobj: IO[bytes]) -> Iterator[Tuple[str, str]]:
+    """ Yields the ID and XML of each filing in a binary file object. """
+    with gzip.GzipFile(fileobj=fileobj, mode='rb') as gzip_file:
+        for line in gzip_file:
+            if not line.strip():
+                continue
+
+            record = json.loads(line.decode('utf8'))
+            yield record['id'], record['content']
+
+
+def dump_bundle(filings: Iterable[Tuple[str, str]]) -> bytes:
+    buffer = io.BytesIO()
+    write_bundle(buffer, filings)
+    return buffer.getvalue()
+
+
+def load_bundle(data: bytes) -> Iterator[Tuple[str, str]]:
+    return read_bundle(io.BytesIO(data))
@@ -1,37 +1,86 @@
 """
 This file contains client code for the Netfile API.
 """
+import datetime
 import io
 import logging
+import os
+import random
+import time
 import zipfile
-from typing import Set
+from typing import Iterable, Iterator, Optional, Set, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from .. import metrics
+from ..concurrency import bounded_map
+from .archives import EFILE_NAME
 from .errors import DownloadError
 
 AID = 'coak'
-API_ROOT = 'https://netfile.com/Connect2/api'
+# Set the NETFILE_API_ROOT environment variable to point the client elsewhere, e.g. at a local stand-in (see `server`).
+API_ROOT = os.environ.get('NETFILE_API_ROOT', 'https://netfile.com/Connect2/api')
 DEFAULT_HEADERS = {
     'Accept': 'application/json',
 }
+DEFAULT_WORKERS = 8
+MAX_CONNECTIONS = 32
+# Responses to retry, since they signal throttling or a temporary outage. Retries wait for the Retry-After header of
+# the response, if any, and otherwise back off exponentially from RETRY_BACKOFF seconds.
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+MAX_RETRIES = 4
+RETRY_BACKOFF = 0.5
+MAX_RETRY_DELAY = 30.0
 
 logger = logging.getLogger(__name__)
 
+# A shared session lets requests reuse connections (and TLS handshakes) across calls and threads.
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONNECTIONS))
+session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONNECTIONS))
+
 
 def build_url(path: str) -> str:
     return f'{API_ROOT}/{path}'
 
 
-def get_filing_ids(form_type: int) -> Set[str]:
+def _get_retry_delay(response: requests.Response, attempt: int) -> float:
+    try:
+        delay = float(response.headers['Retry-After'])
+    except (KeyError, ValueError):
+        # Jitter the delay, so that concurrent downloads throttled together do not all retry together.
+        delay = RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1)
+    return min(delay, MAX_RETRY_DELAY)
+
+
+def _send(method: str, url: str, **kwargs) -> requests.Response:
+    """ Sends a request, and retries it while the API is throttling requests or temporarily unavailable. The last
+    response is returned, whatever its status. """
+    for attempt in range(MAX_RETRIES):
+        response = session.request(method, url, headers=DEFAULT_HEADERS, **kwargs)
+        if response.status_code not in RETRY_STATUS_CODES:
+            return response
+
+        response.close()
+        delay = _get_retry_delay(response, attempt)
+        metrics.increment('netfile_retries', status_code=response.status_code)
+        logger.warning(f'Received status code {response.status_code} from {url}. Retrying in {delay:.2f}s...')
+        time.sleep(delay)
+
+    return session.request(method, url, headers=DEFAULT_HEADERS, **kwargs)
+
+
+def iter_filing_ids(form_type: int, since: Optional[datetime.date] = None) -> Iterator[str]:
     """
-    Returns a list of filing IDs corresponding to the given form type.
+    Yields the IDs of the filings corresponding to the given form type, as each page of the list is retrieved. If
+    `since` is set, only the filings filed on or after that date are listed.
     """
     url = build_url('public/list/filing')
     page = 0
 
-    filings = set()
-    ignored_filings = set()
+    filings: Set[str] = set()
+    ignored_filings: Set[str] = set()
 
     while True:
         logger.info(f'Retrieving page {page} of form type {form_type} data...')
@@ -40,7 +89,11 @@ def get_filing_ids(form_type: int) -> Set[str]:
             'Form': form_type,
             'CurrentPageIndex': page,
         }
-        response = requests.post(url, data=data, headers=DEFAULT_HEADERS)
+        if since:
+            data['DateStart'] = since.isoformat()
+        with metrics.timer('netfile_list_page_seconds'):
+            response = _send('POST', url, data=data)
+        metrics.increment('netfile_list_pages')
 
         if response.status_code != 200:
             msg = f'Failed to download page {page} of the form type {form_type} data!'
@@ -60,11 +113,12 @@ def get_filing_ids(form_type: int) -> Set[str]:
 
         for datum in response_data:
             filing_id = str(datum['id'])
-            if datum.get('isEfiled', False):
-                filings.add(filing_id)
-            else:
+            if not datum.get('isEfiled', False):
                 ignored_filings.add(filing_id)
                 logger.info(f'Ignoring filing {filing_id}. This filing was not filed electronically.')
+            elif filing_id not in filings:
+                filings.add(filing_id)
+                yield filing_id
 
         page += 1
 
@@ -72,16 +126,25 @@ def get_filing_ids(form_type: int) -> Set[str]:
           f'were not filed electronically.'
     logger.info(msg)
 
-    return filings
+
+def get_filing_ids(form_type: int, since: Optional[datetime.date] = None) -> Set[str]:
+    """
+    Returns a list of filing IDs corresponding to the given form type. If `since` is set, only the filings filed on or
+    after that date are listed.
+    """
+    return set(iter_filing_ids(form_type, since))
 
 
 def download_filing(filing_id: str) -> str:
     """ Downloads the XML for the given filing. """
     logger.info(f'Downloading filing {filing_id}...')
     url = build_url(f'public/efile/{filing_id}')
-    response = requests.get(url, headers=DEFAULT_HEADERS, stream=True)
+    with metrics.timer('netfile_download_seconds'):
+        response = _send('GET', url, stream=True)
+        payload = response.content
 
     if response.status_code != 200:
+        metrics.increment('netfile_download_errors', status_code=response.status_code)
         msg = f'Failed to download filing {filing_id}!'
         try:
             content = response.json()
@@ -90,8 +153,21 @@ def download_filing(filing_id: str) -> str:
         logger.error(f'{msg}\nstatus_code: {response.status_code}\ncontent: {content}')
         raise DownloadError(msg)
 
-    downloaded_file = zipfile.ZipFile(io.BytesIO(response.content))
-    text = downloaded_file.read('Efile.txt').decode('utf8')
+    metrics.observe('netfile_download_bytes', len(payload))
+    with metrics.timer('netfile_unzip_seconds'):
+        downloaded_file = zipfile.ZipFile(io.BytesIO(payload))
+        text = downloaded_file.read(EFILE_NAME).decode('utf8')
+    metrics.increment('netfile_filings_downloaded')
 
     logger.info(f'Successfully downloaded filing {filing_id}.')
     return text.strip()
+
+
+def download_filings(filing_ids: Iterable[str], workers: int = DEFAULT_WORKERS) -> Iterator[Tuple[str, str]]:
+    """ Downloads the XML for the given filings concurrently.
+
+    Yields:
+        Tuple[str, str]: The filing ID and its XML, in the order of `filing_ids`.
+    """
+    workers = min(workers, MAX_CONNECTIONS)
+    return bounded_map(lambda filing_id: (filing_id, download_filing(filing_id)), filing_ids, workers)
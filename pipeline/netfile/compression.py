@@ -0,0 +1,36 @@
+"""
+This file contains code for compressing the XML of individual filings for storage.
+
+Form 700 XML is verbose and repetitive, so it shrinks several-fold under gzip. Filings are
+stored as `{filing_id}.xml.gz` files on disk, and as `{filing_id}.xml` blobs with a `gzip`
+Content-Encoding in Cloud Storage. Cloud Storage may decompress such blobs while serving
+them, so readers detect whether the data they get is compressed, which also lets them read
+filings stored uncompressed by earlier runs.
+"""
+import gzip
+import io
+
+GZIP_EXTENSION = '.gz'
+CONTENT_ENCODING = 'gzip'
+
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+def compress(content: str) -> bytes:
+    """ Returns the gzip-compressed UTF-8 encoding of the content. The output only depends on the content. """
+    buffer = io.BytesIO()
+    # NOTE: The modification time is written to the header. Fix it, so the same content compresses to the same bytes.
+    with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as gzip_file:
+        gzip_file.write(content.encode('utf8'))
+    return buffer.getvalue()
+
+
+def is_compressed(data: bytes) -> bool:
+    return data[:len(_GZIP_MAGIC)] == _GZIP_MAGIC
+
+
+def decompress(data: bytes) -> str:
+    """ Returns the content of compressed data, or of uncompressed UTF-8 encoded data. """
+    if is_compressed(data):
+        data = gzip.decompress(data)
+    return data.decode('utf8')
@@ -0,0 +1,144 @@
+"""
+This file contains code to compare two intermediary databases, e.g. those of two consecutive
+runs, row by row.
+
+Rows are matched on a key that is stable across runs: the ID of filings and offices, the ID
+and filing of schedules, and the ID and schedule (by its own key) of nested data, e.g. gifts.
+The auto-incrementing `internal_id` of schedules differs from one run to the next, so it is
+never compared. Matched rows are compared by a digest of their values, so only the digests of
+the previous database are held in memory.
+
+The changes to each table are written to a `{Model}.jsonl.gz` file, one change per line:
+`{"operation": "insert" | "update" | "delete", "key": [...], "row": {...}}`. Deleted rows
+only have a key.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple, Type
+
+from peewee import Model
+
+from .. import metrics
+from .models import AbstractSchedule, db, get_model_classes, get_schedule_reference
+
+logger = logging.getLogger(__name__)
+
+CHANGE_FILE_EXTENSION = '.jsonl.gz'
+OPERATIONS = ('insert', 'update', 'delete')
+
+_PREVIOUS = 'previous'
+
+
+class Change(NamedTuple):
+    operation: str
+    key: Tuple
+    # Values of the inserted or updated row, by column. None for deleted rows.
+    row: Optional[Dict[str, Any]]
+
+
+def _quote(name: str) -> str:
+    return f'"{name}"'
+
+
+def _build_query(model: Type[Model], schema: str) -> Tuple[str, List[str], int]:
+    """ Returns a query of the model's rows, the names of the selected columns, and the number of leading columns
+    that make up the key of a row. """
+    # pylint: disable=protected-access
+    reference = get_schedule_reference(model)
+    key_names = ['id', 'filing'] if issubclass(model, AbstractSchedule) else ['id']
+    fields = [field for field in model._meta.sorted_fields if field.name != 'internal_id' and field is not reference]
+    fields.sort(key=lambda field: key_names.index(field.name) if field.name in key_names else len(key_names))
+
+    names = [field.column_name for field in fields]
+    selections = [f'row.{_quote(name)}' for name in names]
+    joins = ''
+    if reference is not None:
+        # Replace the reference to the schedule's `internal_id` with the schedule's key.
+        schedule_table = f'{schema}.{_quote(reference.rel_model._meta.table_name)}'
+        joins = f' JOIN {schedule_table} AS schedule ON schedule.internal_id = row.{_quote(reference.column_name)}'
+        names[len(key_names):len(key_names)] = [f'{reference.name}_id', f'{reference.name}_filing_id']
+        selections[len(key_names):len(key_names)] = ['schedule.id', 'schedule.filing_id']
+        key_names += ['schedule.id', 'schedule.filing_id']
+
+    table = f'{schema}.{_quote(model._meta.table_name)}'
+    return f'SELECT {", ".join(selections)} FROM {table} AS row{joins}', names, len(key_names)
+
+
+def _get_digest(values: Tuple) -> bytes:
+    return hashlib.blake2b(json.dumps(values, default=str).encode('utf8'), digest_size=16).digest()
+
+
+def _has_table(schema: str, model: Type[Model]) -> bool:
+    # pylint: disable=protected-access
+    cursor = db.execute_sql(f'SELECT 1 FROM {schema}.sqlite_master WHERE type = ? AND name = ?',
+                            ('table', model._meta.table_name))
+    return cursor.fetchone() is not None
+
+
+def diff_model(model: Type[Model], schema: str = _PREVIOUS) -> Iterator[Change]:
+    """ Yields the changes to the model's rows, from the database attached as `schema` to the current database. """
+    query, names, key_length = _build_query(model, 'main')
+    previous: Dict[Tuple, bytes] = {}
+    if _has_table(schema, model):
+        previous_query, _, _ = _build_query(model, schema)
+        for values in db.execute_sql(previous_query):
+            previous[tuple(values[:key_length])] = _get_digest(values)
+
+    for values in db.execute_sql(query):
+        key = tuple(values[:key_length])
+        digest = previous.pop(key, None)
+        if digest is None:
+            yield Change('insert', key, dict(zip(names, values)))
+        elif digest != _get_digest(values):
+            yield Change('update', key, dict(zip(names, values)))
+
+    for key in sorted(previous, key=str):
+        yield Change('delete', key, None)
+
+
+def write_changes(previous_path: str, directory: str) -> Dict[str, Dict[str, int]]:
+    """ Writes the changes from the database at `previous_path` to the current database to the directory, as a change
+    file per model. Models without changes get no file.
+
+    Returns:
+        dict: The number of changes by operation, by model name.
+    """
+    if not os.path.exists(previous_path):
+        raise FileNotFoundError(f'Previous database {previous_path} does not exist.')
+    os.makedirs(directory, exist_ok=True)
+    db.connect(reuse_if_open=True)
+
+    summary: Dict[str, Dict[str, int]] = {}
+    # NOTE: SQLite does not allow ATTACH or DETACH to run inside a transaction.
+    db.execute_sql(f'ATTACH DATABASE ? AS {_PREVIOUS}', (previous_path,))
+    try:
+        for model in get_model_classes():
+            counts = dict.fromkeys(OPERATIONS, 0)
+            path = os.path.join(directory, f'{model.__name__}{CHANGE_FILE_EXTENSION}')
+            with metrics.timer('diff_seconds', model=model.__name__), gzip.open(path, 'wt', encoding='utf8') as f:
+                for change in diff_model(model):
+                    f.write(json.dumps(change._asdict(), default=str) + '\n')
+                    counts[change.operation] += 1
+
+            if not any(counts.values()):
+                os.remove(path)
+            for operation, count in counts.items():
+                metrics.increment('diff_rows', count, model=model.__name__, operation=operation)
+            summary[model.__name__] = counts
+    finally:
+        db.execute_sql(f'DETACH DATABASE {_PREVIOUS}')
+
+    total = sum(sum(counts.values()) for counts in summary.values())
+    logger.info(f'Wrote {total} changes from {previous_path} to {directory}.')
+    return summary
+
+
+def read_changes(path: str) -> Iterator[Change]:
+    """ Yields the changes in a change file written by `write_changes`. """
+    with gzip.open(path, 'rt', encoding='utf8') as f:
+        for line in f:
+            record = json.loads(line)
+            yield Change(record['operation'], tuple(record['key']), record['row'])
@@ -0,0 +1,200 @@
+"""
+This file contains code to resolve the businesses, income sources, and gift sources named in
+the schedules to entities, across the spellings of their names.
+
+Names are first normalized (see `normalize_name`), and names that normalize to the same string
+are the same entity. Comparing every pair of the remaining names would take quadratic time, so
+the names are grouped into blocks by locality-sensitive hashing: the character trigrams of each
+name are summarized by a MinHash signature, and the signature is split into bands. Names that
+agree on every value of a band share a block, which is likely if their trigrams are similar.
+Only the names that share a block are compared, by the Jaccard similarity of their trigrams,
+and similar names are joined into an entity.
+
+Names that normalize to an empty string (e.g. "LLC" or "Inc.") do not identify an entity, so
+they are left unresolved. If there are more than `MAX_NAME_COUNT` distinct names, they are not
+compared, and only names that normalize to the same string are the same entity.
+"""
+import logging
+import random
+import re
+import unicodedata
+import zlib
+from array import array
+from collections import Counter, defaultdict
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from .. import metrics
+from .utils import clean_string
+
+logger = logging.getLogger(__name__)
+
+# Words that do not tell entities apart, e.g. "Acme" and "Acme, Inc."
+IGNORED_WORDS = frozenset((
+    'a', 'an', 'and', 'co', 'company', 'corp', 'corporation', 'inc', 'incorporated', 'llc', 'llp', 'lp', 'ltd',
+    'limited', 'of', 'plc', 'the',
+))
+
+SHINGLE_SIZE = 3
+# With 20 bands of 5 values, names whose trigrams are 60% similar share a block 80% of the time, and names that are
+# 80% similar almost always do, while names that are 40% similar rarely do (18%).
+BAND_COUNT = 20
+BAND_SIZE = 5
+# NOTE: The trigrams and signatures of every distinct name are held at once. A signature is 100 unsigned 64-bit hashes
+# (about 900 bytes with the array's overhead), and the trigrams of a typical name take about 2 KB more. At about 3 KB
+# per name, the 256 MB of `process-netfile-filings` holds some 50,000 names alongside the rest of the export. Beyond
+# that, only names that normalize to the same string are joined.
+MAX_NAME_COUNT = 50000
+# Names in the same block are joined if the Jaccard similarity of their trigrams is at least this high.
+SIMILARITY_THRESHOLD = 0.6
+# Blocks larger than this are skipped, since they cost quadratic time and mostly hold dissimilar names.
+MAX_BLOCK_SIZE = 200
+
+_PRIME = (1 << 61) - 1
+_random = random.Random(0)
+_PERMUTATIONS = [
+    (_random.randrange(1, _PRIME), _random.randrange(0, _PRIME)) for _ in range(BAND_COUNT * BAND_SIZE)
+]
+
+
+def normalize_name(name: str) -> str:
+    """ Returns the name in lower case, without diacritics, punctuation, or words in `IGNORED_WORDS`. """
+    name = unicodedata.normalize('NFKD', clean_string(name) or '')
+    name = ''.join(character for character in name if not unicodedata.combining(character)).lower()
+    name = re.sub(r'[^\w\s]', ' ', name.replace('&', ' and ').replace("'", ''))
+    return ' '.join(word for word in name.split() if word not in IGNORED_WORDS)
+
+
+def get_shingles(normalized_name: str) -> FrozenSet[str]:
+    """ Returns the character trigrams of the name, ignoring spaces, so "J P Morgan" and "JP Morgan" match. """
+    compact = normalized_name.replace(' ', '')
+    if len(compact) <= SHINGLE_SIZE:
+        return frozenset((compact,))
+    return frozenset(compact[index:index + SHINGLE_SIZE] for index in range(len(compact) - SHINGLE_SIZE + 1))
+
+
+def _hash_shingle(shingle: str) -> array:
+    value = zlib.crc32(shingle.encode('utf8'))
+    # NOTE: The hashes are below 2 ** 61, so they fit unsigned 64-bit integers, a fifth of the memory of Python ints.
+    return array('Q', ((a * value + b) % _PRIME for a, b in _PERMUTATIONS))
+
+
+def _get_signature(shingles: FrozenSet[str], cache: Dict[str, array]) -> array:
+    """ Returns the MinHash signature of the shingles. The hashes of each shingle are cached, since there are far
+    fewer distinct trigrams than names. """
+    hashes = []
+    for shingle in shingles:
+        shingle_hashes = cache.get(shingle)
+        if shingle_hashes is None:
+            shingle_hashes = cache[shingle] = _hash_shingle(shingle)
+        hashes.append(shingle_hashes)
+    return array('Q', map(min, zip(*hashes)))
+
+
+def _get_similarity(first: FrozenSet[str], second: FrozenSet[str]) -> float:
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared)
+
+
+class _DisjointSets:
+    def __init__(self, size: int):
+        self._parents = list(range(size))
+
+    def find(self, index: int) -> int:
+        while self._parents[index] != index:
+            self._parents[index] = self._parents[self._parents[index]]
+            index = self._parents[index]
+        return index
+
+    def union(self, first: int, second: int) -> bool:
+        first, second = self.find(first), self.find(second)
+        if first == second:
+            return False
+        self._parents[max(first, second)] = min(first, second)
+        return True
+
+
+def resolve_names(normalized_names: Iterable[str]) -> Dict[str, int]:
+    """ Groups similar names into entities. Empty names are ignored.
+
+    Returns:
+        dict: The index of the entity of each distinct name. Indexes are only meaningful within the result.
+    """
+    names = sorted(set(filter(None, normalized_names)))
+    if len(names) > MAX_NAME_COUNT:
+        logger.warning(f'Not comparing {len(names)} names, more than {MAX_NAME_COUNT}. Only identical normalized names '
+                       f'are resolved to the same entity.')
+        return {name: index for index, name in enumerate(names)}
+    shingles = [get_shingles(name) for name in names]
+
+    cache: Dict[str, array] = {}
+    signatures = [_get_signature(name_shingles, cache) for name_shingles in shingles]
+    del cache
+
+    sets = _DisjointSets(len(names))
+    compared: Set[Tuple[int, int]] = set()
+    skipped_blocks = 0
+    # Names are blocked one band at a time, so only the blocks of a single band are held in memory.
+    for start in range(0, BAND_COUNT * BAND_SIZE, BAND_SIZE):
+        blocks: Dict[bytes, List[int]] = defaultdict(list)
+        for index, signature in enumerate(signatures):
+            blocks[signature[start:start + BAND_SIZE].tobytes()].append(index)
+
+        for members in blocks.values():
+            if len(members) > MAX_BLOCK_SIZE:
+                skipped_blocks += 1
+                continue
+            for position, first in enumerate(members):
+                for second in members[position + 1:]:
+                    if (first, second) in compared or sets.find(first) == sets.find(second):
+                        continue
+                    compared.add((first, second))
+                    if _get_similarity(shingles[first], shingles[second]) >= SIMILARITY_THRESHOLD:
+                        sets.union(first, second)
+
+    metrics.increment('entity_candidate_pairs', len(compared))
+    if skipped_blocks:
+        logger.warning(f'Skipped {skipped_blocks} blocks of more than {MAX_BLOCK_SIZE} names.')
+    return {name: sets.find(index) for index, name in enumerate(names)}
+
+
+class ResolvedEntity(NamedTuple):
+    id: int
+    # The most common spelling of the entity's name
+    name: str
+    normalized_name: str
+    mention_count: int
+
+
+def resolve_entities(names: Iterable[Optional[str]]) -> Tuple[List[ResolvedEntity], Dict[str, int]]:
+    """ Resolves names, one per mention of an entity, to entities.
+
+    Returns:
+        tuple: The entities, numbered in order of their names, and the ID of the entity of each distinct name. Names
+            that are blank or normalize to an empty string have no entity.
+    """
+    cleaned_names = (clean_string(name) for name in names)
+    spellings = Counter(name for name in cleaned_names if name)
+    normalized_names = {name: normalize_name(name) for name in spellings}
+    unresolved = [name for name, normalized_name in normalized_names.items() if not normalized_name]
+    for name in unresolved:
+        del spellings[name]
+    groups = resolve_names(normalized_names.values())
+
+    group_spellings: Dict[int, Counter] = defaultdict(Counter)
+    for name, count in spellings.items():
+        group_spellings[groups[normalized_names[name]]][name] = count
+    canonical_names = {
+        group: min(counts.items(), key=lambda item: (-item[1], item[0]))[0] for group, counts in group_spellings.items()
+    }
+
+    entities = []
+    entity_ids: Dict[int, int] = {}
+    for entity_id, group in enumerate(sorted(canonical_names, key=lambda group: canonical_names[group]), 1):
+        name = canonical_names[group]
+        entities.append(ResolvedEntity(entity_id, name, normalize_name(name), sum(group_spellings[group].values())))
+        entity_ids[group] = entity_id
+
+    metrics.observe('entities_resolved', len(entities))
+    logger.info(f'Resolved {sum(spellings.values())} mentions of {len(spellings)} names to {len(entities)} entities. '
+                f'{len(unresolved)} names without distinguishing words were not resolved.')
+    return entities, {name: entity_ids[groups[normalized_names[name]]] for name in spellings}
@@ -2,19 +2,57 @@
 This file contains database model definitions. We use these models
 to aid in working with a temporary database for data cleansing.
 """
+import codecs
 import csv
 import io
 import logging
 import os
-from typing import Any, List, Tuple
-
-from peewee import AutoField, BooleanField, CharField, DecimalField, ForeignKeyField, IntegerField, Model, UUIDField
+import shutil
+import sys
+import tempfile
+import time
+from typing import IO, Any, Callable, Iterator, List, Optional, Tuple, Type
+
+from peewee import (
+    AutoField, BooleanField, CharField, DecimalField, ForeignKeyField, IntegerField, Model, UUIDField, chunked
+)
 from playhouse.dataset import DataSet
 from playhouse.sqlite_ext import SqliteExtDatabase, TimestampField
 
+from .. import metrics
+from .entities import resolve_entities
+from .utils import clean_string
+
 DATABASE: str = '/tmp/reporting.db'
+INSERT_BATCH_SIZE = 500
+
+
+class InstrumentedSqliteExtDatabase(SqliteExtDatabase):  # pylint: disable=abstract-method
+    """ SQLite database that reports each statement it executes, and its duration, to the registered listeners.
+
+    Listeners are opt-in (see `queries.record_queries`), so statements are executed as usual when there are none.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.listeners: List[Callable[[str, Any, float], None]] = []
 
-db = SqliteExtDatabase(
+    def execute_sql(self, sql, *args, **kwargs):  # pylint: disable=arguments-differ
+        # The arguments are passed on unchanged, since peewee's defaults decide whether to commit.
+        if not self.listeners:
+            return super().execute_sql(sql, *args, **kwargs)
+
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, *args, **kwargs)
+        finally:
+            duration = time.perf_counter() - start
+            params = args[0] if args else kwargs.get('params')
+            for listener in self.listeners:
+                listener(sql, params, duration)
+
+
+db = InstrumentedSqliteExtDatabase(
     DATABASE,
     pragmas=(
         ('foreign_keys', 1),  # Enforce foreign-key constraints
@@ -28,14 +66,27 @@ def close_connection():
         db.close()
 
 
+def use_database(path: str, enforce_foreign_keys: bool = True) -> None:
+    """ Points the models at the SQLite database at the given path.
+
+    Args:
+        path (str): Path of the database file.
+        enforce_foreign_keys (bool): Disable this for databases holding a subset of the filings, where an amendment
+            may reference a filing stored in a different database.
+    """
+    close_connection()
+    db.init(path, pragmas=(('foreign_keys', int(enforce_foreign_keys)),))
+
+
 def destroy_database():
     close_connection()
+    database = db.database
 
-    if os.path.exists(DATABASE):
-        os.remove(DATABASE)
-        logger.info(f'Deleted database: {DATABASE}')
+    if os.path.exists(database):
+        os.remove(database)
+        logger.info(f'Deleted database: {database}')
     else:
-        logger.info(f'Database {DATABASE} not deleted since it does not exist.')
+        logger.info(f'Database {database} not deleted since it does not exist.')
 
 
 class BaseModel(Model):
@@ -250,30 +301,375 @@ class ScheduleE(AbstractSchedule):
     type_of_payment = CharField(choices=type_of_payment_choices)
 
 
+# Columns of the schedules that name a business, income source, or gift source (see `Entity`)
+ENTITY_COLUMNS: Tuple[Tuple[Type[Model], str], ...] = (
+    (ScheduleA1, 'name_of_business_entity'),
+    (ScheduleC1, 'name_of_income_source'),
+    (ScheduleD, 'name_of_source'),
+    (ScheduleE, 'name_of_source'),
+)
+
+
+class DerivedModel(BaseModel):
+    """ Base class for tables computed from the parsed data when it is exported, rather than parsed from filings. """
+
+
+class LatestFiling(DerivedModel):
+    """ The effective filing of each filer and report year: the latest filing that has not been amended.
+
+    `chain_depth` is the number of amendments between the filing and the original filing of its amendment chain, so
+    an original filing that was never amended has a depth of 0.
+    """
+    filer_id = CharField()
+    report_year = IntegerField()
+    filing = ForeignKeyField(Form700Filing)
+    chain_depth = IntegerField()
+
+    class Meta:
+        indexes = (
+            (('filer_id', 'report_year'), True),
+        )
+
+
+class Entity(DerivedModel):
+    """ A business, income source, or gift source, resolved across the spellings of its name (see `entities`). """
+    id = IntegerField(primary_key=True)
+    # The most common spelling of the entity's name
+    name = CharField()
+    normalized_name = CharField()
+    mention_count = IntegerField()
+
+
+class EntityMention(DerivedModel):
+    """ Maps a schedule row that names an entity to the entity. Rows whose name has no entity (see `entities`) have no
+    mention. """
+    entity = ForeignKeyField(Entity, backref='mentions')
+    # Name of the schedule model, and the key of the row in its table
+    model = CharField()
+    schedule_id = UUIDField()
+    filing = ForeignKeyField(Form700Filing)
+    name = CharField()
+
+    class Meta:
+        indexes = (
+            (('model', 'schedule_id', 'filing'), True),
+        )
+
+
+class FilingSummary(DerivedModel):
+    """ The number of rows of each schedule, and of its nested data, e.g. gifts, in each filing, with their total
+    amount for models that have an `amount`. Schedules without rows in a filing have no summary. """
+    filing = ForeignKeyField(Form700Filing)
+    filer_id = CharField()
+    report_year = IntegerField()
+    # Name of the schedule model, e.g. ScheduleDGift
+    schedule = CharField()
+    row_count = IntegerField()
+    total_amount = DecimalField(decimal_places=2, null=True)
+
+    class Meta:
+        indexes = (
+            (('filing', 'schedule'), True),
+        )
+
+
+class FilerYearSummary(DerivedModel):
+    """ The summaries (see `FilingSummary`) of the effective filing of each filer and report year (see
+    `LatestFiling`). """
+    filer_id = CharField()
+    report_year = IntegerField()
+    filing = ForeignKeyField(Form700Filing)
+    schedule = CharField()
+    row_count = IntegerField()
+    total_amount = DecimalField(decimal_places=2, null=True)
+
+    class Meta:
+        indexes = (
+            (('filer_id', 'report_year', 'schedule'), True),
+        )
+
+
+class ValueDistribution(DerivedModel):
+    """ The number of rows in each value range (choice) of the columns in `DISTRIBUTION_COLUMNS`, in the effective
+    filing of each filer and report year.
+
+    `bucket_position` is the position of the range in the column's choices, so ranges sort from low to high. Rows
+    without a value are counted in a bucket of None.
+    """
+    filer_id = CharField()
+    report_year = IntegerField()
+    filing = ForeignKeyField(Form700Filing)
+    schedule = CharField()
+    column_name = CharField()
+    bucket = CharField(null=True)
+    bucket_position = IntegerField(null=True)
+    row_count = IntegerField()
+
+    class Meta:
+        indexes = (
+            (('filer_id', 'report_year', 'schedule', 'column_name', 'bucket'), True),
+        )
+
+
+class GiftSourceTotal(DerivedModel):
+    """ The gifts from each source (see `Entity`) in each report year: gifts on schedule D, and gifts of travel on
+    schedule E. Only the effective filing of each filer and report year is counted. """
+    entity = ForeignKeyField(Entity, backref='gift_totals')
+    report_year = IntegerField()
+    filer_count = IntegerField()
+    gift_count = IntegerField()
+    total_amount = DecimalField(decimal_places=2)
+
+    class Meta:
+        indexes = (
+            (('entity', 'report_year'), True),
+        )
+
+
+# Columns of the schedules whose value ranges are counted in `ValueDistribution`
+DISTRIBUTION_COLUMNS: Tuple[Tuple[Type[Model], str], ...] = (
+    (ScheduleA1, 'fair_market_value'),
+    (ScheduleA2, 'fair_market_value'),
+    (ScheduleA2, 'gross_income_received'),
+    (ScheduleB, 'fair_market_value'),
+    (ScheduleB, 'gross_income_received'),
+    (ScheduleC1, 'gross_income_received'),
+)
+
+
 def get_model_classes() -> List[Model]:
+    """ Returns the models of the data parsed from filings. """
     classes = [cls for cls in BaseModel.__subclasses__()]
     classes += [cls for cls in AbstractSchedule.__subclasses__()]
     classes.remove(AbstractSchedule)
+    classes.remove(DerivedModel)
     return classes
 
 
+def get_derived_model_classes() -> List[Model]:
+    """ Returns the models of the tables computed from the parsed data (see `build_derived_tables`). """
+    return list(DerivedModel.__subclasses__())
+
+
+def get_export_model_classes() -> List[Model]:
+    return get_model_classes() + get_derived_model_classes()
+
+
+def get_schedule_reference(model: Type[Model]) -> Optional[ForeignKeyField]:
+    """ Returns the foreign key of nested data to its schedule, which references the schedule's `internal_id`, or None
+    if the model is not nested in a schedule. """
+    meta = model._meta  # pylint: disable=protected-access
+    for field in meta.refs:
+        if issubclass(field.rel_model, AbstractSchedule):
+            return field
+    return None
+
+
+def _get_table_name(model: Type[Model]) -> str:
+    return model._meta.table_name  # pylint: disable=protected-access
+
+
 def build_tables():
     close_connection()
     db.connect(reuse_if_open=True)
-    db.create_tables(get_model_classes())
+    db.create_tables(get_export_model_classes())
+
+
+def _build_latest_filings() -> None:
+    filings = _get_table_name(Form700Filing)
+    # Walk each amendment chain from its original filing. The heads of the chains, which no filing amends, are the
+    # effective filings, of which the latest signed one wins for each filer and report year. The latest head is the one
+    # that no later head exists for, rather than the first by ROW_NUMBER(), since window functions need SQLite 3.25.
+    # IS compares the filer IDs and report years so that NULLs are equal, as they are when grouping.
+    db.execute_sql(f'''
+        INSERT INTO "{_get_table_name(LatestFiling)}" (filer_id, report_year, filing_id, chain_depth)
+        WITH RECURSIVE chains(id, depth) AS (
+            SELECT id, 0 FROM "{filings}" WHERE amends_id IS NULL
+            UNION ALL
+            SELECT filing.id, chains.depth + 1 FROM "{filings}" AS filing JOIN chains ON filing.amends_id = chains.id
+        ), heads AS (
+            SELECT filing.filer_id, filing.report_year, filing.id, filing.date_signed, chains.depth
+            FROM "{filings}" AS filing JOIN chains ON chains.id = filing.id
+            WHERE NOT EXISTS (SELECT 1 FROM "{filings}" AS amendment WHERE amendment.amends_id = filing.id)
+        )
+        SELECT filer_id, report_year, id, depth FROM heads AS head
+        WHERE NOT EXISTS (
+            SELECT 1 FROM heads AS later
+            WHERE later.filer_id IS head.filer_id AND later.report_year IS head.report_year
+                AND (later.date_signed > head.date_signed
+                     OR later.date_signed = head.date_signed AND later.id > head.id)
+        )
+    ''')
+
+
+def _iter_entity_mentions() -> Iterator[Tuple[str, str, str, str]]:
+    """ Yields the model name, schedule ID, filing ID, and cleaned name of each schedule row that names an entity. """
+    for model, column in ENTITY_COLUMNS:
+        for schedule_id, filing_id, name in db.execute_sql(
+                f'SELECT id, filing_id, "{column}" FROM "{_get_table_name(model)}" '
+                f'WHERE COALESCE("{column}", \'\') != \'\''):
+            # Names of only whitespace are blank once cleaned.
+            name = clean_string(name)
+            if name:
+                yield model.__name__, schedule_id, filing_id, name
+
+
+def _build_entities() -> None:
+    mentions = list(_iter_entity_mentions())
+    entities, entity_ids = resolve_entities(name for _, _, _, name in mentions)
+
+    for batch in chunked((entity._asdict() for entity in entities), INSERT_BATCH_SIZE):
+        db.execute(Entity.insert_many(batch))
+    rows = (
+        {'entity': entity_ids[name], 'model': model, 'schedule_id': schedule_id, 'filing': filing_id, 'name': name}
+        for model, schedule_id, filing_id, name in mentions
+        # Names without distinguishing words are left unresolved.
+        if name in entity_ids
+    )
+    for batch in chunked(rows, INSERT_BATCH_SIZE):
+        db.execute(EntityMention.insert_many(batch))
+
+
+def _get_count_query(model: Type[Model]) -> Optional[str]:
+    """ Returns a query of the number of rows of the schedule, or of its nested data, and their total amount, by
+    filing. """
+    meta = model._meta  # pylint: disable=protected-access
+    amount = 'ROUND(SUM(row.amount), 2)' if 'amount' in meta.fields else 'NULL'
+    table = f'"{_get_table_name(model)}" AS row'
+    filing = 'row.filing_id'
+    if not issubclass(model, AbstractSchedule):
+        reference = get_schedule_reference(model)
+        if reference is None:
+            return None
+        table += (f' JOIN "{_get_table_name(reference.rel_model)}" AS schedule'
+                  f' ON schedule.internal_id = row."{reference.column_name}"')
+        filing = 'schedule.filing_id'
+    return (f"SELECT {filing} AS filing_id, '{model.__name__}' AS schedule, COUNT(*) AS row_count, "
+            f'{amount} AS total_amount FROM {table} GROUP BY {filing}')
+
+
+def _build_summaries() -> None:
+    counts = ' UNION ALL '.join(filter(None, map(_get_count_query, get_model_classes())))
+    db.execute_sql(f'''
+        INSERT INTO "{_get_table_name(FilingSummary)}" (filing_id, filer_id, report_year, schedule, row_count,
+            total_amount)
+        SELECT filing.id, filing.filer_id, filing.report_year, counts.schedule, counts.row_count, counts.total_amount
+        FROM ({counts}) AS counts JOIN "{_get_table_name(Form700Filing)}" AS filing ON filing.id = counts.filing_id
+    ''')
+    # The summaries of the effective filings are copied, rather than counted again from the schedules.
+    db.execute_sql(f'''
+        INSERT INTO "{_get_table_name(FilerYearSummary)}" (filer_id, report_year, filing_id, schedule, row_count,
+            total_amount)
+        SELECT latest.filer_id, latest.report_year, latest.filing_id, summary.schedule, summary.row_count,
+            summary.total_amount
+        FROM "{_get_table_name(LatestFiling)}" AS latest
+        JOIN "{_get_table_name(FilingSummary)}" AS summary ON summary.filing_id = latest.filing_id
+    ''')
+
+
+def _build_value_distributions() -> None:
+    queries = []
+    params: List[Any] = []
+    for model, column in DISTRIBUTION_COLUMNS:
+        choices = getattr(model, f'{column}_choices')
+        positions = ' '.join('WHEN ? THEN ?' for _ in choices)
+        queries.append(
+            f"SELECT latest.filer_id, latest.report_year, latest.filing_id, '{model.__name__}', '{column}', "
+            f'row."{column}", CASE row."{column}" {positions} END, COUNT(*) '
+            f'FROM "{_get_table_name(LatestFiling)}" AS latest '
+            f'JOIN "{_get_table_name(model)}" AS row ON row.filing_id = latest.filing_id '
+            f'GROUP BY latest.filing_id, row."{column}"'
+        )
+        params += [value for position, choice in enumerate(choices) for value in (choice, position)]
+
+    db.execute_sql(
+        f'INSERT INTO "{_get_table_name(ValueDistribution)}" (filer_id, report_year, filing_id, schedule, column_name, '
+        f'bucket, bucket_position, row_count) {" UNION ALL ".join(queries)}',
+        params
+    )
 
 
-def _table_to_csv(dataset: DataSet, table_name: str) -> io.StringIO:
-    buffer = io.StringIO()
-    table = dataset[table_name]
-    dataset.freeze(table.all(), format='csv', file_obj=buffer, quoting=csv.QUOTE_ALL)
-    buffer.seek(0)
-    return buffer
+def _build_gift_source_totals() -> None:
+    db.execute_sql(f'''
+        INSERT INTO "{_get_table_name(GiftSourceTotal)}" (entity_id, report_year, filer_count, gift_count,
+            total_amount)
+        WITH gifts(model, schedule_id, filing_id, amount) AS (
+            SELECT ?, schedule.id, schedule.filing_id, gift.amount
+            FROM "{_get_table_name(ScheduleDGift)}" AS gift
+            JOIN "{_get_table_name(ScheduleD)}" AS schedule ON schedule.internal_id = gift.schedule_id
+            UNION ALL
+            SELECT ?, id, filing_id, amount FROM "{_get_table_name(ScheduleE)}" WHERE type_of_payment = 'gift'
+        )
+        SELECT mention.entity_id, latest.report_year, COUNT(DISTINCT latest.filer_id), COUNT(*),
+            ROUND(SUM(gifts.amount), 2)
+        FROM gifts
+        JOIN "{_get_table_name(LatestFiling)}" AS latest ON latest.filing_id = gifts.filing_id
+        JOIN "{_get_table_name(EntityMention)}" AS mention ON mention.model = gifts.model
+            AND mention.schedule_id = gifts.schedule_id AND mention.filing_id = gifts.filing_id
+        GROUP BY mention.entity_id, latest.report_year
+    ''', (ScheduleD.__name__, ScheduleE.__name__))
+
+
+def build_derived_tables() -> None:
+    """ Recomputes the derived tables from the parsed data. """
+    # Each table is built from the parsed data and the tables built before it.
+    builders = (
+        (LatestFiling, _build_latest_filings),
+        (Entity, _build_entities),
+        (FilingSummary, _build_summaries),
+        (ValueDistribution, _build_value_distributions),
+        (GiftSourceTotal, _build_gift_source_totals),
+    )
+    db.connect(reuse_if_open=True)
+    db.create_tables(get_derived_model_classes())
+    with db.atomic():
+        # Referencing tables are emptied before the tables they reference.
+        for model in reversed(get_derived_model_classes()):
+            model.truncate_table()
+        for model, build in builders:
+            with metrics.timer('derive_seconds', table=_get_table_name(model)):
+                build()
+
+
+def iter_csv_exports(get_spool_size: Callable[[], int]) -> Iterator[Tuple[Model, IO[bytes]]]:
+    """ Exports each table, including the derived tables, which are recomputed first, as UTF-8 encoded CSV, one table
+    at a time.
+
+    Each export is held in memory up to `get_spool_size()` bytes (called before each table), and is spilled to a
+    temporary file beyond that. The file of a table is closed, and its memory released, when the next table is
+    exported.
+    """
+    build_derived_tables()
+    db.close()
+    dataset = DataSet(f'sqlite:///{db.database}')
+    try:
+        for model in get_export_model_classes():
+            table_name = _get_table_name(model)
+            spool_size = get_spool_size()
+            with tempfile.SpooledTemporaryFile(max_size=spool_size) as export:
+                if not spool_size:
+                    # A maximum size of 0 means no maximum, so write to the file from the start.
+                    export.rollover()
+                # Spooled files are not io.IOBase instances before Python 3.8, so they can't be wrapped in an
+                # io.TextIOWrapper.
+                text = codecs.getwriter('utf8')(export)
+                with metrics.timer('export_seconds', table=table_name):
+                    dataset.freeze(dataset[table_name].all(), format='csv', file_obj=text, quoting=csv.QUOTE_ALL)
+
+                metrics.observe('export_bytes', export.tell(), table=table_name)
+                export.seek(0)
+                yield model, export
+    finally:
+        dataset.close()
 
 
 def export_data_to_csv() -> List[Tuple[Model, io.StringIO]]:
-    db.close()
-    dataset = DataSet(f'sqlite:///{DATABASE}')
-    models = get_model_classes()
-    # pylint: disable=protected-access
-    return [(model, _table_to_csv(dataset, model._meta.table_name)) for model in models]
+    """ Exports each table, like `iter_csv_exports`, but holds every export in memory at once. """
+    exports = []
+    for model, export in iter_csv_exports(lambda: sys.maxsize):
+        buffer = io.StringIO(newline='')
+        # Decoded in chunks, so the export isn't held twice as bytes and once as a string
+        shutil.copyfileobj(codecs.getreader('utf8')(export), buffer)
+        buffer.seek(0)
+        exports.append((model, buffer))
+    return exports
@@ -4,10 +4,12 @@ import xml.etree.ElementTree as ET
 from typing import List, Optional, Tuple
 from uuid import UUID
 
+from .. import metrics
 from .models import (
     BaseModel, Form700Filing, Office, ScheduleA1, ScheduleA2, ScheduleB, ScheduleBIncomeSource, ScheduleC1, ScheduleC2,
     ScheduleD, ScheduleDGift, ScheduleE, db
 )
+from .queries import query_scope
 from .utils import clean_boolean, clean_choice, clean_datetime, clean_decimal, clean_integer, clean_string
 
 logger = logging.getLogger(__name__)
@@ -317,37 +319,45 @@ def _save_models(instances: List[BaseModel]) -> None:
     for instance in instances:
         instance.save(force_insert=True)
 
+    if instances:
+        metrics.increment('rows_inserted', len(instances), model=type(instances[0]).__name__)
+
 
 def parse_filing(filing_id: str, raw_data: str) -> Form700Filing:
     logger.info(f'Parsing Form 700 filing {filing_id}')
-    xml_tree = ET.fromstring(raw_data)
+    with metrics.timer('parse_xml_seconds'):
+        xml_tree = ET.fromstring(raw_data)
     filing = Form700Filing(id=filing_id)
 
-    with db.atomic() as transaction:
+    with query_scope(filing_id), db.atomic() as transaction:
         try:
-            filing = _parse_cover(filing, xml_tree)
-            filing = _parse_comments(filing, xml_tree)
-            offices = _parse_offices(filing, xml_tree)
-            schedule_a1_attachments = _parse_schedule_a1_attachments(filing, xml_tree)
-            schedule_a2_attachments = _parse_schedule_a2_attachments(filing, xml_tree)
-            schedule_b_attachments, schedule_b_income_sources = _parse_schedule_b_attachments(filing, xml_tree)
-            schedule_c1_attachments = _parse_schedule_c1_attachments(filing, xml_tree)
-            schedule_c2_attachments = _parse_schedule_c2_attachments(filing, xml_tree)
-            schedule_d_attachments, schedule_d_gifts = _parse_schedule_d_attachments(filing, xml_tree)
-            schedule_e_attachments = _parse_schedule_e_attachments(filing, xml_tree)
-            _save_models([filing])
-            _save_models(offices)
-            _save_models(schedule_a1_attachments)
-            _save_models(schedule_a2_attachments)
-            _save_models(schedule_b_attachments)
-            _save_models(schedule_b_income_sources)
-            _save_models(schedule_c1_attachments)
-            _save_models(schedule_c2_attachments)
-            _save_models(schedule_d_attachments)
-            _save_models(schedule_d_gifts)
-            _save_models(schedule_e_attachments)
+            with metrics.timer('parse_clean_seconds'):
+                filing = _parse_cover(filing, xml_tree)
+                filing = _parse_comments(filing, xml_tree)
+                offices = _parse_offices(filing, xml_tree)
+                schedule_a1_attachments = _parse_schedule_a1_attachments(filing, xml_tree)
+                schedule_a2_attachments = _parse_schedule_a2_attachments(filing, xml_tree)
+                schedule_b_attachments, schedule_b_income_sources = _parse_schedule_b_attachments(filing, xml_tree)
+                schedule_c1_attachments = _parse_schedule_c1_attachments(filing, xml_tree)
+                schedule_c2_attachments = _parse_schedule_c2_attachments(filing, xml_tree)
+                schedule_d_attachments, schedule_d_gifts = _parse_schedule_d_attachments(filing, xml_tree)
+                schedule_e_attachments = _parse_schedule_e_attachments(filing, xml_tree)
+            with metrics.timer('parse_insert_seconds'):
+                _save_models([filing])
+                _save_models(offices)
+                _save_models(schedule_a1_attachments)
+                _save_models(schedule_a2_attachments)
+                _save_models(schedule_b_attachments)
+                _save_models(schedule_b_income_sources)
+                _save_models(schedule_c1_attachments)
+                _save_models(schedule_c2_attachments)
+                _save_models(schedule_d_attachments)
+                _save_models(schedule_d_gifts)
+                _save_models(schedule_e_attachments)
+            metrics.increment('filings_parsed')
         except Exception:  # pylint: disable=broad-except
             transaction.rollback()
+            metrics.increment('filings_failed')
             logger.exception(f'Failed to parse filing {filing_id}!')
 
     logger.info(f'Successfully parsed Form 700 filing {filing_id}')
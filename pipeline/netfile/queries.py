@@ -0,0 +1,135 @@
+"""
+This file contains opt-in accounting of the SQL statements issued to the staging database.
+
+Statements are grouped by scope (e.g. the filing being parsed), by table, and by shape. The
+shape is the statement with its parameters left out. Shapes repeated many times within a
+scope are reported as N+1 patterns: one statement per row, where a single statement could
+handle them all.
+"""
+import contextlib
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .models import db
+
+# Shapes repeated at least this many times within a scope are reported as N+1 patterns
+N_PLUS_ONE_THRESHOLD = 5
+
+_TABLE_PATTERN = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+"?(\w+)"?', re.IGNORECASE)
+_PARAMETER_LIST_PATTERN = re.compile(r'\(\?(?:\s*,\s*\?)+\)')
+
+_scopes = threading.local()
+
+
+class Statement(NamedTuple):
+    scope: Optional[str]
+    table: Optional[str]
+    shape: str
+    seconds: float
+
+
+class QueryStats(NamedTuple):
+    query_count: int
+    seconds: float
+
+
+def get_shape(sql: str) -> str:
+    """ Returns the shape of the statement. peewee already passes values as parameters, so only lists of parameters
+    (e.g. `IN (?, ?, ?)`) need to be collapsed. """
+    return _PARAMETER_LIST_PATTERN.sub('(?...)', ' '.join(sql.split()))
+
+
+def get_table(sql: str) -> Optional[str]:
+    match = _TABLE_PATTERN.search(sql)
+    return match[1] if match else None
+
+
+def _get_scope() -> Optional[str]:
+    return getattr(_scopes, 'current', None)
+
+
+@contextlib.contextmanager
+def query_scope(name: str) -> Iterator[None]:
+    """ Attributes the statements issued by this thread in the enclosed block to the named scope. """
+    previous = _get_scope()
+    _scopes.current = name
+    try:
+        yield
+    finally:
+        _scopes.current = previous
+
+
+class QueryRecorder:
+    """ Records the statements executed by a database. """
+
+    def __init__(self):
+        self.statements: List[Statement] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, sql: str, params, seconds: float) -> None:  # pylint: disable=unused-argument
+        statement = Statement(_get_scope(), get_table(sql), get_shape(sql), seconds)
+        with self._lock:
+            self.statements.append(statement)
+
+    def _select(self, scope: Optional[str] = None, table: Optional[str] = None) -> List[Statement]:
+        return [
+            statement for statement in self.statements
+            if (scope is None or statement.scope == scope) and (table is None or statement.table == table)
+        ]
+
+    def count(self, scope: Optional[str] = None, table: Optional[str] = None) -> int:
+        """ Returns the number of statements, optionally only those of a scope and/or table. """
+        return len(self._select(scope, table))
+
+    def _group(self, attribute: str) -> Dict[Optional[str], QueryStats]:
+        groups: Dict[Optional[str], QueryStats] = {}
+        for statement in self.statements:
+            key = getattr(statement, attribute)
+            count, seconds = groups.get(key, (0, 0.0))
+            groups[key] = QueryStats(count + 1, seconds + statement.seconds)
+        return groups
+
+    def by_scope(self) -> Dict[Optional[str], QueryStats]:
+        return self._group('scope')
+
+    def by_table(self) -> Dict[Optional[str], QueryStats]:
+        return self._group('table')
+
+    def repeated_shapes(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> List[Tuple[Optional[str], str, int]]:
+        """ Returns the shapes repeated at least `threshold` times within a scope, as (scope, shape, count) tuples,
+        most repeated first. Statements outside of any scope are not considered. """
+        counts = Counter((statement.scope, statement.shape) for statement in self.statements if statement.scope)
+        repeated = [(scope, shape, count) for (scope, shape), count in counts.items() if count >= threshold]
+        return sorted(repeated, key=lambda item: -item[2])
+
+    def report(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> str:
+        seconds = sum(statement.seconds for statement in self.statements)
+        lines = [f'{len(self.statements)} statements in {seconds:.3f}s']
+        for table, stats in sorted(self.by_table().items(), key=lambda item: -item[1].query_count):
+            lines.append(f'  {table or "-"}: {stats.query_count} statements in {stats.seconds:.3f}s')
+
+        repeated = self.repeated_shapes(threshold)
+        if repeated:
+            lines.append('Possible N+1 patterns:')
+            for scope, shape, count in repeated:
+                lines.append(f'  {scope}: {count}x {shape}')
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def record_queries(database=db) -> Iterator[QueryRecorder]:
+    """ Records the statements executed by the database in the enclosed block.
+
+    Example:
+        with record_queries() as queries:
+            parse_filing(filing_id, content)
+        assert queries.count(scope=filing_id) <= 50
+    """
+    recorder = QueryRecorder()
+    database.listeners.append(recorder)
+    try:
+        yield recorder
+    finally:
+        database.listeners.remove(recorder)
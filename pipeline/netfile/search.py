@@ -0,0 +1,131 @@
+"""
+This file contains a full-text search index over the names of filers and of the entities,
+sources, lenders, and properties they disclose.
+
+The index is an FTS5 table of the intermediary database, built in bulk once the filings are
+parsed (see `build_search_index`). Each entry holds a name, the model and column it comes
+from, and the IDs of its filing and schedule row, so a match leads back to the disclosure.
+Names are tokenized with diacritics removed, and prefixes of two and three characters are
+indexed, so prefix searches, e.g. for "ameri", are served by the index as well.
+"""
+import logging
+import re
+from typing import List, NamedTuple, Optional, Tuple, Type
+
+from peewee import Model
+from playhouse.sqlite_ext import FTS5Model, SearchField
+
+from .. import metrics
+from .models import Form700Filing, ScheduleA1, ScheduleA2, ScheduleB, ScheduleC1, ScheduleC2, ScheduleD, ScheduleE, db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEARCH_LIMIT = 20
+
+# Columns of the schedules that are indexed, by model
+SEARCH_COLUMNS: Tuple[Tuple[Type[Model], str], ...] = (
+    (ScheduleA1, 'name_of_business_entity'),
+    (ScheduleA2, 'entity_name'),
+    (ScheduleB, 'parcel_or_address'),
+    (ScheduleC1, 'name_of_income_source'),
+    (ScheduleC2, 'name_of_lender'),
+    (ScheduleD, 'name_of_source'),
+    (ScheduleE, 'name_of_source'),
+)
+
+_TERM_PATTERN = re.compile(r'\w+')
+
+
+class SearchEntry(FTS5Model):
+    name = SearchField()
+    # Name of the model, and of the column, the name comes from. Filer names come from `Form700Filing.name`.
+    model = SearchField(unindexed=True)
+    column = SearchField(unindexed=True)
+    filing_id = SearchField(unindexed=True)
+    # ID of the schedule row, or None for filers
+    schedule_id = SearchField(unindexed=True)
+
+    class Meta:
+        database = db
+        table_name = 'search_index'
+        options = {'tokenize': 'unicode61 remove_diacritics 2', 'prefix': '2 3'}
+
+
+class SearchResult(NamedTuple):
+    name: str
+    model: str
+    column: str
+    filing_id: str
+    schedule_id: Optional[str]
+    # BM25 rank of the match. Lower is better.
+    rank: float
+
+
+def _quote(name: str) -> str:
+    return f'"{name}"'
+
+
+def build_search_index() -> int:
+    """ Rebuilds the search index from the filings in the intermediary database.
+
+    Returns:
+        int: The number of entries in the index.
+    """
+    # pylint: disable=protected-access,no-member
+    db.connect(reuse_if_open=True)
+    table = _quote(SearchEntry._meta.table_name)
+    filings = _quote(Form700Filing._meta.table_name)
+    with metrics.timer('search_index_seconds'), db.atomic():
+        SearchEntry.drop_table(safe=True)
+        SearchEntry.create_table()
+
+        db.execute_sql(
+            f'INSERT INTO {table} (name, model, "column", filing_id, schedule_id) '
+            f"SELECT TRIM(first_name || ' ' || COALESCE(middle_name || ' ', '') || last_name), ?, 'name', id, NULL "
+            f'FROM {filings}',
+            (Form700Filing.__name__,)
+        )
+        for model, column in SEARCH_COLUMNS:
+            db.execute_sql(
+                f'INSERT INTO {table} (name, model, "column", filing_id, schedule_id) '
+                f'SELECT {_quote(column)}, ?, ?, filing_id, id FROM {_quote(model._meta.table_name)} '
+                f"WHERE COALESCE({_quote(column)}, '') != ''",
+                (model.__name__, column)
+            )
+
+        # Merge the index segments written by the inserts, so searches read a single b-tree.
+        db.execute_sql(f"INSERT INTO {table} ({table}) VALUES ('optimize')")
+        count = db.execute_sql(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+    metrics.observe('search_index_entries', count)
+    logger.info(f'Indexed {count} names for search.')
+    return count
+
+
+def has_search_index() -> bool:
+    return SearchEntry.table_exists()
+
+
+def _to_match_expression(query: str) -> str:
+    """ Returns an FTS5 query matching names that contain every word of the query, the last of which may be a prefix.
+
+    Punctuation is dropped and words are quoted, so the query is never read as FTS5 syntax, e.g. `NOT` or `col:`.
+    """
+    terms = [f'"{term}"' for term in _TERM_PATTERN.findall(query)]
+    if not terms:
+        raise ValueError(f'The search query "{query}" has no words.')
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> List[SearchResult]:
+    """ Returns the names matching the query, best matches first. See `_to_match_expression`. """
+    # pylint: disable=protected-access,no-member
+    table = _quote(SearchEntry._meta.table_name)
+    with metrics.timer('search_seconds'):
+        cursor = db.execute_sql(
+            f'SELECT name, model, "column", filing_id, schedule_id, rank FROM {table} WHERE {table} MATCH ? '
+            f'ORDER BY rank LIMIT ?',
+            (_to_match_expression(query), limit)
+        )
+        return [SearchResult(*row) for row in cursor.fetchall()]
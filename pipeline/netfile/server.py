@@ -0,0 +1,304 @@
+"""
+This file contains a local stand-in for the Netfile API, to load test and tune the client offline.
+
+The stand-in serves `public/list/filing` and `public/efile/{filing_id}` for a corpus of filings
+(the template filings, or a synthetic corpus), and can add latency, server errors, and 429
+throttling to its responses. Run it, and point the client at it with `NETFILE_API_ROOT`:
+
+    python -m pipeline.netfile.server --filings 1000 --latency 0.1 --throttle-rate 0.05
+    NETFILE_API_ROOT=http://127.0.0.1:8000 python -m pipeline download --workers 16
+"""
+import argparse
+import glob
+import io
+import json
+import logging
+import os
+import random
+import re
+import socket
+import threading
+import time
+import zipfile
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+from urllib.parse import parse_qs
+
+from .synthetic import TEMPLATE_DIRECTORY, SyntheticFilingGenerator, parse_schedule_counts
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_PORT = 8000
+# How often the server checks whether it was stopped, in seconds
+SHUTDOWN_POLL_INTERVAL = 0.05
+
+_EFILE_PATTERN = re.compile(r'^/public/efile/(\w+)$')
+_LIST_PATH = '/public/list/filing'
+
+
+class Faults(NamedTuple):
+    """ Latency and failures added to the responses of the stand-in. """
+    # Median latency of a response, in seconds
+    latency: float = 0.0
+    # Standard deviation of the log of the latency, which is log-normally distributed. 0 gives a fixed latency.
+    latency_sigma: float = 0.0
+    # Share of requests answered with a 500 error
+    error_rate: float = 0.0
+    # Share of requests answered with a 429 error
+    throttle_rate: float = 0.0
+    # Requests beyond this many at once are answered with a 429 error
+    max_concurrency: Optional[int] = None
+    # Value of the Retry-After header of 429 responses, in seconds
+    retry_after: Optional[float] = None
+
+
+def load_fixtures(directory: str = TEMPLATE_DIRECTORY) -> Dict[str, str]:
+    """ Returns the XML of the `{filing_id}.xml` files in the directory, by filing ID. """
+    filings = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*.xml'))):
+        with open(path, encoding='utf8') as f:
+            filings[os.path.splitext(os.path.basename(path))[0]] = f.read()
+    return filings
+
+
+def _zip_filing(content: str) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('Efile.txt', content)
+    return buffer.getvalue()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep connections alive, as the Netfile API does, so the client's connection pool is exercised.
+    protocol_version = 'HTTP/1.1'
+    server: '_Server'
+
+    def setup(self):
+        super().setup()
+        self.server.add_connection(self.connection)
+
+    def finish(self):
+        super().finish()
+        self.server.remove_connection(self.connection)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.server.stand_in.handle(self, 'GET')
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.server.stand_in.handle(self, 'POST')
+
+    def respond(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug(format, *args)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    stand_in: 'NetfileStandIn'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._connections: Set[socket.socket] = set()
+        self._connections_lock = threading.Lock()
+
+    def add_connection(self, connection: socket.socket) -> None:
+        with self._connections_lock:
+            self._connections.add(connection)
+
+    def remove_connection(self, connection: socket.socket) -> None:
+        with self._connections_lock:
+            self._connections.discard(connection)
+
+    def close_connections(self) -> None:
+        """ Closes the connections kept alive by clients, so their handler threads stop. """
+        with self._connections_lock:
+            for connection in self._connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class NetfileStandIn:  # pylint: disable=too-many-instance-attributes
+    """ Serves a corpus of filings over HTTP, as the Netfile API does.
+
+    Use the stand-in as a context manager to serve on a background thread, and point the client at its `url`.
+
+    Args:
+        filings (dict): XML of the filings, by filing ID. Filings are listed in the order of the dictionary.
+        page_size (int): Number of filings per page of the list.
+        faults (Faults): Latency and failures to add to the responses.
+        seed (int): Seed of the random generator that draws latencies and failures.
+    """
+
+    def __init__(self, filings: Dict[str, str], page_size: int = DEFAULT_PAGE_SIZE, faults: Faults = Faults(),
+                 seed: Optional[int] = 0):
+        self.filings = filings
+        self.page_size = page_size
+        self.faults = faults
+        # Number of responses by status code, and the most requests handled at once
+        self.responses: Counter = Counter()
+        self.max_active = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._archives: Dict[str, bytes] = {}
+        self._server: Optional[_Server] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """ The root URL of the API, to use as the client's `API_ROOT`. """
+        if self._server is None:
+            raise RuntimeError('The stand-in is not serving.')
+        host, port = self._server.socket.getsockname()[:2]
+        return f'http://{host}:{port}'
+
+    def _get_fault(self, active: int) -> Optional[int]:
+        """ Returns the error status with which to answer a request, if any. """
+        faults = self.faults
+        with self._lock:
+            draw = self._random.random()
+        if faults.max_concurrency is not None and active > faults.max_concurrency:
+            return 429
+        if draw < faults.throttle_rate:
+            return 429
+        if draw < faults.throttle_rate + faults.error_rate:
+            return 500
+        return None
+
+    def _get_latency(self) -> float:
+        if not self.faults.latency_sigma:
+            return self.faults.latency
+        with self._lock:
+            return self.faults.latency * self._random.lognormvariate(0, self.faults.latency_sigma)
+
+    def _list(self, body: bytes) -> Tuple[int, bytes, str]:
+        data = parse_qs(body.decode('utf8'))
+        page = int(data.get('CurrentPageIndex', ['0'])[0])
+        filing_ids = list(self.filings)[page * self.page_size:(page + 1) * self.page_size]
+        page_data = {'filings': [{'id': filing_id, 'isEfiled': True} for filing_id in filing_ids]}
+        return 200, json.dumps(page_data).encode('utf8'), 'application/json'
+
+    def _efile(self, filing_id: str) -> Tuple[int, bytes, str]:
+        content = self.filings.get(filing_id)
+        if content is None:
+            return 404, json.dumps({'message': f'Filing {filing_id} not found'}).encode('utf8'), 'application/json'
+
+        archive = self._archives.get(filing_id)
+        if archive is None:
+            archive = self._archives[filing_id] = _zip_filing(content)
+        return 200, archive, 'application/zip'
+
+    def handle(self, handler: _Handler, method: str) -> None:
+        with self._lock:
+            self._active += 1
+            active = self._active
+            self.max_active = max(self.max_active, active)
+
+        try:
+            # Read the whole request, so the connection can be reused whatever the response.
+            request_body = handler.rfile.read(int(str(handler.headers.get('Content-Length') or 0)))
+            time.sleep(self._get_latency())
+
+            headers = {}
+            match = _EFILE_PATTERN.match(handler.path)
+            status = self._get_fault(active)
+            if status == 429:
+                if self.faults.retry_after is not None:
+                    headers['Retry-After'] = str(self.faults.retry_after)
+                response = (status, b'{"message": "Too many requests"}', 'application/json')
+            elif status == 500:
+                response = (status, b'{"message": "Internal server error"}', 'application/json')
+            elif method == 'POST' and handler.path == _LIST_PATH:
+                response = self._list(request_body)
+            elif method == 'GET' and match:
+                response = self._efile(match[1])
+            else:
+                response = (404, b'{"message": "Not found"}', 'application/json')
+
+            with self._lock:
+                self.responses[response[0]] += 1
+            handler.respond(*response, headers=headers)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def start(self, host: str = '127.0.0.1', port: int = 0) -> None:
+        """ Serves on a background thread. A port of 0 picks a free port. """
+        self._server = _Server((host, port), _Handler)
+        self._server.stand_in = self
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(SHUTDOWN_POLL_INTERVAL,),
+                                        name='netfile-stand-in', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server.close_connections()
+            self._thread.join()  # type: ignore
+            self._server = None
+
+    def __enter__(self) -> 'NetfileStandIn':
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the Netfile API.')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to serve on.')
+    parser.add_argument('--filings', type=int,
+                        help='Serve this many synthetic filings. Defaults to serving the template filings.')
+    parser.add_argument('--schedules', type=parse_schedule_counts, default=None,
+                        help='Entries per schedule in each synthetic filing, e.g. "a1=1000,b=10".')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help='Number of filings per page.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Median latency of a response, in seconds.')
+    parser.add_argument('--latency-sigma', type=float, default=0.0,
+                        help='Spread of the log-normally distributed latency. 0 gives a fixed latency.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 500.')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of requests answered with a 429.')
+    parser.add_argument('--max-concurrency', type=int,
+                        help='Answer requests beyond this many at once with a 429.')
+    parser.add_argument('--retry-after', type=float, help='Retry-After header of 429 responses, in seconds.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+    if args.filings:
+        filings = dict(SyntheticFilingGenerator(seed=args.seed).generate_corpus(args.filings, args.schedules))
+    else:
+        filings = load_fixtures()
+    faults = Faults(args.latency, args.latency_sigma, args.error_rate, args.throttle_rate, args.max_concurrency,
+                    args.retry_after)
+
+    stand_in = NetfileStandIn(filings, args.page_size, faults, args.seed)
+    stand_in.start(port=args.port)
+    logger.info(f'Serving {len(filings)} filings at {stand_in.url}. Press Ctrl+C to stop.')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stand_in.stop()
+        logger.info(f'Responses by status code: {dict(stand_in.responses)}. At most {stand_in.max_active} requests '
+                    f'were handled at once.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+This file contains code to process filings in parallel shards. Filings are partitioned
+across shards by a hash of their ID. Each shard is parsed into its own SQLite database,
+and the shard databases are then merged into the main database.
+"""
+import logging
+import zlib
+from typing import Dict, Iterable, List, Type
+
+from peewee import AutoField, ForeignKeyField, Model
+
+from .models import AbstractSchedule, Form700Filing, db, get_model_classes
+
+logger = logging.getLogger(__name__)
+
+
+def get_shard(key: str, shard_count: int) -> int:
+    """ Returns the shard, in the range [0, shard_count), to which the given key (e.g. a filing ID) belongs. """
+    return zlib.crc32(key.encode('utf8')) % shard_count
+
+
+def _get_merge_order(models: List[Type[Model]]) -> List[Type[Model]]:
+    """ Sorts the models so that each model comes after the models it references. """
+    ordered: List[Type[Model]] = []
+    remaining = list(models)
+    while remaining:
+        for model in remaining:
+            # pylint: disable=protected-access
+            dependencies = {field.rel_model for field in model._meta.refs if field.rel_model is not model}
+            if dependencies.issubset(ordered):
+                ordered.append(model)
+                remaining.remove(model)
+                break
+        else:
+            raise ValueError(f'Cannot determine the merge order of {remaining}')
+    return ordered
+
+
+def _quote(name: str) -> str:
+    return f'"{name}"'
+
+
+def _merge_shard(alias: str) -> None:
+    # pylint: disable=protected-access
+    models = _get_merge_order(get_model_classes())
+
+    # Schedules use an auto-incrementing `internal_id` as their primary key, which collides across shards.
+    # Shift the IDs of each shard past the IDs already merged, and apply the same shift to the foreign keys
+    # of the nested data (e.g. gifts) that reference them.
+    offsets: Dict[Type[Model], int] = {}
+    for model in models:
+        if issubclass(model, AbstractSchedule):
+            table = _quote(model._meta.table_name)
+            offsets[model] = db.execute_sql(f'SELECT COALESCE(MAX(internal_id), 0) FROM main.{table}').fetchone()[0]
+
+    for model in models:
+        columns = []
+        selections = []
+        for field in model._meta.sorted_fields:
+            column = _quote(field.column_name)
+            columns.append(column)
+            if isinstance(field, AutoField) and model in offsets:
+                selections.append(f'{column} + {offsets[model]}')
+            elif isinstance(field, ForeignKeyField) and field.rel_model in offsets:
+                selections.append(f'{column} + {offsets[field.rel_model]}')
+            else:
+                selections.append(column)
+
+        table = _quote(model._meta.table_name)
+        db.execute_sql(
+            f'INSERT OR IGNORE INTO main.{table} ({", ".join(columns)}) '
+            f'SELECT {", ".join(selections)} FROM {alias}.{table}'
+        )
+
+
+def merge_databases(paths: Iterable[str]) -> None:
+    """ Merges the shard databases at the given paths into the current database.
+
+    Shards are merged one at a time, so `paths` may be a generator that fetches each shard when it is needed.
+
+    The current database's tables must already exist. Like the parser, rows whose primary key already exists (e.g. an
+    office listed on several filings) are skipped, so the first shard to contain them wins. Amendments that reference
+    a filing that is not part of any shard have their `amends` reference cleared, since the referenced filing cannot
+    be loaded.
+    """
+    db.connect(reuse_if_open=True)
+    alias = 'shard'
+
+    # Amendments may reference filings in later shards, so foreign keys are only checked once every shard is merged.
+    # NOTE: SQLite does not allow this pragma, ATTACH, or DETACH to run inside a transaction.
+    db.execute_sql('PRAGMA foreign_keys = OFF')
+    count = 0
+    try:
+        for path in paths:
+            logger.info(f'Merging shard database {path}...')
+            db.execute_sql(f'ATTACH DATABASE ? AS {alias}', (path,))
+            try:
+                with db.atomic():
+                    _merge_shard(alias)
+            finally:
+                db.execute_sql(f'DETACH DATABASE {alias}')
+            count += 1
+
+        orphans = (Form700Filing
+                   .update(amends=None)
+                   .where(Form700Filing.amends.not_in(Form700Filing.select(Form700Filing.id))))
+        orphan_count = orphans.execute()
+        if orphan_count:
+            logger.warning(f'Cleared the amended filing of {orphan_count} filings whose amended filing is not '
+                           f'available.')
+    finally:
+        db.execute_sql('PRAGMA foreign_keys = ON')
+
+    violations = db.execute_sql('PRAGMA foreign_key_check').fetchall()
+    if violations:
+        raise ValueError(f'Merged database has {len(violations)} foreign key violations, e.g. {violations[0]}')
+
+    logger.info(f'Merged {count} shard databases.')
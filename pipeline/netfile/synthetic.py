@@ -0,0 +1,133 @@
+"""
+This file contains a generator of synthetic Form 700 filings, for benchmarks and load tests.
+
+Filings are built from real filings used as templates: a base filing provides the cover
+page, and each schedule entry is a copy of an entry taken from one of the templates, with
+fresh IDs and randomized names and amounts.
+"""
+import copy
+import glob
+import os
+import random
+import uuid
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional, Tuple
+
+TEMPLATE_DIRECTORY = os.path.join(os.path.dirname(__file__), 'templates')
+BASE_TEMPLATE_ID = '182305528'
+
+# Short schedule names, and the path of their entries in a filing
+SCHEDULE_PATHS: Dict[str, Tuple[str, str]] = {
+    'a1': ('schedule_a_1s', 'schedule_a_1'),
+    'a2': ('schedule_a_2s', 'schedule_a_2'),
+    'b': ('schedule_bs', 'schedule_b'),
+    'c1': ('schedule_c_1s', 'schedule_c_1'),
+    'c2': ('schedule_c_2s', 'schedule_c_2'),
+    'd': ('schedule_ds', 'schedule_d'),
+    'e': ('schedule_es', 'schedule_e'),
+}
+
+# Number of entries per schedule in a filing, modeled on a typical filing
+DEFAULT_SCHEDULE_COUNTS: Dict[str, int] = {
+    'a1': 6,
+    'a2': 1,
+    'b': 1,
+    'c1': 2,
+    'c2': 1,
+    'd': 2,
+    'e': 1,
+}
+
+NAME_ELEMENTS = (
+    'name_of_business_entity', 'entity_name', 'name_of_income_source', 'name_of_lender', 'name_of_source', 'name',
+)
+AMOUNT_ELEMENTS = ('amount',)
+WORDS = (
+    'Alameda', 'Bay', 'Capital', 'Coastal', 'Golden', 'Harbor', 'Lake', 'Merritt', 'Pacific', 'Redwood', 'Summit',
+    'Valley',
+)
+SUFFIXES = ('Inc.', 'LLC', 'Corp', 'Partners', 'Foundation', 'Bank', 'Group', '')
+
+
+def parse_schedule_counts(value: str) -> Dict[str, int]:
+    """ Parses schedule counts of the form `a1=1000,b=10`. Schedules that are not listed have no entries. """
+    counts = {schedule: 0 for schedule in SCHEDULE_PATHS}
+    for item in filter(None, value.split(',')):
+        schedule, count = item.split('=')
+        if schedule not in SCHEDULE_PATHS:
+            raise ValueError(f'Unknown schedule "{schedule}". Valid schedules: {", ".join(SCHEDULE_PATHS)}')
+        counts[schedule] = int(count)
+    return counts
+
+
+def _find(element: ET.Element, path: str) -> ET.Element:
+    child = element.find(path)
+    if child is None:
+        raise ValueError(f'The base template has no {path} element')
+    return child
+
+
+class SyntheticFilingGenerator:
+    """ Generates synthetic filings from the templates in a directory of real filings. """
+
+    def __init__(self, template_directory: str = TEMPLATE_DIRECTORY, seed: Optional[int] = 0):
+        self.random = random.Random(seed)
+        self.entries: Dict[str, List[ET.Element]] = {schedule: [] for schedule in SCHEDULE_PATHS}
+
+        paths = sorted(glob.glob(os.path.join(template_directory, '*.xml')))
+        templates = {os.path.basename(path)[:-len('.xml')]: ET.parse(path).getroot() for path in paths}
+        self.base = templates.get(BASE_TEMPLATE_ID) or next(iter(templates.values()))
+
+        for template in templates.values():
+            for schedule, (container, entry) in SCHEDULE_PATHS.items():
+                self.entries[schedule] += template.findall(f'{container}/{entry}')
+
+        missing = [schedule for schedule, entries in self.entries.items() if not entries]
+        if missing:
+            raise ValueError(f'The templates in {template_directory} have no entries for schedules {missing}')
+
+    def _uuid(self) -> str:
+        return str(uuid.UUID(int=self.random.getrandbits(128), version=4))
+
+    def _name(self) -> str:
+        return ' '.join(filter(None, (self.random.choice(WORDS), self.random.choice(WORDS),
+                                      self.random.choice(SUFFIXES))))
+
+    def _randomize(self, element: ET.Element) -> ET.Element:
+        for child in element.iter():
+            if child.tag == 'id':
+                child.text = self._uuid()
+            elif child.tag in NAME_ELEMENTS:
+                child.text = self._name()
+            elif child.tag in AMOUNT_ELEMENTS:
+                child.text = str(self.random.randint(1, 5000))
+        return element
+
+    def generate(self, filing_id: str, schedule_counts: Optional[Dict[str, int]] = None) -> str:
+        """ Returns the XML of a synthetic filing with the given number of entries per schedule. """
+        schedule_counts = DEFAULT_SCHEDULE_COUNTS if schedule_counts is None else schedule_counts
+        filing = copy.deepcopy(self.base)
+
+        _find(filing, 'filing_information/filer_id').text = f'SYN-{filing_id}'
+        _find(filing, 'cover/first_name').text = self.random.choice(WORDS)
+        _find(filing, 'cover/last_name').text = self.random.choice(WORDS)
+        for office in filing.findall('cover/offices/office'):
+            self._randomize(office)
+
+        for schedule, (container_path, _) in SCHEDULE_PATHS.items():
+            container = _find(filing, container_path)
+            for entry in list(container):
+                container.remove(entry)
+
+            count = schedule_counts.get(schedule, 0)
+            for _ in range(count):
+                container.append(self._randomize(copy.deepcopy(self.random.choice(self.entries[schedule]))))
+            container.set('count', str(count))
+
+        return ET.tostring(filing, encoding='unicode')
+
+    def generate_corpus(self, filing_count: int, schedule_counts: Optional[Dict[str, int]] = None,
+                        first_filing_id: int = 900000000) -> Iterator[Tuple[str, str]]:
+        """ Yields the ID and XML of `filing_count` synthetic filings. """
+        for filing_id in range(first_filing_id, first_filing_id + filing_count):
+            yield str(filing_id), self.generate(str(filing_id), schedule_counts)
@@ -0,0 +1,58 @@
+import io
+import os
+import shutil
+import zipfile
+
+import pytest
+
+from ..archives import list_archive, read_archive, write_archive
+
+FIXTURE_DIRECTORY = os.path.join(os.path.dirname(__file__), 'fixtures')
+FILINGS = [
+    ('1', '<filing>\n  <name>Ünïcode</name>\n</filing>'),
+    ('2', '<filing />'),
+]
+
+
+def _netfile_archive(content: str) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('Efile.txt', content)
+    return buffer.getvalue()
+
+
+def test_single_filing_archive(tmpdir):
+    # A filing as downloaded from Netfile
+    path = str(tmpdir.join('1234.zip'))
+    shutil.copy(os.path.join(FIXTURE_DIRECTORY, 'dummy_filing.zip'), path)
+
+    assert list(read_archive(path)) == [('1234', 'This is a test file!')]
+    assert list_archive(path) == ['1234']
+
+
+def test_multi_filing_archive(tmpdir):
+    path = str(tmpdir.join('filings.zip'))
+    assert write_archive(path, FILINGS) == 2
+
+    assert list(read_archive(path)) == FILINGS
+    assert list(read_archive(path, lambda filing_id: filing_id == '2')) == FILINGS[1:]
+    assert list_archive(path) == ['1', '2']
+
+
+def test_archive_layouts(tmpdir):
+    path = str(tmpdir.join('filings.zip'))
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('run/1/Efile.txt', FILINGS[0][1])
+        archive.writestr('2.zip', _netfile_archive(FILINGS[1][1]))
+        archive.writestr('3.txt', '<filing id="3" />')
+        archive.writestr('README.md', 'Not a filing')
+
+    assert list(read_archive(path)) == FILINGS + [('3', '<filing id="3" />')]
+
+
+def test_empty_archive(tmpdir):
+    path = tmpdir.join('empty.zip')
+    path.write('')
+
+    with pytest.raises(zipfile.BadZipFile):
+        list(read_archive(str(path)))
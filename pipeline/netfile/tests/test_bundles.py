@@ -0,0 +1,21 @@
+import io
+
+from ..bundles import dump_bundle, load_bundle, read_bundle, write_bundle
+
+
+def test_bundle_round_trip():
+    filings = [
+        ('1', '<filing>\n  <name>Ünïcode</name>\n</filing>'),
+        ('2', '<filing />'),
+    ]
+
+    buffer = io.BytesIO()
+    assert write_bundle(buffer, filings) == 2
+    buffer.seek(0)
+    assert list(read_bundle(buffer)) == filings
+
+    assert list(load_bundle(dump_bundle(filings))) == filings
+
+
+def test_empty_bundle():
+    assert not list(load_bundle(dump_bundle([])))
@@ -1,9 +1,11 @@
+import datetime
 import os
+from urllib.parse import parse_qs
 
 import pytest
 import responses
 
-from ..client import build_url, download_filing, get_filing_ids
+from ..client import build_url, download_filing, download_filings, get_filing_ids
 from ..errors import DownloadError
 
 FORM_TYPE = 254
@@ -48,6 +50,15 @@ def test_get_filings():
     assert actual == {'2', '3', '4'}
 
 
+@responses.activate
+def test_get_filings_since():
+    url = build_url('public/list/filing')
+    responses.add(responses.POST, url, json={})
+
+    assert get_filing_ids(FORM_TYPE, since=datetime.date(2019, 1, 1)) == set()
+    assert parse_qs(responses.calls[0].request.body)['DateStart'] == ['2019-01-01']
+
+
 @responses.activate
 def test_get_filings_error():
     responses.add(responses.POST, build_url('public/list/filing'), status=500)
@@ -72,3 +83,17 @@ def test_download_filing_error():
 
     with pytest.raises(DownloadError):
         download_filing(filing_id)
+
+
+@responses.activate
+def test_download_filings():
+    filing_ids = [str(filing_id) for filing_id in range(10)]
+    file_path = os.path.join(os.path.dirname(__file__), 'fixtures', 'dummy_filing.zip')
+    with open(file_path, 'rb') as test_file:
+        body = test_file.read()
+
+    for filing_id in filing_ids:
+        responses.add(responses.GET, build_url(f'public/efile/{filing_id}'), body=body, stream=True)
+
+    actual = list(download_filings(filing_ids, workers=4))
+    assert actual == [(filing_id, 'This is a test file!') for filing_id in filing_ids]
@@ -0,0 +1,18 @@
+from ..compression import compress, decompress, is_compressed
+
+CONTENT = '<filing>\n  <name>Ünïcode</name>\n</filing>'
+
+
+def test_compression_round_trip():
+    data = compress(CONTENT)
+    assert is_compressed(data)
+    assert decompress(data) == CONTENT
+
+
+def test_compression_is_deterministic():
+    assert compress(CONTENT) == compress(CONTENT)
+
+
+def test_decompress_uncompressed():
+    assert not is_compressed(CONTENT.encode('utf8'))
+    assert decompress(CONTENT.encode('utf8')) == CONTENT
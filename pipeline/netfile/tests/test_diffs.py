@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from ..diffs import CHANGE_FILE_EXTENSION, read_changes, write_changes
+from ..models import DATABASE, build_tables, destroy_database, use_database
+from ..parsers import parse_filing
+from .test_parsers import read_filing
+from .test_shards import FILING_IDS
+
+# Holds a gift described as "Ticket to Game"
+GIFT_FILING_ID = '178032623'
+
+
+@pytest.fixture
+def restore_database():
+    yield
+    use_database(DATABASE)
+    destroy_database()
+
+
+def _build_database(path, filings):
+    use_database(path)
+    destroy_database()
+    build_tables()
+    for filing_id, content in filings:
+        parse_filing(filing_id, content)
+
+
+def _read_change_files(directory):
+    return {
+        name[:-len(CHANGE_FILE_EXTENSION)]: list(read_changes(os.path.join(directory, name)))
+        for name in os.listdir(directory)
+    }
+
+
+@pytest.mark.usefixtures('restore_database')
+def test_write_changes(tmpdir):
+    previous_path = str(tmpdir.join('previous.db'))
+    _build_database(previous_path, [(filing_id, read_filing(filing_id)) for filing_id in FILING_IDS[:-1]])
+
+    # Drop the first filing, which shifts the internal IDs of the schedules that follow it, add the last one, and
+    # change a gift.
+    filings = {filing_id: read_filing(filing_id) for filing_id in FILING_IDS[1:]}
+    filings[GIFT_FILING_ID] = filings[GIFT_FILING_ID].replace('Ticket to Game', 'Tickets to Game')
+    _build_database(str(tmpdir.join('current.db')), filings.items())
+
+    output = str(tmpdir.join('changes'))
+    summary = write_changes(previous_path, output)
+    changes = _read_change_files(output)
+
+    assert [(change.operation, change.key) for change in changes['Form700Filing']] == [
+        ('insert', (FILING_IDS[-1],)), ('delete', (FILING_IDS[0],)),
+    ]
+    assert changes['Form700Filing'][0].row['id'] == FILING_IDS[-1]
+    assert changes['Form700Filing'][1].row is None
+
+    # Only the gift was updated, although the internal IDs of the schedules changed
+    updates = [(name, change) for name, model_changes in changes.items() for change in model_changes
+               if change.operation == 'update']
+    assert [name for name, _ in updates] == ['ScheduleDGift']
+    update = updates[0][1]
+    assert update.row['description'] == 'Tickets to Game'
+    assert update.row['schedule_filing_id'] == GIFT_FILING_ID
+    assert update.key[2] == GIFT_FILING_ID
+    assert 'internal_id' not in update.row
+
+    assert {name for name, counts in summary.items() if any(counts.values())} == set(changes)
+    assert summary['Form700Filing'] == {'insert': 1, 'update': 0, 'delete': 1}
+
+
+@pytest.mark.usefixtures('restore_database')
+def test_write_changes_unchanged(tmpdir):
+    path = str(tmpdir.join('reporting.db'))
+    _build_database(path, [(filing_id, read_filing(filing_id)) for filing_id in FILING_IDS])
+
+    output = str(tmpdir.join('changes'))
+    summary = write_changes(path, output)
+
+    assert not any(any(counts.values()) for counts in summary.values())
+    assert not os.listdir(output)
+
+
+def test_write_changes_missing_database(tmpdir):
+    with pytest.raises(FileNotFoundError):
+        write_changes(str(tmpdir.join('missing.db')), str(tmpdir))
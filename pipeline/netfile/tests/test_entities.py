@@ -0,0 +1,80 @@
+import pytest
+
+from ..entities import get_shingles, normalize_name, resolve_entities, resolve_names
+from ..models import Entity, EntityMention, build_derived_tables
+from .test_parsers import _parse_filing
+
+
+@pytest.mark.parametrize('name,expected', [
+    ('Acme, Inc.', 'acme'),
+    ('The Acme Company', 'acme'),
+    ('  AT&T  ', 'at t'),
+    ("Macy's", 'macys'),
+    ('Café Rouge', 'cafe rouge'),
+    ('LLC', ''),
+    (None, ''),
+])
+def test_normalize_name(name, expected):
+    assert normalize_name(name) == expected
+
+
+def test_get_shingles():
+    assert get_shingles('jp morgan') == get_shingles('j p morgan')
+    assert get_shingles('ibm') == frozenset(('ibm',))
+
+
+def test_resolve_names():
+    names = ['jpmorgan chase', 'jp morgan chase', 'jpmorgan chase bank', 'costco wholesale', 'costco wholesale store',
+             'nike', 'golden state warriors', 'golden state warrior']
+    groups = resolve_names(names)
+    assert groups['jpmorgan chase'] == groups['jp morgan chase'] == groups['jpmorgan chase bank']
+    assert groups['costco wholesale'] == groups['costco wholesale store']
+    assert groups['golden state warriors'] == groups['golden state warrior']
+    assert len(set(groups.values())) == 4
+
+
+def test_resolve_entities():
+    entities, entity_ids = resolve_entities(['Nike', 'NIKE, Inc.', 'Nike', 'Costco', ' Costco '])
+    assert [(entity.id, entity.name, entity.normalized_name, entity.mention_count) for entity in entities] == [
+        (1, 'Costco', 'costco', 2),
+        (2, 'Nike', 'nike', 3),
+    ]
+    assert entity_ids == {'Costco': 1, 'Nike': 2, 'NIKE, Inc.': 2}
+
+
+def test_resolve_entities_without_distinguishing_words():
+    # Names that normalize to nothing are not one entity, and are left unresolved
+    entities, entity_ids = resolve_entities(['LLC', 'Inc.', 'The Company', 'Acme LLC'])
+    assert [(entity.name, entity.mention_count) for entity in entities] == [('Acme LLC', 1)]
+    assert entity_ids == {'Acme LLC': 1}
+    assert resolve_names(['', 'acme']) == {'acme': 0}
+
+
+def test_resolve_names_beyond_max_name_count(monkeypatch):
+    # Too many names to compare: only identical normalized names are joined
+    monkeypatch.setattr('pipeline.netfile.entities.MAX_NAME_COUNT', 2)
+    assert resolve_names(['acme', 'acme', 'acme widgets', 'acme widget']) == {
+        'acme': 0, 'acme widget': 1, 'acme widgets': 2,
+    }
+
+
+def test_resolve_entities_without_names():
+    entities, entity_ids = resolve_entities([None, '', '  ', 'Acme'])
+    assert [(entity.name, entity.mention_count) for entity in entities] == [('Acme', 1)]
+    assert entity_ids == {'Acme': 1}
+
+
+@pytest.mark.usefixtures('reset_database')
+def test_build_entities():
+    _parse_filing('178032623')
+    _parse_filing('178665313')
+    build_derived_tables()
+    # Recomputing replaces the rows
+    build_derived_tables()
+
+    entity = Entity.get(Entity.name == 'Oakland Education Fund')
+    assert sorted(mention.name for mention in entity.mentions) == [
+        'Oakland Education Fund', 'Oakland Public Education Fund',
+    ]
+    assert entity.mention_count == 2
+    assert len(EntityMention.select()) == sum(entity.mention_count for entity in Entity.select())
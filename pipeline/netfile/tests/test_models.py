@@ -0,0 +1,87 @@
+import csv
+import io
+from decimal import Decimal
+
+import pytest
+
+from ..models import (
+    FilerYearSummary, FilingSummary, Form700Filing, GiftSourceTotal, LatestFiling, Office, ValueDistribution,
+    build_derived_tables, export_data_to_csv, get_model_classes, iter_csv_exports
+)
+from ..parsers import parse_filing
+from .test_parsers import _parse_filing, read_filing
+
+
+@pytest.mark.usefixtures('reset_database')
+def test_iter_csv_exports():
+    _parse_filing('182305528')
+    expected = {model: export.getvalue() for model, export in export_data_to_csv()}
+
+    # A spool size of zero spills every export to a temporary file
+    exports = {}
+    for model, export in iter_csv_exports(lambda: 0):
+        assert export._rolled  # pylint: disable=protected-access
+        exports[model] = export.read().decode('utf8')
+
+    assert exports == expected
+    rows = list(csv.reader(io.StringIO(next(value for model, value in exports.items() if model.__name__ == 'Office'))))
+    assert len(rows) == 2
+
+
+@pytest.mark.usefixtures('reset_database')
+def test_build_derived_tables():
+    for filing_id in ('177199734', '177199959', '177692551', '181517263', '182305528'):
+        _parse_filing(filing_id)
+    # A second amendment, of the amendment
+    parse_filing('999999999', read_filing('181517263').replace('>177692551<', '>181517263<'))
+    # A filing signed at the same time as another wins by its ID
+    parse_filing('999999998', read_filing('182305528'))
+
+    build_derived_tables()
+    # Recomputing replaces the rows
+    build_derived_tables()
+
+    latest = {
+        row.filer_id: (row.report_year, row.filing_id, row.chain_depth)
+        for row in LatestFiling.select()
+    }
+    assert latest == {
+        # The later of two filings
+        'COAK-154754': (2018, '177199959', 0),
+        'COAK-152132': (2018, '999999999', 2),
+        'COAK-151463': (2018, '999999998', 0),
+    }
+    assert any(model is LatestFiling for model, _ in export_data_to_csv())
+
+
+@pytest.mark.usefixtures('reset_database')
+def test_build_aggregate_tables():
+    for filing_id in ('177692551', '181517263', '178032623', '178768108'):
+        _parse_filing(filing_id)
+    build_derived_tables()
+
+    # Every schedule row, and row of nested data, is counted once
+    counted = {}
+    for summary in FilingSummary.select():
+        counted[summary.schedule] = counted.get(summary.schedule, 0) + summary.row_count
+    expected = {model.__name__: len(model.select()) for model in get_model_classes()}
+    del expected[Form700Filing.__name__], expected[Office.__name__]
+    assert counted == {name: count for name, count in expected.items() if count}
+
+    gifts = FilingSummary.get(FilingSummary.filing == '178768108', FilingSummary.schedule == 'ScheduleDGift')
+    assert (gifts.row_count, gifts.total_amount) == (3, Decimal('604.8'))
+
+    # Only the amendment, which is the effective filing, is summarized for its filer
+    summaries = FilerYearSummary.select()
+    assert {summary.filing_id for summary in summaries if summary.filer_id == 'COAK-152132'} == {'181517263'}
+
+    distribution = {
+        row.bucket: (row.bucket_position, row.row_count)
+        for row in ValueDistribution.select()
+        if (row.filer_id, row.schedule, row.column_name) == ('COAK-152132', 'ScheduleA1', 'fair_market_value')
+    }
+    assert distribution == {'2000-10000': (0, 9), '10001-100000': (1, 26)}
+
+    totals = {total.entity.name: (total.gift_count, total.total_amount) for total in GiftSourceTotal.select()}
+    assert totals['City Administrators Office'] == (2, Decimal('404.8'))
+    assert totals['Warriors Community Foundation'] == (1, Decimal('100'))
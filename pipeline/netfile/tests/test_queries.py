@@ -0,0 +1,65 @@
+import pytest
+from playhouse.sqlite_ext import SqliteExtDatabase
+
+from ..models import Office, db
+from ..parsers import parse_filing
+from ..queries import get_shape, query_scope, record_queries
+from .test_parsers import read_filing
+
+# Statements parsing a filing may issue: the savepoint, the filing and office inserts, the office lookup, and one
+# insert per schedule entry.
+FILING_BASE_STATEMENTS = 4
+
+
+@pytest.mark.usefixtures('reset_database')
+def test_parse_filing_query_budget():
+    with record_queries() as queries:
+        parse_filing('182305528', read_filing('182305528'))
+
+    # One office, and ten schedule entries
+    assert queries.count(scope='182305528') <= FILING_BASE_STATEMENTS + 10
+    assert queries.count(scope='182305528', table='office') == 2
+    assert queries.count(scope='182305528', table='schedulea1') == 6
+
+    # Lookups are not repeated per row
+    assert not [shape for _, shape, _ in queries.repeated_shapes(threshold=2) if shape.startswith('SELECT')]
+
+
+@pytest.mark.usefixtures('reset_database')
+def test_repeated_shapes():
+    with record_queries() as queries, query_scope('lookups'):
+        for _ in range(5):
+            Office.get_or_none(Office.id == '00000000-0000-0000-0000-000000000000')
+
+    (scope, shape, count), = queries.repeated_shapes()
+    assert scope == 'lookups'
+    assert shape.startswith('SELECT')
+    assert count == 5
+    assert 'Possible N+1 patterns' in queries.report()
+
+
+@pytest.mark.usefixtures('reset_database')
+def test_record_queries_is_opt_in():
+    with record_queries() as queries:
+        Office.get_or_none(Office.id == '00000000-0000-0000-0000-000000000000')
+    Office.get_or_none(Office.id == '00000000-0000-0000-0000-000000000000')
+
+    assert queries.count() == 1
+    assert queries.by_table()['office'].query_count == 1
+
+
+def test_record_queries_passes_arguments_through(monkeypatch):
+    # peewee decides whether to commit from the arguments that are not given, so none are added
+    calls = []
+    monkeypatch.setattr(SqliteExtDatabase, 'execute_sql', lambda self, *args, **kwargs: calls.append((args, kwargs)))
+    with record_queries() as queries:
+        db.execute_sql('SELECT ?', (1,))
+    db.execute_sql('SELECT 1')
+
+    assert calls == [(('SELECT ?', (1,)), {}), (('SELECT 1',), {})]
+    assert queries.count() == 1
+
+
+def test_get_shape():
+    shape = get_shape('SELECT *\n  FROM "office" WHERE "id" IN (?, ?, ?)')
+    assert shape == 'SELECT * FROM "office" WHERE "id" IN (?...)'
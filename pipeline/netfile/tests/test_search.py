@@ -0,0 +1,56 @@
+import pytest
+
+from ..search import build_search_index, has_search_index, search
+from .test_parsers import _parse_filing
+
+FILING_ID = '177423011'
+
+
+@pytest.fixture(name='search_index')
+def search_index_fixture(reset_database):  # pylint: disable=unused-argument
+    _parse_filing(FILING_ID)
+    _parse_filing('177692551')
+    build_search_index()
+
+
+@pytest.mark.usefixtures('search_index')
+def test_search():
+    results = search('chase')
+    assert [(result.name, result.model, result.column) for result in results] == [
+        ('Chase', 'ScheduleC2', 'name_of_lender'), ('Chase Bank', 'ScheduleC2', 'name_of_lender'),
+    ]
+    assert all(result.filing_id == FILING_ID and result.schedule_id for result in results)
+
+    # Every word must match, and the last may be a prefix
+    assert [result.name for result in search('Chase b')] == ['Chase Bank']
+    assert [result.name for result in search('ameri')] == ['TD Ameritrade']
+    assert not search('chase costco')
+
+
+@pytest.mark.usefixtures('search_index')
+def test_search_filers():
+    results = search('fong')
+    assert [(result.name, result.model, result.filing_id, result.schedule_id) for result in results] == [
+        ('Peter Fong', 'Form700Filing', FILING_ID, None),
+    ]
+
+
+@pytest.mark.usefixtures('search_index')
+def test_search_query_syntax():
+    """ Queries are searched as words, not read as FTS5 syntax. """
+    assert [result.name for result in search('NOT chase:')] == []
+    assert [result.name for result in search('"Chase", bank')] == ['Chase Bank']
+    assert len(search('chase', limit=1)) == 1
+
+    with pytest.raises(ValueError):
+        search('--')
+
+
+@pytest.mark.usefixtures('reset_database')
+def test_build_search_index():
+    assert not has_search_index()
+    _parse_filing(FILING_ID)
+    count = build_search_index()
+    assert has_search_index()
+    # Rebuilding replaces the entries
+    assert build_search_index() == count
@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from .. import client
+from ..client import download_filing, download_filings, get_filing_ids
+from ..errors import DownloadError
+from ..server import Faults, NetfileStandIn, load_fixtures
+
+FILINGS = {str(filing_id): f'<filing id="{filing_id}"/>' for filing_id in range(25)}
+
+
+@pytest.fixture(name='serve')
+def serve_fixture(monkeypatch):
+    stand_ins = []
+
+    def serve(filings=None, **kwargs):
+        stand_in = NetfileStandIn(FILINGS if filings is None else filings, **kwargs)
+        stand_in.start()
+        stand_ins.append(stand_in)
+        monkeypatch.setattr(client, 'API_ROOT', stand_in.url)
+        return stand_in
+
+    yield serve
+    for stand_in in stand_ins:
+        stand_in.stop()
+
+
+def test_load_fixtures():
+    filings = load_fixtures()
+    assert '182305528' in filings
+    assert filings['182305528'].startswith('<disclosure')
+
+
+def test_list_pages(serve):
+    stand_in = serve(page_size=10)
+
+    assert get_filing_ids(254) == set(FILINGS)
+    # Three full pages, and an empty one
+    assert stand_in.responses[200] == 4
+
+
+def test_download(serve):
+    serve()
+    assert download_filing('3') == FILINGS['3']
+
+    with pytest.raises(DownloadError):
+        download_filing('unknown')
+
+
+def test_download_concurrently(serve):
+    stand_in = serve(faults=Faults(latency=0.05))
+
+    start = time.monotonic()
+    actual = list(download_filings(list(FILINGS), workers=8))
+    elapsed = time.monotonic() - start
+
+    assert actual == list(FILINGS.items())
+    assert stand_in.max_active > 1
+    assert elapsed < len(FILINGS) * 0.05
+
+
+def test_download_errors(serve):
+    serve(faults=Faults(error_rate=1))
+    with pytest.raises(DownloadError):
+        download_filing('3')
+
+
+def test_throttling_retried(serve, monkeypatch):
+    monkeypatch.setattr(client, 'RETRY_BACKOFF', 0.001)
+    stand_in = serve(faults=Faults(throttle_rate=0.3, retry_after=0.01))
+
+    actual = list(download_filings(list(FILINGS), workers=4))
+
+    assert actual == list(FILINGS.items())
+    assert stand_in.responses[429] > 0
+    assert stand_in.responses[200] == len(FILINGS)
+
+
+def test_concurrency_limit(serve, monkeypatch):
+    monkeypatch.setattr(client, 'RETRY_BACKOFF', 0.05)
+    stand_in = serve(faults=Faults(latency=0.02, max_concurrency=3))
+
+    assert list(download_filings(list(FILINGS), workers=4)) == list(FILINGS.items())
+    assert stand_in.responses[429] > 0
+
+
+def test_retries_exhausted(serve, monkeypatch):
+    monkeypatch.setattr(client, 'RETRY_BACKOFF', 0.001)
+    stand_in = serve(faults=Faults(throttle_rate=1))
+
+    with pytest.raises(DownloadError):
+        download_filing('3')
+    assert stand_in.responses[429] == client.MAX_RETRIES + 1
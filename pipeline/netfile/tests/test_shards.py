@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from ..models import (
+    DATABASE, Form700Filing, Office, ScheduleB, ScheduleBIncomeSource, build_tables, destroy_database,
+    get_model_classes, use_database
+)
+from ..parsers import parse_filing
+from ..shards import get_shard, merge_databases
+from .test_parsers import read_filing
+
+FILING_IDS = (
+    '177199734', '177423011', '177692551', '178032623', '178069526', '178665313', '178768108', '178774422', '181517263',
+    '182305528',
+)
+
+
+@pytest.fixture
+def restore_database():
+    yield
+    use_database(DATABASE)
+    destroy_database()
+
+
+def _snapshot():
+    # pylint: disable=protected-access
+    # NOTE: `internal_id` (and the `schedule` foreign keys referencing it) is reassigned by the merge. An office
+    # shared by several filings is stored as it appears in whichever filing was loaded first, so only the office IDs
+    # are compared.
+    snapshot = {}
+    for model in get_model_classes():
+        ignored = ('internal_id', 'schedule')
+        if model is Office:
+            ignored = tuple(field.name for field in model._meta.sorted_fields if field.name != 'id')
+
+        snapshot[model.__name__] = sorted(
+            sorted((key, str(value)) for key, value in row.__data__.items() if key not in ignored)
+            for row in model.select()
+        )
+    return snapshot
+
+
+def test_get_shard():
+    assert get_shard('182305528', 4) == get_shard('182305528', 4)
+    assert {get_shard(filing_id, 4) for filing_id in FILING_IDS} == {0, 1, 2, 3}
+    assert all(0 <= get_shard(filing_id, 3) < 3 for filing_id in FILING_IDS)
+
+
+@pytest.mark.usefixtures('restore_database')
+def test_merge_databases(tmpdir):
+    shard_count = 3
+
+    # Parse the filings serially, for comparison
+    use_database(os.path.join(str(tmpdir), 'serial.db'))
+    destroy_database()
+    build_tables()
+    for filing_id in FILING_IDS:
+        parse_filing(filing_id, read_filing(filing_id))
+    expected = _snapshot()
+
+    # Parse the filings into shards
+    shard_paths = []
+    for shard in range(shard_count):
+        path = os.path.join(str(tmpdir), f'shard-{shard}.db')
+        use_database(path, enforce_foreign_keys=False)
+        build_tables()
+        for filing_id in reversed(FILING_IDS):
+            if get_shard(filing_id, shard_count) == shard:
+                parse_filing(filing_id, read_filing(filing_id))
+        shard_paths.append(path)
+
+    use_database(os.path.join(str(tmpdir), 'merged.db'))
+    build_tables()
+    merge_databases(shard_paths)
+
+    assert _snapshot() == expected
+    assert Form700Filing.get_by_id('181517263').amends.id == '177692551'
+
+    # Nested data must still reference the right schedule after the primary keys are remapped.
+    for income_source in ScheduleBIncomeSource.select():
+        assert ScheduleB.get_by_id(income_source.schedule_id).filing_id in FILING_IDS
+    assert len(ScheduleBIncomeSource.select()) >= 1
@@ -0,0 +1,31 @@
+import pytest
+
+from ..models import Form700Filing, ScheduleA1, ScheduleB, ScheduleD
+from ..parsers import parse_filing
+from ..synthetic import SyntheticFilingGenerator, parse_schedule_counts
+
+
+def test_parse_schedule_counts():
+    assert parse_schedule_counts('a1=1000,b=10') == {'a1': 1000, 'a2': 0, 'b': 10, 'c1': 0, 'c2': 0, 'd': 0, 'e': 0}
+
+    with pytest.raises(ValueError):
+        parse_schedule_counts('z=1')
+
+
+def test_generate_is_reproducible():
+    first = list(SyntheticFilingGenerator(seed=1).generate_corpus(2))
+    second = list(SyntheticFilingGenerator(seed=1).generate_corpus(2))
+    assert first == second
+    assert first[0][1] != first[1][1]
+
+
+def test_generated_filings_parse(reset_database):  # pylint: disable=unused-argument
+    generator = SyntheticFilingGenerator()
+    schedule_counts = {'a1': 20, 'b': 3, 'd': 5}
+    for filing_id, content in generator.generate_corpus(3, schedule_counts):
+        parse_filing(filing_id, content)
+
+    assert len(Form700Filing.select()) == 3
+    assert len(ScheduleA1.select()) == 60
+    assert len(ScheduleB.select()) == 9
+    assert len(ScheduleD.select()) == 15
@@ -0,0 +1,199 @@
+"""
+This file contains a profiling mode for the scripts and cloud functions.
+
+Two profilers are available: `cprofile` records every function call of the profiled thread,
+and writes a pstats file; `sample` periodically samples the stacks of every thread (including
+the download and prefetch worker threads, which cProfile does not see), and writes a file of
+collapsed stacks that flame graph tools (e.g. flamegraph.pl or speedscope) can read.
+"""
+import contextlib
+import cProfile
+import datetime
+import functools
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+from collections import Counter
+from types import FrameType
+from typing import Callable, Dict, Iterator, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+PROFILERS = ('cprofile', 'sample')
+DEFAULT_PROFILER = 'cprofile'
+EXTENSIONS = {'cprofile': 'pstats', 'sample': 'collapsed'}
+# Set this environment variable to `cprofile` or `sample` (or `1`, for the default) to profile the cloud functions.
+PROFILE_ENVIRONMENT_VARIABLE = 'PIPELINE_PROFILE'
+PROFILE_DIRECTORY = '/tmp'
+SAMPLE_INTERVAL = 0.005  # seconds
+TOP_FUNCTIONS = 15
+
+# Functions that mark the stages of the pipeline, by name, and the module in which they are defined
+STAGES: Dict[str, Tuple[str, str]] = {
+    'list pages': ('client.py', 'iter_filing_ids'),
+    'download': ('client.py', 'download_filing'),
+    'parse': ('parsers.py', 'parse_filing'),
+    'merge': ('shards.py', 'merge_databases'),
+    'export': ('models.py', 'iter_csv_exports'),
+    'load': ('bigquery.py', 'refresh_model_data'),
+}
+
+
+def _get_profiler_name(value: Optional[str]) -> Optional[str]:
+    """ Returns the profiler selected by a flag or environment variable value, or None if profiling is disabled. """
+    if not value or value.lower() in ('0', 'false', 'off'):
+        return None
+    if value.lower() in ('1', 'true', 'on'):
+        return DEFAULT_PROFILER
+    if value not in PROFILERS:
+        raise ValueError(f'Unknown profiler "{value}". Valid profilers: {", ".join(PROFILERS)}')
+    return value
+
+
+def _format_frame(filename: str, line: int, function: str) -> str:
+    return f'{function} ({os.path.basename(filename)}:{line})'
+
+
+class StackSampler:
+    """ Samples the stacks of all threads, other than its own, at a fixed interval. """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            for thread_id, thread_frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if thread_id == self._thread.ident:
+                    continue
+
+                stack = []
+                frame: Optional[FrameType] = thread_frame
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(_format_frame(code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def write(self, path: str) -> None:
+        """ Writes the samples as collapsed stacks: one line per distinct stack, followed by its sample count. """
+        with open(path, 'w', encoding='utf8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+
+    def summarize(self, top: int = TOP_FUNCTIONS) -> str:
+        total = sum(self.samples.values()) or 1
+        own: Counter = Counter()
+        stages: Counter = Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for stage, (module, function) in STAGES.items():
+                if any(frame.startswith(f'{function} ({module}:') for frame in frames):
+                    stages[stage] += count
+
+        lines = ['Samples per stage (all threads):']
+        lines += [f'  {stage}: {count} ({count / total:.1%})' for stage, count in stages.most_common()]
+        lines.append(f'Top {top} functions by own samples, of {total}:')
+        lines += [f'  {count:>6} ({count / total:>6.1%})  {frame}' for frame, count in own.most_common(top)]
+        return '\n'.join(lines)
+
+
+class CallProfiler:
+    """ Wraps cProfile, which records the calls of the thread that started it. """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self) -> None:
+        self.profile.enable()
+
+    def stop(self) -> None:
+        self.profile.disable()
+
+    def write(self, path: str) -> None:
+        self.profile.dump_stats(path)
+
+    def summarize(self, top: int = TOP_FUNCTIONS) -> str:
+        stats = pstats.Stats(self.profile)
+        lines = ['Cumulative time per stage:']
+        for stage, (module, function) in STAGES.items():
+            # Each entry is keyed by (filename, line, function), and holds (calls, primitive calls, own time,
+            # cumulative time, callers).
+            cumulative_times = [
+                value[3] for (filename, _, name), value in stats.stats.items()  # type: ignore
+                if name == function and os.path.basename(filename) == module
+            ]
+            if cumulative_times:
+                lines.append(f'  {stage}: {max(cumulative_times):.3f}s')
+
+        buffer = io.StringIO()
+        stats.stream = buffer  # type: ignore
+        stats.sort_stats('tottime').print_stats(top)
+        lines.append(buffer.getvalue().strip())
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def profile(name: str, profiler_name: Optional[str] = DEFAULT_PROFILER, directory: Optional[str] = None,
+            upload: Optional[Callable[[str], None]] = None) -> Iterator[None]:
+    """ Profiles the enclosed block, writes the profile to a file, and logs a summary of the hot spots.
+
+    Args:
+        name (str): Name of the profiled run, used to name the file.
+        profiler_name (str): `cprofile` or `sample`. If None, the block is not profiled.
+        directory (str): Directory in which to write the file. Defaults to `PROFILE_DIRECTORY`.
+        upload: If set, called with the path of the file, e.g. to copy it to Cloud Storage.
+    """
+    if profiler_name is None:
+        yield
+        return
+
+    profiler: Union[CallProfiler, StackSampler] = CallProfiler() if profiler_name == 'cprofile' else StackSampler()
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        timestamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+        path = os.path.join(directory or PROFILE_DIRECTORY, f'{name}-{timestamp}.{EXTENSIONS[profiler_name]}')
+        profiler.write(path)
+        logger.info(f'Wrote the {profiler_name} profile of {name} to {path}.\n{profiler.summarize()}')
+        if upload:
+            upload(path)
+
+
+def profile_if_enabled(upload: Optional[Callable[[str], None]] = None) -> Callable[[Callable], Callable]:
+    """ Decorates a function (e.g. a cloud function entry point) to profile it when the `PIPELINE_PROFILE` environment
+    variable is set. The variable is read on each invocation. """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler_name = _get_profiler_name(os.environ.get(PROFILE_ENVIRONMENT_VARIABLE))
+            with profile(func.__name__, profiler_name, upload=upload):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def add_profile_arguments(parser) -> None:
+    """ Adds the `--profile` and `--profile-directory` arguments to a script's argument parser. """
+    parser.add_argument('--profile', nargs='?', const=DEFAULT_PROFILER, choices=PROFILERS,
+                        help=f'Profile the run, and write the profile to the profile directory. Defaults to '
+                             f'{DEFAULT_PROFILER}. The "sample" profiler samples the stacks of every thread.')
+    parser.add_argument('--profile-directory', default='.', help='Directory in which to write the profile.')
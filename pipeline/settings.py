@@ -0,0 +1,9 @@
+"""
+This file contains the settings of the deployment that the cloud functions (`main.py`) share with the local tools,
+such as the CLI and the harness. It has no dependencies, so importing it does not slow the cold starts of the
+functions.
+"""
+PROJECT_ID = 'openoakland'
+BUCKET_NAME = 'form-700-filings'
+# Number of filing IDs in each message published to `download-netfile-filing`
+DOWNLOAD_CHUNK_SIZE = 20
@@ -0,0 +1,177 @@
+"""
+This file contains the layouts used to store a run's filings in a Cloud Storage bucket.
+
+Each layout is written to in chunks (one per download invocation) and read back as a
+sequence of blobs, each of which holds one or more filings.
+"""
+import hashlib
+import json
+import logging
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type
+
+from google.cloud.exceptions import PreconditionFailed
+
+from . import metrics
+from .concurrency import bounded_map
+from .netfile.bundles import BUNDLE_EXTENSION, CONTENT_TYPE, dump_bundle, load_bundle
+from .netfile.compression import CONTENT_ENCODING, compress, decompress
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_WORKERS = 8
+DOWNLOAD_WORKERS = 8
+# Directory of the bucket holding the filings of every run, by content hash (see `ObjectFilingStore`)
+OBJECTS_DIRECTORY = 'objects'
+
+
+class FilingStore:
+    """ Base class for the ways a run's filings can be laid out in a bucket. """
+    directory_name: str
+
+    def __init__(self, bucket, directory: str):
+        self.bucket = bucket
+        self.directory = directory
+
+    @property
+    def prefix(self) -> str:
+        return f'{self.directory}/{self.directory_name}/'
+
+    def write(self, chunk: str, filings: List[Tuple[str, str]]) -> None:
+        """ Stores a chunk of filings. Writing the same chunk again overwrites it. """
+        raise NotImplementedError
+
+    def list_blobs(self, start_after: Optional[str] = None) -> Iterator[Any]:
+        """ Yields the blobs holding the run's filings, in order of their names.
+
+        Args:
+            start_after (str): If set, only blobs whose names sort after this name are returned.
+        """
+        for blob in self.bucket.list_blobs(prefix=self.prefix, start_offset=start_after):
+            if blob.name != start_after:
+                yield blob
+
+    def read(self, blob) -> List[Tuple[str, str]]:
+        """ Returns the ID and XML of each filing in the given blob. """
+        raise NotImplementedError
+
+    def shard_key(self, blob) -> str:  # pylint: disable=no-self-use
+        """ Returns the key used to assign the given blob to a processing shard. """
+        return blob.name
+
+
+class XmlFilingStore(FilingStore):
+    """ Stores each filing as its own XML blob: `{directory}/xml/{filing_id}.xml`.
+
+    Blobs are gzip-compressed, and have a `gzip` Content-Encoding, so Cloud Storage can serve them decompressed to
+    clients that do not accept gzip. Uncompressed blobs, stored by earlier runs, are read as well.
+    """
+    directory_name = 'xml'
+
+    def _upload(self, filing: Tuple[str, str]) -> None:
+        filing_id, content = filing
+        blob = self.bucket.blob(f'{self.prefix}{filing_id}.xml')
+        blob.content_encoding = CONTENT_ENCODING
+        blob.upload_from_string(compress(content), content_type='text/xml')
+
+    def write(self, chunk: str, filings: List[Tuple[str, str]]) -> None:
+        for _ in bounded_map(self._upload, filings, UPLOAD_WORKERS):
+            pass
+
+    def list_blobs(self, start_after: Optional[str] = None) -> Iterator[Any]:
+        for blob in super().list_blobs(start_after):
+            if not re.fullmatch(rf'{re.escape(self.prefix)}\d+\.xml', blob.name):
+                logger.warning(f'File name "{blob.name}" does not match the expected format')
+                continue
+            yield blob
+
+    def _get_filing_id(self, blob) -> str:
+        return blob.name[len(self.prefix):-len('.xml')]
+
+    def read(self, blob) -> List[Tuple[str, str]]:
+        return [(self._get_filing_id(blob), decompress(blob.download_as_string()))]
+
+    def shard_key(self, blob) -> str:  # pylint: disable=no-self-use
+        return self._get_filing_id(blob)
+
+
+class BundleFilingStore(FilingStore):
+    """ Stores each chunk of filings as a single bundle: `{directory}/bundles/{chunk}.jsonl.gz`. """
+    directory_name = 'bundles'
+
+    def write(self, chunk: str, filings: List[Tuple[str, str]]) -> None:
+        blob = self.bucket.blob(f'{self.prefix}{int(chunk):06d}{BUNDLE_EXTENSION}')
+        blob.upload_from_string(dump_bundle(filings), content_type=CONTENT_TYPE)
+
+    def read(self, blob) -> List[Tuple[str, str]]:
+        return list(load_bundle(blob.download_as_string()))
+
+
+def get_content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode('utf8')).hexdigest()
+
+
+class ObjectFilingStore(FilingStore):
+    """ Stores each filing once across runs, named after the hash of its content: `objects/{sha256}.xml`. Each chunk
+    of filings is written as a manifest, `{directory}/manifests/{chunk}.json`, which maps the ID of each filing in the
+    chunk to the hash of its content.
+
+    Filings that have not changed since an earlier run are not uploaded again, so the storage written by a run is
+    proportional to the number of filings that changed. Objects are compressed, as the blobs of `XmlFilingStore` are.
+    """
+    directory_name = 'manifests'
+
+    @staticmethod
+    def _get_object_name(content_hash: str) -> str:
+        return f'{OBJECTS_DIRECTORY}/{content_hash}.xml'
+
+    def _upload(self, filing: Tuple[str, str]) -> str:
+        _, content = filing
+        content_hash = get_content_hash(content)
+        name = self._get_object_name(content_hash)
+        if self.bucket.get_blob(name) is not None:
+            metrics.increment('storage_objects_reused')
+            return content_hash
+
+        blob = self.bucket.blob(name)
+        blob.content_encoding = CONTENT_ENCODING
+        try:
+            # Only create the object. If another invocation just created it, it holds the same content.
+            blob.upload_from_string(compress(content), content_type='text/xml', if_generation_match=0)
+        except PreconditionFailed:
+            metrics.increment('storage_objects_reused')
+        else:
+            metrics.increment('storage_objects_uploaded')
+        return content_hash
+
+    def write(self, chunk: str, filings: List[Tuple[str, str]]) -> None:
+        # The objects are uploaded before the manifest, so every object a manifest refers to exists.
+        content_hashes = list(bounded_map(self._upload, filings, UPLOAD_WORKERS))
+        manifest = {filing_id: content_hash for (filing_id, _), content_hash in zip(filings, content_hashes)}
+        blob = self.bucket.blob(f'{self.prefix}{int(chunk):06d}.json')
+        blob.upload_from_string(json.dumps(manifest, sort_keys=True), content_type='application/json')
+
+    def _download(self, item: Tuple[str, str]) -> Tuple[str, str]:
+        filing_id, content_hash = item
+        blob = self.bucket.blob(self._get_object_name(content_hash))
+        return filing_id, decompress(blob.download_as_string())
+
+    def read(self, blob) -> List[Tuple[str, str]]:
+        manifest = json.loads(blob.download_as_string().decode('utf8'))
+        return list(bounded_map(self._download, sorted(manifest.items()), DOWNLOAD_WORKERS))
+
+
+STORE_CLASSES: Dict[str, Type[FilingStore]] = {
+    'xml': XmlFilingStore,
+    'bundle': BundleFilingStore,
+    'objects': ObjectFilingStore,
+}
+DEFAULT_STORAGE_FORMAT = 'xml'
+
+
+def get_filing_store(storage_format: str, bucket, directory: str) -> FilingStore:
+    try:
+        store_class = STORE_CLASSES[storage_format]
+    except KeyError as e:
+        raise ValueError(f'Unknown storage format: {storage_format}') from e
+    return store_class(bucket, directory)
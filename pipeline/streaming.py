@@ -0,0 +1,201 @@
+"""
+This file contains a streaming runner, which lists, downloads, and parses filings concurrently.
+
+The stages are connected by bounded queues: the lister feeds filing IDs to a pool of download
+threads, which feed filings to the parser. A stage that gets ahead blocks on its full output
+queue until the next stage catches up, so memory use is bounded by the size of the queues, and
+a run takes roughly as long as its slowest stage, rather than the sum of all of them.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from . import metrics
+from .local import load_filing, save_filing
+from .netfile.client import DEFAULT_WORKERS, MAX_CONNECTIONS, download_filing
+from .netfile.models import build_tables, destroy_database
+from .netfile.parsers import parse_filing
+from .netfile.search import build_search_index
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 64
+# How often a blocked stage checks whether the run was stopped, in seconds
+POLL_INTERVAL = 0.1
+
+# Marks the end of a queue. Each consumer of a queue receives one.
+_DONE = object()
+
+
+class StreamingResult(NamedTuple):
+    listed: int
+    cached: int
+    downloaded: int
+    parsed: int
+    failed: List[str]
+    seconds: float
+    # Seconds each stage spent waiting on its neighbours. The stage that waits least is the bottleneck.
+    waits: Dict[str, float]
+
+
+class StreamingRunner:  # pylint: disable=too-many-instance-attributes
+    """ Lists, downloads, and parses filings concurrently, into a new intermediary database.
+
+    Args:
+        download_workers (int): Number of download threads.
+        queue_size (int): Capacity of each queue between two stages.
+        cache_directory (str): If set, each downloaded filing is also saved to this directory (see
+            `local.save_filing`), and filings already saved there are read from disk rather than downloaded.
+    """
+
+    def __init__(self, download_workers: int = DEFAULT_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 cache_directory: Optional[str] = None):
+        self.download_workers = max(min(download_workers, MAX_CONNECTIONS), 1)
+        self.cache_directory = cache_directory
+        self._filing_ids: queue.Queue = queue.Queue(queue_size)
+        self._filings: queue.Queue = queue.Queue(queue_size)
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._errors: List[BaseException] = []
+        self._counts = {'listed': 0, 'cached': 0, 'downloaded': 0, 'parsed': 0}
+        self._failed: List[str] = []
+        self._waits = {'list': 0.0, 'download': 0.0, 'parse': 0.0}
+
+    def _wait(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._waits[stage] += seconds
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def _put(self, stage: str, output: queue.Queue, item: Any) -> bool:
+        """ Puts the item on the queue, waiting while it is full. Returns False if the run was stopped. """
+        start = time.perf_counter()
+        try:
+            while not self._stopped.is_set():
+                try:
+                    output.put(item, timeout=POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            self._wait(stage, time.perf_counter() - start)
+
+    def _get(self, stage: str, source: queue.Queue) -> Any:
+        """ Gets an item from the queue, waiting while it is empty. Returns `_DONE` if the run was stopped. """
+        start = time.perf_counter()
+        try:
+            while not self._stopped.is_set():
+                try:
+                    return source.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+            return _DONE
+        finally:
+            self._wait(stage, time.perf_counter() - start)
+
+    def _list(self, filing_ids: Iterable[str]) -> None:
+        try:
+            for filing_id in filing_ids:
+                self._count('listed')
+                if not self._put('list', self._filing_ids, filing_id):
+                    return
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception('Failed to list the filings!')
+            with self._lock:
+                self._errors.append(e)
+        finally:
+            for _ in range(self.download_workers):
+                self._put('list', self._filing_ids, _DONE)
+
+    def _load(self, filing_id: str) -> str:
+        if self.cache_directory:
+            cached = load_filing(self.cache_directory, filing_id)
+            if cached is not None:
+                self._count('cached')
+                return cached
+
+        content = download_filing(filing_id)
+        self._count('downloaded')
+        if self.cache_directory:
+            save_filing(self.cache_directory, filing_id, content)
+        return content
+
+    def _download(self) -> None:
+        try:
+            while True:
+                filing_id = self._get('download', self._filing_ids)
+                if filing_id is _DONE:
+                    return
+
+                try:
+                    content = self._load(filing_id)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception(f'Failed to download filing {filing_id}!')
+                    with self._lock:
+                        self._failed.append(filing_id)
+                    continue
+
+                if not self._put('download', self._filings, (filing_id, content)):
+                    return
+        finally:
+            self._put('download', self._filings, _DONE)
+
+    def run(self, filing_ids: Iterable[str]) -> StreamingResult:
+        """ Parses the given filings into a new intermediary database, and indexes them for search.
+
+        The filing IDs are consumed lazily by a separate thread, so they may come from a slow source, e.g.
+        `netfile.client.iter_filing_ids`. Filings that fail to download are logged and skipped. Errors raised while
+        listing the filings stop the run, and are re-raised once the other stages have stopped.
+        """
+        start = time.perf_counter()
+        if self.cache_directory:
+            os.makedirs(self.cache_directory, exist_ok=True)
+
+        # Setup the intermediary database
+        destroy_database()
+        build_tables()
+
+        threads = [threading.Thread(target=self._list, args=(filing_ids,), name='stream-list', daemon=True)]
+        threads += [
+            threading.Thread(target=self._download, name=f'stream-download-{index}', daemon=True)
+            for index in range(self.download_workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        # Parse in this thread, since the database connection belongs to it.
+        try:
+            finished_workers = 0
+            while finished_workers < self.download_workers:
+                item = self._get('parse', self._filings)
+                if item is _DONE:
+                    finished_workers += 1
+                    continue
+
+                parse_filing(*item)
+                self._count('parsed')
+        finally:
+            # Stop the other stages, e.g. if parsing failed
+            self._stopped.set()
+            for thread in threads:
+                thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+        build_search_index()
+
+        for stage, seconds in self._waits.items():
+            metrics.increment('stream_wait_seconds', seconds, stage=stage)
+        result = StreamingResult(failed=sorted(self._failed), seconds=time.perf_counter() - start,
+                                 waits=dict(self._waits), **self._counts)
+        waits = ', '.join(f'{stage} {seconds:.1f}s' for stage, seconds in result.waits.items())
+        logger.info(f'Parsed {result.parsed} of {result.listed} filings in {result.seconds:.1f}s '
+                    f'({result.downloaded} downloaded, {result.cached} cached, {len(result.failed)} failed). '
+                    f'Time spent waiting by stage: {waits}.')
+        return result
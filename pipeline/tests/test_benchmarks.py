@@ -0,0 +1,34 @@
+from ..benchmarks import BenchmarkResult, compare_to_baseline, format_results, run_benchmarks
+
+
+def test_run_benchmarks():
+    results = run_benchmarks(filing_count=3, schedule_counts={'a1': 5, 'd': 2})
+    stages = {result.stage: result for result in results}
+
+    assert set(stages) == {
+        'clean_string', 'clean_datetime', 'clean_boolean', 'clean_decimal', 'parse_filing', 'export_data_to_csv',
+        'refresh_model_data',
+    }
+    assert stages['parse_filing'].filings == 3
+    assert stages['parse_filing'].statements > 0
+    # Every parsed row is exported and loaded, along with the latest filing of each of the 3 filers, a mention of an
+    # entity for each of the 21 A1 and D schedules, the 20 entities they resolve to, and the aggregates: the A1, D, and
+    # gift summaries of each filing and filer, 5 value buckets, and the gift totals of 6 sources
+    assert stages['refresh_model_data'].rows == stages['parse_filing'].rows + 3 + 21 + 20 + 9 + 9 + 5 + 6
+    assert 'parse_filing' in format_results(results)
+
+
+def test_compare_to_baseline():
+    results = [BenchmarkResult('parse_filing', 1.0, 10, 100, 120, 0, 100000)]
+    baseline = {'parse_filing': {'filings_per_second': 25.0, 'statements': 100, 'peak_memory': 50000}}
+
+    regressed = {
+        comparison.metric for comparison in compare_to_baseline(results, baseline) if comparison.regressed
+    }
+    # The peak memory doubled, but by less than the smallest regression
+    assert regressed == {'filings_per_second', 'statements'}
+
+    comparisons = compare_to_baseline(results, baseline, {'statements': 0.5}, metrics=('statements', 'peak_memory'))
+    assert [(comparison.metric, comparison.regressed) for comparison in comparisons] == [
+        ('statements', False), ('peak_memory', False),
+    ]
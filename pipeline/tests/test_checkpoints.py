@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from pipeline.checkpoints import ProcessingCheckpoint, StaleCheckpointError
+from pipeline.local_cloud import MemoryBucket
+
+
+@pytest.fixture(name='database_path')
+def database_path_fixture(tmpdir):
+    path = os.path.join(str(tmpdir), 'reporting.db')
+    with open(path, 'wb') as f:
+        f.write(b'checkpoint 1')
+    return path
+
+
+def test_save_and_restore(database_path, tmpdir):
+    bucket = MemoryBucket()
+    checkpoint = ProcessingCheckpoint(bucket, 'run')
+    checkpoint.start()
+    checkpoint.save(1, 'run/xml/1.xml', database_path)
+
+    restored_path = os.path.join(str(tmpdir), 'restored.db')
+    assert ProcessingCheckpoint(bucket, 'run').restore(1, restored_path) == 'run/xml/1.xml'
+    with open(restored_path, 'rb') as f:
+        assert f.read() == b'checkpoint 1'
+
+
+def test_restore_stale_checkpoint(database_path):
+    bucket = MemoryBucket()
+    checkpoint = ProcessingCheckpoint(bucket, 'run')
+    checkpoint.start()
+    checkpoint.save(1, 'run/xml/1.xml', database_path)
+    checkpoint.save(2, 'run/xml/2.xml', database_path)
+
+    with pytest.raises(StaleCheckpointError):
+        ProcessingCheckpoint(bucket, 'run').restore(1, database_path)
+
+    with pytest.raises(StaleCheckpointError):
+        ProcessingCheckpoint(bucket, 'other-run').restore(1, database_path)
+
+
+def test_save_after_another_invocation(database_path, tmpdir):
+    bucket = MemoryBucket()
+    checkpoint = ProcessingCheckpoint(bucket, 'run')
+    checkpoint.start()
+    checkpoint.save(1, 'run/xml/1.xml', database_path)
+
+    # Two invocations continue from the same checkpoint. Only the first to save may continue the run.
+    first = ProcessingCheckpoint(bucket, 'run')
+    second = ProcessingCheckpoint(bucket, 'run')
+    first.restore(1, database_path)
+    second.restore(1, database_path)
+    first.save(2, 'run/xml/2.xml', database_path)
+
+    # The database of the second invocation, which lost, does not replace the first's
+    with open(database_path, 'wb') as f:
+        f.write(b'checkpoint 2 of the second invocation')
+    with pytest.raises(StaleCheckpointError):
+        second.save(2, 'run/xml/3.xml', database_path)
+
+    restored_path = os.path.join(str(tmpdir), 'restored.db')
+    assert ProcessingCheckpoint(bucket, 'run').restore(2, restored_path) == 'run/xml/2.xml'
+    with open(restored_path, 'rb') as f:
+        assert f.read() == b'checkpoint 1'
+
+
+def test_start_supersedes_previous_checkpoints(database_path):
+    bucket = MemoryBucket()
+    ProcessingCheckpoint(bucket, 'run').save(1, 'run/xml/1.xml', database_path)
+
+    # Processing the run again starts a new sequence of checkpoints.
+    checkpoint = ProcessingCheckpoint(bucket, 'run')
+    checkpoint.start()
+    checkpoint.save(1, 'run/xml/3.xml', database_path)
+    assert ProcessingCheckpoint(bucket, 'run').restore(1, database_path) == 'run/xml/3.xml'
@@ -0,0 +1,178 @@
+import csv
+import datetime
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from .. import local, metrics
+from ..cli import main
+from ..netfile.models import DATABASE, use_database
+from ..netfile.synthetic import TEMPLATE_DIRECTORY
+
+FILING_IDS = ('182305528', '177199734')
+
+
+@pytest.fixture(name='restore_database')
+def restore_database_fixture():
+    yield
+    use_database(DATABASE)
+
+
+@pytest.fixture(name='fake_netfile')
+def fake_netfile_fixture(monkeypatch):
+    requests = {}
+
+    def get_filing_ids(form_type, since=None):
+        requests.update(form_type=form_type, since=since)
+        return set(FILING_IDS)
+
+    def download_filings(filing_ids, workers):
+        requests.update(filing_ids=list(filing_ids), workers=workers)
+        return ((filing_id, f'<filing id="{filing_id}"/>') for filing_id in requests['filing_ids'])
+
+    monkeypatch.setattr(local, 'get_filing_ids', get_filing_ids)
+    monkeypatch.setattr(local, 'download_filings', download_filings)
+    return requests
+
+
+def test_import_is_light():
+    """ Only the subcommands that need the BigQuery client or the harness import them. """
+    code = ('import sys, pipeline.cli; '
+            'print([name for name in ("google.cloud.bigquery", "pipeline.harness") if name in sys.modules])')
+    output = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True).stdout
+    assert output.decode('utf8').strip() == '[]'
+
+
+def test_download(tmpdir, fake_netfile):
+    cache_directory = tmpdir.mkdir('filings')
+    cache_directory.join(f'{FILING_IDS[0]}.xml').write('<cached/>')
+
+    main(['download', '--cache-dir', str(cache_directory), '--form-type', '255', '--workers', '4', '--since',
+          '2019-01-01'])
+
+    # Cached filings are not downloaded again
+    assert fake_netfile == {
+        'form_type': 255,
+        'since': datetime.date(2019, 1, 1),
+        'filing_ids': [FILING_IDS[1]],
+        'workers': 4,
+    }
+    assert dict(local.iter_filings(str(cache_directory))) == {
+        FILING_IDS[0]: '<cached/>',
+        FILING_IDS[1]: f'<filing id="{FILING_IDS[1]}"/>',
+    }
+
+
+def test_download_bundles(tmpdir, fake_netfile):
+    cache_directory = str(tmpdir.join('filings'))
+    main(['download', '--cache-dir', cache_directory, '--format', 'bundle'])
+
+    assert fake_netfile['filing_ids'] == sorted(FILING_IDS)
+    assert len(os.listdir(cache_directory)) == 1
+    assert local.get_cached_filing_ids(cache_directory) == set(FILING_IDS)
+
+    # With --refresh, cached filings are downloaded again
+    main(['download', '--cache-dir', cache_directory, '--format', 'bundle', '--refresh'])
+    assert fake_netfile['filing_ids'] == sorted(FILING_IDS)
+
+
+def test_download_archives(tmpdir, fake_netfile):
+    cache_directory = str(tmpdir.join('filings'))
+    main(['download', '--cache-dir', cache_directory, '--format', 'zip'])
+
+    assert fake_netfile['filing_ids'] == sorted(FILING_IDS)
+    assert [os.path.splitext(name)[1] for name in os.listdir(cache_directory)] == ['.zip']
+    assert dict(local.iter_filings(cache_directory)) == {
+        filing_id: f'<filing id="{filing_id}"/>' for filing_id in FILING_IDS
+    }
+
+
+def test_download_invalid_since(tmpdir):
+    with pytest.raises(SystemExit):
+        main(['download', '--cache-dir', str(tmpdir), '--since', '01/01/2019'])
+
+
+@pytest.mark.usefixtures('restore_database')
+def test_bench(capsys):
+    main(['bench', '--filings', '2', '--schedules', 'a1=3', '--json'])
+
+    results = json.loads(capsys.readouterr().out)
+    assert {result['stage'] for result in results} >= {'parse_filing', 'export_data_to_csv'}
+    assert all(result['filings'] == 2 for result in results if result['stage'] == 'parse_filing')
+
+
+@pytest.mark.usefixtures('restore_database')
+@pytest.mark.parametrize('workers', (1, 2))
+def test_parse_and_export(tmpdir, workers):
+    cache_directory = tmpdir.mkdir('filings')
+    for filing_id in FILING_IDS:
+        shutil.copy(os.path.join(TEMPLATE_DIRECTORY, f'{filing_id}.xml'), str(cache_directory))
+    database = str(tmpdir.join('reporting.db'))
+    output = str(tmpdir.join('export'))
+
+    main(['parse', '--cache-dir', str(cache_directory), '--db', database, '--workers', str(workers)])
+    main(['export', '--db', database, '--output', output])
+
+    assert os.path.exists(database)
+    with open(os.path.join(output, 'Form700Filing.csv'), encoding='utf8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(row['id'] for row in rows) == sorted(FILING_IDS)
+
+
+@pytest.mark.usefixtures('restore_database')
+def test_parse_metrics_do_not_depend_on_workers(tmpdir, caplog):
+    cache_directory = tmpdir.mkdir('filings')
+    for filing_id in FILING_IDS:
+        shutil.copy(os.path.join(TEMPLATE_DIRECTORY, f'{filing_id}.xml'), str(cache_directory))
+    caplog.set_level(logging.INFO, logger=metrics.__name__)
+
+    counters = {}
+    for workers in (1, 2):
+        # Recorded before the workers are forked
+        metrics.increment('earlier_work')
+        main(['parse', '--cache-dir', str(cache_directory), '--db', str(tmpdir.join(f'{workers}.db')),
+              '--workers', str(workers)])
+        snapshot = json.loads([record for record in caplog.records if record.name == metrics.__name__][-1].message)
+        counters[workers] = {(counter['name'], json.dumps(counter['labels'])): counter['value']
+                             for counter in snapshot['counters']}
+
+    assert counters[2] == counters[1]
+    assert counters[1][('earlier_work', '{}')] == 1
+
+
+@pytest.mark.usefixtures('restore_database')
+@pytest.mark.parametrize('workers', (1, 2))
+def test_search(tmpdir, capsys, workers):
+    cache_directory = tmpdir.mkdir('filings')
+    for filing_id in FILING_IDS:
+        shutil.copy(os.path.join(TEMPLATE_DIRECTORY, f'{filing_id}.xml'), str(cache_directory))
+    database = str(tmpdir.join('reporting.db'))
+
+    # Parsing builds the search index, even when the shards are merged
+    main(['parse', '--cache-dir', str(cache_directory), '--db', database, '--workers', str(workers)])
+    capsys.readouterr()
+    main(['search', '--db', database, '--json', 'brooks'])
+
+    results = json.loads(capsys.readouterr().out)
+    assert [(result['model'], result['filing_id']) for result in results] == [('Form700Filing', '182305528')]
+
+
+@pytest.mark.usefixtures('restore_database')
+def test_diff(tmpdir):
+    cache_directory = tmpdir.mkdir('filings')
+    shutil.copy(os.path.join(TEMPLATE_DIRECTORY, f'{FILING_IDS[0]}.xml'), str(cache_directory))
+    previous = str(tmpdir.join('previous.db'))
+    main(['parse', '--cache-dir', str(cache_directory), '--db', previous])
+
+    shutil.copy(os.path.join(TEMPLATE_DIRECTORY, f'{FILING_IDS[1]}.xml'), str(cache_directory))
+    database = str(tmpdir.join('reporting.db'))
+    main(['parse', '--cache-dir', str(cache_directory), '--db', database])
+
+    output = str(tmpdir.join('changes'))
+    main(['diff', '--previous', previous, '--db', database, '--output', output])
+    assert 'Form700Filing.jsonl.gz' in os.listdir(output)
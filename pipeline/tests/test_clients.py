@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+from pipeline import clients
+
+
+@pytest.fixture(autouse=True)
+def reset_clients():
+    clients.reset_clients()
+    yield
+    clients.reset_clients()
+
+
+def test_get_client_reuses_instance():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return object()
+
+    first = clients._get_client('test', factory)  # pylint: disable=protected-access
+    second = clients._get_client('test', factory)  # pylint: disable=protected-access
+    assert first is second
+    assert len(calls) == 1
+
+
+def test_reset_clients():
+    first = clients._get_client('test', object)  # pylint: disable=protected-access
+    clients.reset_clients()
+    second = clients._get_client('test', object)  # pylint: disable=protected-access
+    assert first is not second
+
+
+def test_get_client_nested():
+    """ Factories may get other clients, as `get_bucket` gets the storage client. """
+    # pylint: disable=protected-access
+    inner = clients._get_client('outer', lambda: clients._get_client('inner', object))
+    assert clients._get_client('inner', object) is inner
+
+
+def test_get_bucket_creates_storage_client(monkeypatch):
+    """ Getting a bucket on a cold instance creates the storage client while the registry's lock is held, which must
+    not deadlock. """
+    class StorageClient:
+        @staticmethod
+        def get_bucket(bucket_name):
+            return bucket_name
+
+    monkeypatch.setattr('google.cloud.storage.Client', StorageClient)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(clients.get_bucket('bucket')), daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive(), 'get_bucket deadlocked'
+    assert result == ['bucket']
+    assert isinstance(clients.get_storage_client(), StorageClient)
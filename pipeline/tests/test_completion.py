@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pipeline.completion import LocalCompletionTracker, StorageCompletionTracker
+from pipeline.local_cloud import MemoryBucket
+
+
+@pytest.fixture(name='tracker', params=['local', 'storage'])
+def tracker_fixture(request):
+    if request.param == 'local':
+        return LocalCompletionTracker()
+    return StorageCompletionTracker(MemoryBucket(), shard_count=4)
+
+
+def test_mark_complete(tracker):
+    tracker.start('run', 3)
+    assert not tracker.mark_complete('run', '1')
+    assert not tracker.mark_complete('run', '2')
+    assert tracker.mark_complete('run', '3')
+
+
+def test_mark_complete_ignores_duplicates(tracker):
+    tracker.start('run', 2)
+    assert not tracker.mark_complete('run', '1')
+    assert not tracker.mark_complete('run', '1')
+    assert tracker.mark_complete('run', '2')
+    assert not tracker.mark_complete('run', '1')
+
+
+def test_mark_complete_redelivered_final_item(tracker):
+    """ The item that completed the run completes it again when it is redelivered, e.g. because the fan-in step
+    failed. """
+    tracker.start('run', 2)
+    assert not tracker.mark_complete('run', '1')
+    assert tracker.mark_complete('run', '2')
+    assert tracker.mark_complete('run', '2')
+
+
+def test_mark_complete_fires_once_under_contention(tracker):
+    item_ids = [str(i) for i in range(50)]
+    tracker.start('run', len(item_ids))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda item_id: tracker.mark_complete('run', item_id), item_ids))
+
+    assert results.count(True) == 1
+
+
+def test_storage_tracker_reads_expected_count_from_bucket():
+    bucket = MemoryBucket()
+    StorageCompletionTracker(bucket).start('run', 1)
+
+    # A different instance, e.g. in another function invocation, should pick up the expected count.
+    assert StorageCompletionTracker(bucket).mark_complete('run', '1')
+
+
+def test_storage_tracker_retries_after_failure(monkeypatch):
+    """ A redelivered item completes the run if its first delivery failed before or after it was counted. """
+    tracker = StorageCompletionTracker(MemoryBucket(), shard_count=4)
+    tracker.start('run', 2)
+    assert not tracker.mark_complete('run', '1')
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('crashed')
+
+    # Fails before the item is counted
+    with monkeypatch.context() as patch:
+        patch.setattr(tracker, '_increment', fail)
+        with pytest.raises(RuntimeError):
+            tracker.mark_complete('run', '2')
+
+    # Fails after the item is counted, before the run is triggered
+    with monkeypatch.context() as patch:
+        patch.setattr(tracker, '_count', fail)
+        with pytest.raises(RuntimeError):
+            tracker.mark_complete('run', '2')
+
+    assert tracker.mark_complete('run', '2')
+    assert not tracker.mark_complete('run', '1')
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+from pipeline.concurrency import bounded_map
+
+
+def test_bounded_map_preserves_order():
+    def slow_square(value: int) -> int:
+        # Later items finish first
+        time.sleep((10 - value) / 1000)
+        return value * value
+
+    assert list(bounded_map(slow_square, range(10), workers=4)) == [value * value for value in range(10)]
+
+
+def test_bounded_map_limits_pending_items():
+    lock = threading.Lock()
+    started = []
+
+    def record(value: int) -> int:
+        with lock:
+            started.append(value)
+        return value
+
+    results = bounded_map(record, range(100), workers=2, max_pending=3)
+    assert next(results) == 0
+
+    # Only the items within the window may have been submitted.
+    time.sleep(0.05)
+    assert len(started) <= 4
+    assert list(results) == list(range(1, 100))
+
+
+def test_bounded_map_raises_errors():
+    def fail_on_three(value: int) -> int:
+        if value == 3:
+            raise ValueError(value)
+        return value
+
+    results = bounded_map(fail_on_three, range(5), workers=2)
+    assert [next(results) for _ in range(3)] == [0, 1, 2]
+    with pytest.raises(ValueError):
+        next(results)
+
+
+def test_bounded_map_throttle():
+    submitted = []
+
+    def record(value: int) -> int:
+        submitted.append(value)
+        return value
+
+    # While throttled, each result is consumed before the next item is submitted
+    results = bounded_map(record, range(10), workers=2, max_pending=5, throttle=lambda: True)
+    assert next(results) == 0
+    assert len(submitted) <= 2
+    assert list(results) == list(range(1, 10))
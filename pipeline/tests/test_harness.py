@@ -0,0 +1,116 @@
+import datetime
+from types import SimpleNamespace
+
+import pytest
+from google.cloud.exceptions import PreconditionFailed
+
+import main
+
+from ..clients import register_client
+from ..harness import run_functions
+from ..local_cloud import MemoryBucket
+from ..netfile import client
+from ..netfile.errors import DownloadError
+from ..netfile.server import Faults, load_fixtures
+
+FILING_COUNT = len(load_fixtures())
+
+
+def test_memory_bucket():
+    bucket = MemoryBucket()
+    blob = bucket.blob('run/filings.txt')
+    blob.upload_from_string('1\n2', if_generation_match=0)
+
+    with pytest.raises(PreconditionFailed):
+        bucket.blob('run/filings.txt').upload_from_string('3', if_generation_match=0)
+
+    assert bucket.get_blob('run/filings.txt').download_as_string() == b'1\n2'
+    assert [blob.name for blob in bucket.list_blobs(prefix='run/')] == ['run/filings.txt']
+    assert bucket.operations['upload'] == 2
+
+
+@pytest.mark.parametrize('attributes', (
+    {},
+    {'storage_format': 'bundle', 'chunk_size': '3'},
+    {'storage_format': 'objects', 'chunk_size': '3'},
+    {'shards': '2', 'chunk_size': '4'},
+))
+def test_run_functions(attributes):
+    report = run_functions(load_fixtures(), attributes, parallelism=4)
+
+    chunk_count = -(-FILING_COUNT // int(attributes.get('chunk_size', 20)))
+    assert report.invocations['download-all-filings'][:2] == (1, 0)
+    assert report.invocations['download-netfile-filing'][:2] == (chunk_count, 0)
+    assert report.invocations['process-netfile-filings'][:2] == (1, 0)
+    if 'shards' in attributes:
+        assert report.invocations['process-netfile-shard'][:2] == (2, 0)
+    assert report.tables['filings'] == FILING_COUNT
+    assert report.bucket_operations['upload'] > 0
+
+
+def test_run_functions_restores_clients():
+    publisher = object()
+    register_client('publisher', publisher)
+    try:
+        run_functions(load_fixtures(), parallelism=2)
+    finally:
+        assert register_client('publisher', None) is publisher
+
+
+def test_run_functions_redelivers_failures(monkeypatch):
+    download_filing = client.download_filing
+    failed = set()
+
+    def fail_once(filing_id: str) -> str:
+        if filing_id not in failed:
+            failed.add(filing_id)
+            raise DownloadError(f'Failed to download {filing_id}')
+        return download_filing(filing_id)
+
+    monkeypatch.setattr(client, 'download_filing', fail_once)
+    report = run_functions(load_fixtures(), {'chunk_size': '100'})
+
+    # The chunk fails, and is redelivered
+    assert report.invocations['download-netfile-filing'][:2] == (2, 1)
+    assert report.tables['filings'] == FILING_COUNT
+
+
+def test_run_functions_redelivers_failed_trigger(monkeypatch):
+    publish_processing = main._publish_processing  # pylint: disable=protected-access
+    failed = []
+
+    def fail_once(directory: str, **attributes: str) -> None:
+        if not failed:
+            failed.append(directory)
+            raise RuntimeError('Failed to publish')
+        publish_processing(directory, **attributes)
+
+    monkeypatch.setattr(main, '_publish_processing', fail_once)
+    report = run_functions(load_fixtures(), {'chunk_size': '100'})
+
+    # The final chunk fails to trigger processing, and is redelivered, which triggers processing again
+    assert failed
+    assert report.invocations['download-netfile-filing'][:2] == (2, 1)
+    assert report.invocations['process-netfile-filings'][:2] == (1, 0)
+    assert report.tables['filings'] == FILING_COUNT
+
+
+def test_run_functions_does_not_redeliver_listing():
+    report = run_functions(load_fixtures(), {'chunk_size': '100'}, faults=Faults(error_rate=1))
+
+    # The listing is not deployed with --retry, so it fails once and the run stops
+    assert report.invocations['download-all-filings'][:2] == (1, 1)
+    assert 'download-netfile-filing' not in report.invocations
+    assert not report.tables
+
+
+def test_expired_events_are_dropped():
+    # pylint: disable=protected-access
+    now = datetime.datetime.now(datetime.timezone.utc)
+    assert not main._is_expired(SimpleNamespace(event_id='1', timestamp=now.isoformat()))
+    assert not main._is_expired(None)
+
+    expired = SimpleNamespace(event_id='1', timestamp='2019-01-01T00:00:00.000Z')
+    assert main._is_expired(expired)
+    # The event is dropped before its data is read
+    main.download_netfile_filing({}, expired)
@@ -0,0 +1,67 @@
+import logging
+
+import pytest
+
+from ..memory import EXPORT_SPOOL_SIZE, MemoryGovernor, get_memory_usage, get_rss
+
+
+@pytest.fixture(name='rss')
+def rss_fixture(monkeypatch):
+    rss = {'value': 100 * 2 ** 20}
+    monkeypatch.setattr('pipeline.memory.get_memory_usage', lambda: rss['value'])
+    return rss
+
+
+def test_get_rss():
+    assert get_rss() > 0
+
+
+def test_get_memory_usage(monkeypatch, tmpdir):
+    usage = tmpdir.join('memory.usage_in_bytes')
+    usage.write('123456\n')
+    monkeypatch.setattr('pipeline.memory.CGROUP_USAGE_PATHS', (str(tmpdir.join('missing')), str(usage)))
+    assert get_memory_usage() == 123456
+
+    # Without cgroups, the usage is the RSS
+    monkeypatch.setattr('pipeline.memory.CGROUP_USAGE_PATHS', (str(tmpdir.join('missing')),))
+    monkeypatch.setattr('pipeline.memory.get_rss', lambda: 789)
+    assert get_memory_usage() == 789
+
+
+def test_governor_without_budget(rss):
+    governor = MemoryGovernor()
+    rss['value'] = 10 * 2 ** 30
+    assert not governor.over_budget()
+    assert governor.spool_size() == EXPORT_SPOOL_SIZE
+
+
+def test_governor_budget(rss):
+    governor = MemoryGovernor(budget=200 * 2 ** 20)
+    assert not governor.over_budget()
+    assert governor.spool_size() == EXPORT_SPOOL_SIZE
+
+    rss['value'] = 190 * 2 ** 20
+    assert not governor.over_budget()
+    assert governor.spool_size() == 5 * 2 ** 20
+
+    rss['value'] = 210 * 2 ** 20
+    assert governor.over_budget()
+    assert governor.spool_size() == 0
+    assert governor.throttled == 1
+    assert governor.peak == 210 * 2 ** 20
+
+
+def test_governor_from_environment(monkeypatch):
+    monkeypatch.setenv('PIPELINE_MEMORY_BUDGET_MB', '192')
+    assert MemoryGovernor.from_environment().budget == 192 * 2 ** 20
+
+    monkeypatch.delenv('PIPELINE_MEMORY_BUDGET_MB')
+    assert MemoryGovernor.from_environment().budget is None
+
+
+def test_governor_logs_peak(rss, caplog):
+    with caplog.at_level(logging.INFO, logger='pipeline.memory'):
+        with MemoryGovernor(budget=200 * 2 ** 20, name='test', sample_interval=0.001):
+            rss['value'] = 150 * 2 ** 20
+
+    assert 'Peak memory usage of test was 150.0 MB of a 200 MB budget.' in caplog.text
@@ -0,0 +1,85 @@
+import json
+import logging
+
+import pytest
+
+from ..metrics import MetricsRegistry, flush_metrics, registry
+
+
+def test_counters_and_histograms():
+    metrics = MetricsRegistry()
+    metrics.increment('rows_inserted', 3, model='Office')
+    metrics.increment('rows_inserted', 2, model='Office')
+    metrics.observe('bytes', 10)
+    metrics.observe('bytes', 30)
+    with metrics.timer('seconds', stage='parse'):
+        pass
+
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == [{'name': 'rows_inserted', 'labels': {'model': 'Office'}, 'value': 5}]
+    histograms = {histogram['name']: histogram for histogram in snapshot['histograms']}
+    assert histograms['bytes'] == {'name': 'bytes', 'labels': {}, 'count': 2, 'sum': 40, 'min': 10, 'max': 30}
+    assert histograms['seconds']['count'] == 1
+    assert histograms['seconds']['labels'] == {'stage': 'parse'}
+
+
+def test_merge():
+    metrics = MetricsRegistry()
+    metrics.increment('filings_parsed')
+    metrics.observe('bytes', 10)
+
+    other = MetricsRegistry()
+    other.increment('filings_parsed', 2)
+    other.observe('bytes', 5)
+    metrics.merge(other.snapshot())
+
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'][0]['value'] == 3
+    assert snapshot['histograms'][0] == {'name': 'bytes', 'labels': {}, 'count': 2, 'sum': 15, 'min': 5, 'max': 10}
+
+
+def test_flush(caplog):
+    metrics = MetricsRegistry()
+    metrics.increment('filings_parsed')
+
+    with caplog.at_level(logging.INFO, logger='pipeline.metrics'):
+        metrics.flush(function='process_netfile_filings')
+
+    entry = json.loads(caplog.records[-1].getMessage())
+    assert entry['message'] == 'metrics'
+    assert entry['function'] == 'process_netfile_filings'
+    assert entry['counters'] == [{'name': 'filings_parsed', 'labels': {}, 'value': 1}]
+    assert metrics.snapshot() == {'counters': [], 'histograms': []}
+
+
+def test_to_prometheus():
+    metrics = MetricsRegistry()
+    metrics.increment('rows_inserted', 5, model='Office')
+    metrics.observe('export_bytes', 100, table='office')
+
+    assert metrics.to_prometheus() == (
+        '# TYPE rows_inserted counter\n'
+        'rows_inserted{model="Office"} 5\n'
+        '# TYPE export_bytes summary\n'
+        'export_bytes_count{table="office"} 1\n'
+        'export_bytes_sum{table="office"} 100.0\n'
+    )
+
+
+def test_flush_metrics(caplog):
+    registry.reset()
+
+    @flush_metrics
+    def handler():
+        registry.increment('work')
+        raise ValueError
+
+    with caplog.at_level(logging.INFO, logger='pipeline.metrics'), pytest.raises(ValueError):
+        handler()
+
+    entry = json.loads(caplog.records[-1].getMessage())
+    assert entry['function'] == 'handler'
+    assert entry['status'] == 'error'
+    assert entry['counters'] == [{'name': 'work', 'labels': {}, 'value': 1}]
+    assert entry['histograms'][0]['name'] == 'invocation_seconds'
+    assert entry['histograms'][0]['labels'] == {'function': 'handler'}
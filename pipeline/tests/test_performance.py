@@ -0,0 +1,52 @@
+"""
+Performance regression test. A fixed workload is run through parsing and exporting, and its SQL statement count and
+peak memory are compared with the committed baseline. Both are deterministic. Throughput depends on the machine and
+its load, so it is only compared when `PERFORMANCE_CHECK_THROUGHPUT=1` is set, e.g. on a dedicated benchmark machine.
+
+Set `PERFORMANCE_TOLERANCE` to override the tolerance of every metric (e.g. `0.3` to allow a 30% regression), and set
+`UPDATE_PERFORMANCE_BASELINE=1` to record a new baseline after an intended change.
+"""
+import json
+import os
+
+import pytest
+
+from ..benchmarks import (
+    BASELINE_METRICS, DETERMINISTIC_METRICS, REGRESSION_FILING_COUNT, REGRESSION_REPEAT, compare_to_baseline,
+    format_comparisons, get_baseline, run_regression_workload
+)
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'performance_baseline.json')
+
+
+def _get_tolerances(baseline: dict) -> dict:
+    tolerances = baseline.get('tolerances', {})
+    override = os.environ.get('PERFORMANCE_TOLERANCE')
+    if override:
+        tolerances = {metric: float(override) for metric in BASELINE_METRICS}
+    return tolerances
+
+
+def test_performance_regression():
+    update = bool(os.environ.get('UPDATE_PERFORMANCE_BASELINE'))
+    check_throughput = bool(os.environ.get('PERFORMANCE_CHECK_THROUGHPUT'))
+    # The workload is only timed repeatedly when its throughput is recorded or compared.
+    results = run_regression_workload(REGRESSION_REPEAT if update or check_throughput else 1)
+
+    with open(BASELINE_PATH, encoding='utf8') as f:
+        baseline = json.load(f)
+
+    if update:
+        baseline.update(filings=REGRESSION_FILING_COUNT, stages=get_baseline(results))
+        with open(BASELINE_PATH, 'w', encoding='utf8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        pytest.skip(f'Updated the performance baseline at {BASELINE_PATH}.')
+
+    assert baseline['filings'] == REGRESSION_FILING_COUNT, 'The workload changed. Update the baseline.'
+
+    metrics = tuple(BASELINE_METRICS) if check_throughput else DETERMINISTIC_METRICS
+    comparisons = compare_to_baseline(results, baseline['stages'], _get_tolerances(baseline), metrics)
+    report = format_comparisons(comparisons)
+    assert not [comparison for comparison in comparisons if comparison.regressed], \
+        f'Performance regressed compared with the baseline:\n{report}'
@@ -0,0 +1,95 @@
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+import pytest
+
+from ..harness import run_functions
+from ..netfile.server import load_fixtures
+from ..profiling import STAGES, _get_profiler_name, profile, profile_if_enabled
+
+
+def parse_filing():
+    """ Stands in for the parse stage. """
+    deadline = time.monotonic() + 0.05
+    while time.monotonic() < deadline:
+        sum(range(1000))
+
+
+def test_get_profiler_name():
+    assert _get_profiler_name(None) is None
+    assert _get_profiler_name('0') is None
+    assert _get_profiler_name('1') == 'cprofile'
+    assert _get_profiler_name('sample') == 'sample'
+
+    with pytest.raises(ValueError):
+        _get_profiler_name('perf')
+
+
+def test_profile_cprofile(tmpdir, caplog):
+    with caplog.at_level(logging.INFO, logger='pipeline.profiling'):
+        with profile('run', 'cprofile', str(tmpdir)):
+            parse_filing()
+
+    path, = tmpdir.listdir()
+    assert path.basename.endswith('.pstats')
+    assert pstats.Stats(str(path)).total_calls > 0
+    assert 'Cumulative time per stage' in caplog.text
+
+
+def test_profile_sample(tmpdir, caplog):
+    with caplog.at_level(logging.INFO, logger='pipeline.profiling'):
+        with profile('run', 'sample', str(tmpdir)):
+            parse_filing()
+
+    path, = tmpdir.listdir()
+    assert path.basename.endswith('.collapsed')
+    lines = path.read().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(' ', 1)
+    assert 'parse_filing (test_profiling.py:' in stack
+    assert int(count) > 0
+    assert 'Samples per stage' in caplog.text
+
+
+def test_profile_if_enabled(monkeypatch, tmpdir):
+    monkeypatch.setattr('pipeline.profiling.PROFILE_DIRECTORY', str(tmpdir))
+    uploads = []
+
+    def handler():
+        return 'done'
+
+    decorated = profile_if_enabled(upload=uploads.append)(handler)
+
+    monkeypatch.delenv('PIPELINE_PROFILE', raising=False)
+    assert decorated() == 'done'
+    assert not uploads
+
+    monkeypatch.setenv('PIPELINE_PROFILE', 'cprofile')
+    assert decorated() == 'done'
+    assert len(uploads) == 1
+    path = uploads[0]
+    assert os.path.dirname(path) == str(tmpdir)
+    assert os.path.basename(path).startswith('handler-')
+
+
+def test_stages_are_called():
+    """ Each stage's function is called in a sharded run of the cloud functions, in some thread. """
+    called = set()
+
+    def record_call(frame, event, arg):  # pylint: disable=unused-argument
+        if event == 'call':
+            called.add((os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+
+    threading.setprofile(record_call)
+    sys.setprofile(record_call)
+    try:
+        run_functions(load_fixtures(), {'shards': '2', 'chunk_size': '4'})
+    finally:
+        sys.setprofile(None)
+        threading.setprofile(None)
+
+    assert [stage for stage, (module, function) in STAGES.items() if (module, function) not in called] == []
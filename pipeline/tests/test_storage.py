@@ -0,0 +1,81 @@
+import pytest
+
+from pipeline.local_cloud import MemoryBucket
+from pipeline.netfile.compression import is_compressed
+from pipeline.storage import BundleFilingStore, ObjectFilingStore, XmlFilingStore, get_content_hash, get_filing_store
+
+FILINGS = [('1', '<filing id="1" />'), ('2', '<filing id="2" />'), ('3', '<filing id="3" />')]
+
+
+@pytest.mark.parametrize('storage_format', ['xml', 'bundle', 'objects'])
+def test_filing_store_round_trip(storage_format):
+    store = get_filing_store(storage_format, MemoryBucket(), 'run')
+    store.write('0', FILINGS[:2])
+    store.write('1', FILINGS[2:])
+
+    actual = [filing for blob in store.list_blobs() for filing in store.read(blob)]
+    assert sorted(actual) == FILINGS
+
+
+def test_xml_filing_store_layout():
+    bucket = MemoryBucket()
+    XmlFilingStore(bucket, 'run').write('0', FILINGS)
+    assert sorted(bucket.blobs) == ['run/xml/1.xml', 'run/xml/2.xml', 'run/xml/3.xml']
+    assert all(is_compressed(blob.data) and blob.content_encoding == 'gzip' for blob in bucket.blobs.values())
+
+
+def test_xml_filing_store_reads_uncompressed_blobs():
+    """ Blobs stored by earlier runs, or decompressed by Cloud Storage while serving them, are read as is. """
+    bucket = MemoryBucket()
+    store = XmlFilingStore(bucket, 'run')
+    bucket.blob('run/xml/1.xml').upload_from_string(FILINGS[0][1])
+    assert [filing for blob in store.list_blobs() for filing in store.read(blob)] == FILINGS[:1]
+
+
+def test_xml_filing_store_skips_unexpected_blobs():
+    bucket = MemoryBucket()
+    store = XmlFilingStore(bucket, 'run')
+    store.write('0', FILINGS[:1])
+    bucket.blob('run/xml/notes.txt').upload_from_string('')
+    assert [blob.name for blob in store.list_blobs()] == ['run/xml/1.xml']
+
+
+def test_bundle_filing_store_layout():
+    bucket = MemoryBucket()
+    BundleFilingStore(bucket, 'run').write('7', FILINGS)
+    assert list(bucket.blobs) == ['run/bundles/000007.jsonl.gz']
+
+
+def test_object_filing_store_layout():
+    bucket = MemoryBucket()
+    ObjectFilingStore(bucket, 'run').write('7', FILINGS[:2])
+    assert sorted(bucket.blobs) == sorted(
+        ['run/manifests/000007.json'] + [f'objects/{get_content_hash(content)}.xml' for _, content in FILINGS[:2]])
+
+
+def test_object_filing_store_skips_unchanged_filings():
+    bucket = MemoryBucket()
+    ObjectFilingStore(bucket, 'first').write('0', FILINGS)
+    generations = {name: blob.generation for name, blob in bucket.blobs.items()}
+
+    changed = [FILINGS[0], ('2', '<filing id="2" amended="true" />'), FILINGS[2]]
+    store = ObjectFilingStore(bucket, 'second')
+    store.write('0', changed)
+
+    new_objects = {name for name in bucket.blobs if name.startswith('objects/')} - set(generations)
+    assert new_objects == {f'objects/{get_content_hash(changed[1][1])}.xml'}
+    assert all(bucket.blobs[name].generation == generation for name, generation in generations.items())
+    assert [filing for blob in store.list_blobs() for filing in store.read(blob)] == changed
+
+
+def test_get_filing_store_unknown_format():
+    with pytest.raises(ValueError) as exc_info:
+        get_filing_store('csv', MemoryBucket(), 'run')
+    assert isinstance(exc_info.value.__cause__, KeyError)
+
+
+def test_list_blobs_start_after():
+    bucket = MemoryBucket()
+    store = XmlFilingStore(bucket, 'run')
+    store.write('0', FILINGS)
+    assert [blob.name for blob in store.list_blobs(start_after='run/xml/1.xml')] == ['run/xml/2.xml', 'run/xml/3.xml']
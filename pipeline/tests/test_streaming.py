@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+
+import pytest
+
+from .. import streaming
+from ..netfile.models import DATABASE, Form700Filing, use_database
+from ..netfile.synthetic import TEMPLATE_DIRECTORY
+from ..streaming import StreamingRunner
+
+FILING_IDS = ['182305528', '177199734', '177199959', '177423011']
+
+
+def read_fixture(filing_id):
+    with open(os.path.join(TEMPLATE_DIRECTORY, f'{filing_id}.xml'), encoding='utf8') as f:
+        return f.read()
+
+
+@pytest.fixture(name='database')
+def database_fixture(tmpdir):
+    use_database(str(tmpdir.join('reporting.db')))
+    yield
+    use_database(DATABASE)
+
+
+@pytest.fixture(name='downloads')
+def downloads_fixture(monkeypatch):
+    downloads = []
+
+    def download_filing(filing_id):
+        downloads.append(filing_id)
+        if filing_id == 'missing':
+            raise ValueError(filing_id)
+        return read_fixture(filing_id)
+
+    monkeypatch.setattr(streaming, 'download_filing', download_filing)
+    return downloads
+
+
+@pytest.mark.usefixtures('database')
+def test_run(downloads):
+    result = StreamingRunner(download_workers=2, queue_size=2).run(iter(FILING_IDS + ['missing']))
+
+    assert sorted(downloads) == sorted(FILING_IDS + ['missing'])
+    assert (result.listed, result.downloaded, result.cached, result.parsed) == (5, 4, 0, 4)
+    assert result.failed == ['missing']
+    assert set(result.waits) == {'list', 'download', 'parse'}
+    assert sorted(filing.id for filing in Form700Filing.select()) == sorted(FILING_IDS)
+
+
+@pytest.mark.usefixtures('database')
+def test_run_cache(tmpdir, downloads):
+    cache_directory = tmpdir.mkdir('filings')
+    cache_directory.join(f'{FILING_IDS[0]}.xml').write(read_fixture(FILING_IDS[0]))
+
+    result = StreamingRunner(cache_directory=str(cache_directory)).run(FILING_IDS)
+
+    assert sorted(downloads) == sorted(FILING_IDS[1:])
+    assert (result.downloaded, result.cached, result.parsed) == (3, 1, 4)
+    assert sorted(path.basename for path in cache_directory.listdir()) == sorted(
+        [f'{FILING_IDS[0]}.xml'] + [f'{filing_id}.xml.gz' for filing_id in FILING_IDS[1:]])
+
+
+@pytest.mark.usefixtures('database', 'downloads')
+def test_run_streams(monkeypatch):
+    """ Filings are parsed while others are still being listed, and the lister is held back by the parser. """
+    listed = []
+    in_flight = []
+    listing_finished = threading.Event()
+    parsed_before_listing_finished = []
+
+    def iter_filing_ids():
+        for filing_id in FILING_IDS * 5:
+            listed.append(filing_id)
+            time.sleep(0.01)
+            yield filing_id
+        listing_finished.set()
+
+    def parse_filing(filing_id, content):  # pylint: disable=unused-argument
+        parsed_before_listing_finished.append(not listing_finished.is_set())
+        time.sleep(0.02)
+        in_flight.append(len(listed) - len(parsed_before_listing_finished))
+
+    monkeypatch.setattr(streaming, 'parse_filing', parse_filing)
+    result = StreamingRunner(download_workers=2, queue_size=2).run(iter_filing_ids())
+
+    assert result.parsed == 20
+    assert parsed_before_listing_finished[0]
+    # Two queues of two filings, two downloads, and one filing being listed
+    assert max(in_flight) <= 7
+
+
+@pytest.mark.usefixtures('database', 'downloads')
+def test_run_listing_error():
+    def iter_filing_ids():
+        yield FILING_IDS[0]
+        raise ValueError('Failed to list the filings')
+
+    with pytest.raises(ValueError):
+        StreamingRunner(download_workers=2).run(iter_filing_ids())
@@ -1,36 +1,39 @@
 #!/usr/bin/python
+import argparse
 import os
 
-from pipeline.netfile.client import download_filing, get_filing_ids
+from pipeline import metrics
+from pipeline.local import FORM_TYPE, download_to_directory
 from pipeline.netfile.models import build_tables, destroy_database
+from pipeline.profiling import add_profile_arguments, profile
 
 DIRECTORY_NAME = 'filings'
-FORM_TYPE = 254  # FPPC Form 700 Statement of Economic Interests (2018-2019)
 
 
-def _save_file(directory: str, filing_id: str, content: str) -> None:
-    file_path = os.path.join(directory, f'{filing_id}.xml')
-    with open(file_path, 'w') as output:
-        output.write(content)
-
-
-def main():
+def _download(directory: str) -> None:
     # Setup the intermediary database
     destroy_database()
     build_tables()
 
-    # Create the download directory
+    # Download the filings
+    download_to_directory(directory, FORM_TYPE, use_cache=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download all Form 700 filings. See also `python -m pipeline '
+                                                 'download`.')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='Write the metrics of the run to this file, in the Prometheus text format.')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
     directory = os.path.join(os.path.dirname(__file__), DIRECTORY_NAME)
-    if not os.path.exists(directory):
-        os.makedirs(directory)
 
-    # Get a list of filing IDs
-    filing_ids = get_filing_ids(FORM_TYPE)
+    with profile('download_form_700_data', args.profile, args.profile_directory):
+        _download(directory)
 
-    # Download the filings
-    for filing_id in filing_ids:
-        content = download_filing(filing_id)
-        _save_file(directory, filing_id, content)
+    if args.metrics:
+        metrics.write_prometheus(args.metrics)
+    metrics.flush(script='download_form_700_data')
 
 
 if __name__ == '__main__':
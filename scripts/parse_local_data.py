@@ -1,38 +1,34 @@
 #!/usr/bin/python
+import argparse
 import os
-import re
-from pathlib import Path
 
-from pipeline.netfile.models import build_tables, destroy_database
-from pipeline.netfile.parsers import parse_filing
-
-FORM_TYPE = 254  # FPPC Form 700 Statement of Economic Interests (2018-2019)
+from pipeline import metrics
+from pipeline.local import parse_directory
+from pipeline.profiling import add_profile_arguments, profile
 
 DIRECTORY_NAME = 'filings'
 
 
-def _save_file(directory: str, filing_id: str, content: str) -> None:
-    file_path = os.path.join(directory, f'{filing_id}.xml')
-    with open(file_path, 'w') as output:
-        output.write(content)
-
-
 def main():
-    # Setup the intermediary database
-    destroy_database()
-    build_tables()
-
-    # Iterate over filings
+    parser = argparse.ArgumentParser(description='Parse downloaded filings into the intermediary database. See also '
+                                                 '`python -m pipeline parse`.')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Number of processes to parse with. Each parses a share of the filings into its own '
+                             'database, and the databases are merged at the end.')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='Write the metrics of the run to this file, in the Prometheus text format.')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
     directory = os.path.join(os.path.dirname(__file__), DIRECTORY_NAME)
-    paths = Path(directory).glob('**/*.xml')
-    for path in paths:
-        match = re.search(r'(\d+)\.xml', str(path))
-        filing_id = match[1]
 
-        with open(str(path)) as f:
-            content = f.read()
+    # NOTE: With several shards, the parsing happens in worker processes, which cProfile does not see. Profile
+    # a single shard to see where parsing spends its time.
+    with profile('parse_local_data', args.profile, args.profile_directory):
+        parse_directory(directory, args.shards)
 
-        parse_filing(filing_id, content)
+    if args.metrics:
+        metrics.write_prometheus(args.metrics)
+    metrics.flush(script='parse_local_data')
 
 
 if __name__ == '__main__':